@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Command Burst Benchmark
+Replays a burst of pump/valve commands through subscriber.message_callback
+the way paho's network thread would, with a simulated serial write cost
+(wire time serialised on one port lock, then the per-command settle gap),
+and compares inline handling with the ActuatorExecutor:
+- network thread blocked: how long paho could not read, write or PING
+- completion: time until every command was written and acknowledged
+
+Usage: python -m benchmarks.command_burst [--commands 40] [--actuators 6] [--wire-ms 6] [--gap-ms 50]
+"""
+import argparse
+import threading
+import time
+
+from config import config
+from controls.executor import ActuatorExecutor
+from mqtt import subscriber
+from mqtt.serial_manager import serial_manager
+
+
+class _InlineExecutor:
+    """Runs each command on the calling thread (the previous behaviour)"""
+
+    def submit(self, key, fn, *args):
+        fn(*args)
+
+    def wait_idle(self, timeout=None):
+        return True
+
+
+def _install_fakes(wire_ms, gap_ms):
+    acks = []
+    port = threading.Lock()
+
+    def write_command(command, wait=True):
+        with port:
+            time.sleep(wire_ms / 1000)
+        time.sleep(gap_ms / 1000)
+        return True
+
+    serial_manager.connected = True
+    serial_manager.ser = object()
+    serial_manager.write_command = write_command
+    subscriber.publish = lambda topic, message, QoS=0, retain=False: acks.append(topic)
+    subscriber.print = lambda *args, **kwargs: None
+    return acks
+
+
+def _burst(commands, actuators):
+    for i in range(commands):
+        kind = "pump" if i % 2 == 0 else "valve"
+        number = (i // 2) % max(1, actuators // 2) + 1
+        yield f"mfc/{config.SERIAL_NUMBER}/{kind}/{number}", "OPEN" if i % 4 < 2 else "CLOSE"
+
+
+def run(executor, commands, actuators):
+    subscriber.command_executor = executor
+    start = time.perf_counter()
+    for topic, message in _burst(commands, actuators):
+        subscriber.message_callback(message, topic)
+    blocked = time.perf_counter() - start
+    executor.wait_idle()
+    return blocked, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--commands", type=int, default=40)
+    parser.add_argument("--actuators", type=int, default=6)
+    parser.add_argument("--wire-ms", type=float, default=6.0, help="time on the wire per command (9600 baud)")
+    parser.add_argument("--gap-ms", type=float, default=config.SERIAL_COMMAND_GAP * 1000)
+    args = parser.parse_args()
+
+    acks = _install_fakes(args.wire_ms, args.gap_ms)
+    print(f"{args.commands} commands over {args.actuators} actuators, "
+          f"{args.wire_ms:.0f} ms wire + {args.gap_ms:.0f} ms gap per command\n")
+    print(f"{'mode':<18} {'network thread blocked':>24} {'burst complete':>16} {'commands/s':>11}")
+    for name, executor in (("inline", _InlineExecutor()),
+                           ("executor (4)", ActuatorExecutor(max_workers=4))):
+        acks.clear()
+        blocked, total = run(executor, args.commands, args.actuators)
+        print(f"{name:<18} {blocked * 1000:>21.1f} ms {total * 1000:>13.1f} ms {args.commands / total:>11.1f}")
+        if len(acks) != args.commands * 2:
+            print(f"  ⚠ expected {args.commands * 2} ack/state publishes, got {len(acks)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+End-to-End Latency Benchmark
+Runs the real device code (publisher.main and subscriber.main with
+SerialManager and the mqtt_client singleton) against a pty pair standing in
+for the Arduino and a LocalBroker standing in for the cloud broker.
+No hardware or external broker required (Linux/macOS, needs a pty).
+
+Paths measured:
+  serial->mqtt    last line of a cycle written by the "Arduino" until the batch
+                  arrives on hydronew/ai/classification
+  mqtt->serial    OPEN/CLOSE published on hydroponics/<serial>/pump/N until
+                  "PN=1"/"PN=0" is read on the Arduino side
+  command->ack    same command until <topic>/ack arrives
+  burst           commands published back to back across pumps and valves,
+                  each until it reaches the serial port
+
+Usage: python -m benchmarks.e2e_latency [--samples 200] [--commands 100] [--burst 30]
+       [--full-duplex] [--json results.json]
+"""
+import argparse
+import contextlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+
+from mqtt.local_broker import start_in_thread
+from utils.latency import LatencyRecorder
+
+COMMAND_LINE = re.compile(r"^[PV]\d+=[01]$")
+SEQUENCE_FIELD = re.compile(r"dirty_water,.*?water_level:(\d+)")
+
+
+class ArduinoSide:
+    """The master end of the pty: writes stage lines, collects command lines"""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self._lock = threading.Lock()
+        self._expected = defaultdict(deque)   # command line -> deque of (sent_at, recorder)
+        self.arrived = threading.Condition(self._lock)
+        self.unexpected = 0
+        threading.Thread(target=self._read_loop, daemon=True, name="Bench-Arduino").start()
+
+    def write_cycle(self, sequence):
+        lines = (
+            f"dirty_water,ph:6.50,tds:300.00,turbidity:12.00,water_level:{sequence}\r\n"
+            "clean_water,ph:7.00,tds:120.00,turbidity:8.00,water_level:80.00\r\n"
+            "hydroponics_water,ph:6.00,tds:850.00,humidity:60.00,ec:1020.00\r\n"
+        )
+        os.write(self.fd, lines.encode())
+        return time.perf_counter()
+
+    def expect(self, line, sent_at, recorder):
+        with self._lock:
+            self._expected[line].append((sent_at, recorder))
+
+    def outstanding(self):
+        with self._lock:
+            return sum(len(pending) for pending in self._expected.values())
+
+    def wait_drained(self, timeout):
+        with self._lock:
+            return self.arrived.wait_for(lambda: not any(self._expected.values()), timeout)
+
+    def _read_loop(self):
+        buffer = b""
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+            except OSError:
+                return
+            now = time.perf_counter()
+            buffer += data
+            *lines, buffer = buffer.split(b"\n")
+            for raw in lines:
+                line = raw.decode(errors="replace").strip()
+                if not COMMAND_LINE.match(line):
+                    continue
+                with self._lock:
+                    pending = self._expected.get(line)
+                    if not pending:
+                        self.unexpected += 1
+                        continue
+                    sent_at, recorder = pending.popleft()
+                    recorder.record(now - sent_at)
+                    self.arrived.notify_all()
+
+
+class Observer:
+    """Backend-side paho client: sends commands, timestamps what the device publishes"""
+
+    def __init__(self, port, serial_number):
+        import paho.mqtt.client as mqtt
+        self.serial_number = serial_number
+        self.batch_sent = {}      # sequence -> sent_at
+        self.ack_sent = defaultdict(deque)
+        self.serial_to_mqtt = LatencyRecorder(maxlen=100_000)
+        self.command_to_ack = LatencyRecorder(maxlen=100_000)
+        self._lock = threading.Lock()
+        self.received = threading.Condition(self._lock)
+        self.client = mqtt.Client("bench-observer")
+        self.client.on_message = self._on_message
+        self.client.connect("127.0.0.1", port)
+        self.client.subscribe([("hydronew/ai/classification", 1), (f"+/{serial_number}/+/+/ack", 1)])
+        self.client.loop_start()
+
+    def _on_message(self, client, userdata, msg):
+        now = time.perf_counter()
+        with self._lock:
+            if msg.topic.endswith("/ack"):
+                pending = self.ack_sent.get(msg.topic[:-len("/ack")])
+                if pending:
+                    self.command_to_ack.record(now - pending.popleft())
+            else:
+                for match in SEQUENCE_FIELD.finditer(msg.payload.decode(errors="replace")):
+                    sent_at = self.batch_sent.pop(int(match.group(1)), None)
+                    if sent_at is not None:
+                        self.serial_to_mqtt.record(now - sent_at)
+            self.received.notify_all()
+
+    def send_command(self, topic, command, arduino, recorder):
+        line = f"{'P' if '/pump/' in topic else 'V'}{topic.rsplit('/', 1)[1]}={'1' if command == 'OPEN' else '0'}"
+        sent_at = time.perf_counter()
+        arduino.expect(line, sent_at, recorder)
+        with self._lock:
+            self.ack_sent[topic].append(sent_at)
+        self.client.publish(topic, command, qos=1)
+
+    def wait_batches(self, timeout):
+        with self._lock:
+            return self.received.wait_for(lambda: not self.batch_sent, timeout)
+
+
+def _row(name, snapshot):
+    if not snapshot["count"]:
+        return f"{name:<14} {0:>6} {'-':>9} {'-':>9} {'-':>9} {'-':>9}"
+    return (f"{name:<14} {snapshot['count']:>6} {snapshot['p50_ms']:>9.2f} {snapshot['p95_ms']:>9.2f} "
+            f"{snapshot['p99_ms']:>9.2f} {snapshot['max_ms']:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--samples", type=int, default=200, help="sensor cycles to send")
+    parser.add_argument("--period", type=float, default=0.1, help="seconds between sensor cycles")
+    parser.add_argument("--commands", type=int, default=100, help="sequential commands to send")
+    parser.add_argument("--spacing", type=float, default=0.2,
+                        help="pause between sequential commands (past SERIAL_COMMAND_GAP)")
+    parser.add_argument("--burst", type=int, default=30, help="commands sent back to back")
+    parser.add_argument("--full-duplex", action="store_true", help="SERIAL_FULL_DUPLEX=1")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    broker = start_in_thread()
+    master, slave = os.openpty()
+    # Point the device code at the pty and the local broker before config is imported
+    os.environ.update({
+        "SERIAL_PORT": os.ttyname(slave),
+        "MQTT_BROKER": "127.0.0.1",
+        "MQTT_PORT": str(broker.port),
+        "MQTT_USER": "bench",
+        "MQTT_PASSWORD": "bench",
+        "MQTT_TLS": "0",
+        "MQTT_PERSISTENT_SESSION": "0",
+        "SERIAL_FULL_DUPLEX": "1" if args.full_duplex else "0",
+        "SPOOL_ENABLED": "0",
+        "TIMESERIES_ENABLED": "0",
+        "PUBLISH_ASYNC": "0",
+    })
+
+    arduino = ArduinoSide(master)
+    devnull = open(os.devnull, "w")
+    with contextlib.redirect_stdout(devnull):
+        from config import config
+        from mqtt import mqtt_client, publisher, subscriber
+        from mqtt.serial_manager import serial_manager
+        threading.Thread(target=subscriber.main, daemon=True, name="Bench-Subscriber").start()
+        threading.Thread(target=publisher.main, daemon=True, name="Bench-Publisher").start()
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline and not (
+            mqtt_client.client is not None and mqtt_client.client.is_connected()
+        ):
+            time.sleep(0.05)
+        time.sleep(1.5)  # subscriber.main subscribes after its own 1 s settle
+
+    serial_number = config.SERIAL_NUMBER
+    observer = Observer(broker.port, serial_number)
+    time.sleep(0.3)
+    mqtt_to_serial = LatencyRecorder(maxlen=100_000)
+    burst = LatencyRecorder(maxlen=100_000)
+
+    mode = "full-duplex" if args.full_duplex else "half-duplex"
+    print(f"Serial {os.ttyname(slave)} ({mode}), broker 127.0.0.1:{broker.port}", file=sys.stderr)
+
+    with contextlib.redirect_stdout(devnull):
+        # serial -> MQTT
+        for sequence in range(args.samples):
+            # Held while writing so the observer cannot see the batch before its send time
+            with observer._lock:
+                observer.batch_sent[sequence] = arduino.write_cycle(sequence)
+            time.sleep(args.period)
+        observer.wait_batches(timeout=10)
+
+        # MQTT -> serial, one command at a time
+        for i in range(args.commands):
+            topic = f"hydroponics/{serial_number}/pump/{i % 4 + 1}"
+            observer.send_command(topic, "OPEN" if i % 8 < 4 else "CLOSE", arduino, mqtt_to_serial)
+            arduino.wait_drained(timeout=5)
+            time.sleep(args.spacing)
+
+        # Command burst across actuators
+        time.sleep(0.5)
+        topics = [f"hydroponics/{serial_number}/pump/{n}" for n in range(1, 5)]
+        topics += [f"mfc/{serial_number}/valve/{n}" for n in range(1, 3)]
+        burst_start = time.perf_counter()
+        for i in range(args.burst):
+            observer.send_command(topics[i % len(topics)], "OPEN" if i // len(topics) % 2 == 0 else "CLOSE",
+                                  arduino, burst)
+        arduino.wait_drained(timeout=30)
+        burst_time = time.perf_counter() - burst_start
+        time.sleep(0.5)
+
+    results = {
+        "mode": mode,
+        "serial_to_mqtt": observer.serial_to_mqtt.snapshot(),
+        "mqtt_to_serial": mqtt_to_serial.snapshot(),
+        "command_to_ack": observer.command_to_ack.snapshot(),
+        "burst": {**burst.snapshot(), "total_ms": round(burst_time * 1000, 2)},
+        "lost": {"batches": len(observer.batch_sent), "commands": arduino.outstanding()},
+        "serial_commands": serial_manager.command_stats(),
+        "broker": broker.stats(),
+    }
+
+    print(f"\n{'path':<14} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name in ("serial_to_mqtt", "mqtt_to_serial", "command_to_ack", "burst"):
+        print(_row(name.replace("_to_", "->"), results[name]))
+    print(f"\nburst of {args.burst} commands drained in {results['burst']['total_ms']:.1f} ms; "
+          f"lost: {results['lost']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✓ Results written to {args.json}")
+    os._exit(0)  # device threads (publisher, subscriber, serial reader) never return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Logging Overhead Benchmark
+CPU cost per sensor batch of the publisher's console output, before and after
+utils/log.py. Each batch emits what the hot path used to print:
+"Batch received", "Message published to <topic>: <payload>" and
+"1 batch(es) published".
+
+Scenarios:
+  print        the old print() calls
+  sync-info    logging at INFO (per-message lines are DEBUG), written inline
+  async-info   the default: INFO, rate-limited, bounded queue + writer thread
+  async-debug  LOG_LEVEL=DEBUG, everything logged (still rate-limited)
+
+Output goes to a `cat > /dev/null` subprocess through a pipe, like stdout
+under systemd/journald, so the sink's own work is not counted. CPU is
+process time of this process (caller plus writer thread) until the async
+queue is drained.
+
+Usage: python -m benchmarks.log_overhead [--batches 20000] [--rate 1] [--burst 10]
+       (--rate 0 turns rate limiting off to show the raw async cost)
+"""
+import argparse
+import io
+import logging
+import subprocess
+import time
+
+from utils.log import (TEXT_FORMAT, BoundedQueueHandler, DrainingQueueListener, RateLimitedLogger,
+                       RateLimiter, TextFormatter)
+
+TOPIC = "hydronew/ai/classification"
+PAYLOAD = (
+    "SN-000123\n"
+    "dirty_water,ph:6.12,tds:301.55,turbidity:12.40,water_level:55.10\n"
+    "clean_water,ph:7.02,tds:120.31,turbidity:7.85,water_level:80.42\n"
+    "hydroponics_water,ph:6.01,tds:850.77,humidity:60.12,ec:1020.55"
+)
+
+
+class CountingStream(io.TextIOBase):
+    """Text stream over a pipe that counts the characters written"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.chars = 0
+
+    def write(self, text):
+        self.chars += len(text)
+        return self.raw.write(text)
+
+    def flush(self):
+        self.raw.flush()
+
+
+def _sink():
+    proc = subprocess.Popen(["cat"], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+    return proc, CountingStream(io.TextIOWrapper(proc.stdin, line_buffering=True))
+
+
+def _run_print(batches, stream):
+    for _ in range(batches):
+        print(f"[{time.strftime('%H:%M:%S')}] Batch received from serial", file=stream)
+        print(f"[MQTT] Message published to {TOPIC}: {PAYLOAD}", file=stream)
+        print(f"[{time.strftime('%H:%M:%S')}] ✓ 1 batch(es) published to MQTT\n", file=stream)
+
+
+def _run_logging(batches, logger):
+    for _ in range(batches):
+        logger.debug("Batch received from serial")
+        logger.debug("[MQTT] Message published to %s: %s", TOPIC, PAYLOAD)
+        logger.info("✓ %d batch(es) published to MQTT", 1)
+
+
+def _make_logger(name, stream, level, async_, rate, burst):
+    """The handler chain utils.log.setup() builds, on a private logger"""
+    writer = logging.StreamHandler(stream)
+    writer.setFormatter(TextFormatter(TEXT_FORMAT))
+    listener = None
+    if async_:
+        handler = BoundedQueueHandler(1000)
+        listener = DrainingQueueListener(handler.queue, writer)
+        listener.start()
+    else:
+        handler = writer
+    logger = RateLimitedLogger(f"bench.{name}", level)
+    logger.limiter = RateLimiter(rate, burst)
+    logger.addHandler(handler)
+    logger.propagate = False
+    return logger, handler, listener
+
+
+def run_scenario(name, batches, rate, burst):
+    proc, stream = _sink()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    suppressed = dropped = 0
+    if name == "print":
+        _run_print(batches, stream)
+        caller = time.perf_counter() - wall_start
+    else:
+        level = logging.DEBUG if name == "async-debug" else logging.INFO
+        logger, handler, listener = _make_logger(
+            name, stream, level, name.startswith("async"), rate, burst)
+        _run_logging(batches, logger)
+        caller = time.perf_counter() - wall_start
+        if listener is not None:
+            listener.stop()  # drain the queue so the writer's CPU is counted
+        suppressed, dropped = logger.limiter.suppressed, getattr(handler, "dropped", 0)
+    cpu = time.process_time() - cpu_start
+    stream.flush()
+    proc.stdin.close()
+    proc.wait()
+    return {
+        "scenario": name,
+        "cpu_us": cpu / batches * 1e6,
+        "caller_us": caller / batches * 1e6,
+        "bytes": stream.chars,
+        "suppressed": suppressed,
+        "dropped": dropped,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batches", type=int, default=20000)
+    parser.add_argument("--rate", type=float, default=1.0, help="records/s per call site (0 = unlimited)")
+    parser.add_argument("--burst", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{args.batches} batches, rate limit {args.rate:g}/s burst {args.burst}\n")
+    print(f"{'scenario':<12} {'CPU us/batch':>13} {'caller us':>10} {'bytes out':>11} "
+          f"{'suppressed':>11} {'dropped':>8}")
+    baseline = None
+    for name in ("print", "sync-info", "async-info", "async-debug"):
+        r = run_scenario(name, args.batches, args.rate, args.burst)
+        baseline = baseline or r["cpu_us"]
+        print(f"{name:<12} {r['cpu_us']:>13.2f} {r['caller_us']:>10.2f} {r['bytes']:>11} "
+              f"{r['suppressed']:>11} {r['dropped']:>8}   ({r['cpu_us'] / baseline:.0%} of print)")
+
+
+if __name__ == "__main__":
+    main()
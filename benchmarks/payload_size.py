@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Payload Size/CPU Benchmark
+Compares the text and binary sensor payload formats on message size,
+encode time on the device and decode time on the classifier side
+(text decode = split lines + SampleParser, binary decode = decode_binary).
+
+Usage: python -m benchmarks.payload_size [--rounds 20000]
+"""
+import argparse
+import time
+
+from data.records import SampleParser
+from mqtt.batch_assembler import SensorBatch
+from mqtt.payload import decode_binary, encode_binary, encode_text, TEXT_PREFIX
+from simulate_serial import generate_sensor_data
+
+SERIAL_NUMBER = "BT-2025-0001"
+
+
+def _make_batches(count):
+    batches = []
+    for i in range(count):
+        records = list(generate_sensor_data())
+        batches.append(SensorBatch([r.to_line() for r in records], records, float(i), float(i)))
+    return batches
+
+
+def _decode_text(payload):
+    parser = SampleParser()
+    lines = payload.split("\n")
+    if not lines[0].startswith(TEXT_PREFIX):
+        raise ValueError("bad header")
+    return [parser.parse(line) for line in lines[1:] if line]
+
+
+def _time_us(fn, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'batches':>7} {'format':<7} {'bytes':>7} {'ratio':>6} {'encode us':>10} {'decode us':>10}")
+    for count in (1, 10, 60):
+        batches = _make_batches(count)
+        timestamps = [1760000000.0 + i for i in range(count)]
+        rounds = max(100, args.rounds // count)
+
+        text = encode_text(SERIAL_NUMBER, batches)
+        text_size = len(text.encode())
+        binary = encode_binary(SERIAL_NUMBER, batches, timestamps)
+
+        rows = (
+            ("text", text_size,
+             _time_us(lambda: encode_text(SERIAL_NUMBER, batches).encode(), rounds),
+             _time_us(lambda: _decode_text(text), rounds)),
+            ("binary", len(binary),
+             _time_us(lambda: encode_binary(SERIAL_NUMBER, batches, timestamps), rounds),
+             _time_us(lambda: decode_binary(binary), rounds)),
+        )
+        for name, size, encode_us, decode_us in rows:
+            print(f"{count:>7} {name:<7} {size:>7} {size / text_size:>6.2f} {encode_us:>10.1f} {decode_us:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
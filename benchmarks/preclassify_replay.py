@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Pre-classifier Offline Evaluation
+Replays recorded batches through PreClassifier and reports how many would
+be tagged normal / suspect / anomalous and how many would be published
+under a given forward policy.
+
+Sources:
+  --lines FILE    Arduino stage lines as read from serial (one per line);
+                  grouped into batches by stage repetition like read_batches
+  --store PATH    raw chunks of the local time-series store (data/timeseries.py);
+                  records with the same timestamp form one batch
+  --labels FILE   optional, one expected tag per batch (normal/suspect/anomalous);
+                  adds a confusion matrix and the share of labelled non-normal
+                  batches that would still be published
+
+Usage: python -m benchmarks.preclassify_replay --lines capture.txt [--normal-every 10]
+       [--ranges "ph=6:9"] [--anomaly-score 0.5] [--labels labels.txt]
+"""
+import argparse
+import sys
+import time
+
+from data.preclassifier import NORMAL, TAGS, PreClassifier, parse_ranges
+from data.records import STAGES, STAGE_SCHEMAS, make_record
+from mqtt.batch_assembler import BatchAssembler, SensorBatch
+
+
+def batches_from_lines(path):
+    # Deadline far away: only a repeated stage (or a full cycle) closes a batch
+    assembler = BatchAssembler(cycle_deadline=float("inf"))
+    with open(path) as f:
+        for number, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            batch = assembler.add(line, float(number))
+            if batch is not None:
+                yield batch
+    batch = assembler.flush()
+    if batch is not None:
+        yield batch
+
+
+def batches_from_store(path):
+    from data.timeseries import TimeSeriesStore
+    store = TimeSeriesStore(path)
+    by_time = {}
+    for stage in STAGES:
+        series = store.query(stage, start=0, end=time.time(), resolution="raw")
+        fields = STAGE_SCHEMAS[stage]
+        for index, ts in enumerate(series["t"]):
+            values = {name: series["fields"][name][index] for name in fields}
+            record = make_record(stage, **{k: v for k, v in values.items() if v is not None})
+            by_time.setdefault(ts, []).append(record)
+    for ts in sorted(by_time):
+        records = sorted(by_time[ts], key=lambda record: record.stage_id)
+        yield SensorBatch([record.to_line() for record in records], records, ts, ts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--lines")
+    source.add_argument("--store")
+    parser.add_argument("--labels")
+    parser.add_argument("--ranges", default="")
+    parser.add_argument("--anomaly-score", type=float, default=0.5)
+    parser.add_argument("--normal-every", type=int, default=1)
+    args = parser.parse_args()
+
+    classifier = PreClassifier(
+        parse_ranges(args.ranges), anomaly_score=args.anomaly_score, normal_every=args.normal_every
+    )
+    batches = list(batches_from_lines(args.lines) if args.lines else batches_from_store(args.store))
+    if not batches:
+        sys.exit("No batches to replay")
+
+    start = time.perf_counter()
+    results = [classifier.classify(batch) for batch in batches]
+    elapsed = time.perf_counter() - start
+    published = [classifier.should_forward(tag) for tag, _ in results]
+
+    total = len(batches)
+    print(f"{total} batches replayed in {elapsed * 1000:.1f} ms ({elapsed / total * 1e6:.1f} us/batch)")
+    for tag in TAGS:
+        count = classifier.counts[tag]
+        print(f"  {tag:<10} {count:>7} ({count / total:.1%})")
+    print(f"  published  {classifier.forwarded:>7} ({classifier.forwarded / total:.1%}) "
+          f"with 1 in {args.normal_every} normal batches forwarded")
+
+    if args.labels:
+        with open(args.labels) as f:
+            labels = [line.strip() for line in f if line.strip()]
+        if len(labels) != total:
+            sys.exit(f"{len(labels)} labels for {total} batches")
+        unknown = set(labels) - set(TAGS)
+        if unknown:
+            sys.exit(f"Unknown label(s): {', '.join(sorted(unknown))}")
+        matrix = {(expected, got): 0 for expected in TAGS for got in TAGS}
+        missed = flagged = 0
+        for expected, (got, _), sent in zip(labels, results, published):
+            matrix[expected, got] += 1
+            if expected != NORMAL:
+                flagged += 1
+                missed += not sent
+        print("\nlabel \\ tag " + "".join(f"{tag:>11}" for tag in TAGS))
+        for expected in TAGS:
+            print(f"{expected:<11} " + "".join(f"{matrix[expected, got]:>11}" for got in TAGS))
+        if flagged:
+            print(f"\nlabelled non-normal batches not published: {missed}/{flagged} ({missed / flagged:.1%})")
+
+
+if __name__ == "__main__":
+    main()
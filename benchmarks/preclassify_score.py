@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Pre-classifier Scoring Benchmark
+Times PreClassifier on CPU three ways:
+- per batch:  classify() on one SensorBatch, as the publisher calls it
+- vectorized: classify_many() over all batches at once (replay/backfill path)
+- python:     the same range rule written as a plain loop, for reference
+
+Usage: python -m benchmarks.preclassify_score [--batches 20000]
+"""
+import argparse
+import math
+import time
+
+import numpy as np
+
+from data.preclassifier import DEFAULT_RANGES, PreClassifier
+from mqtt.batch_assembler import SensorBatch
+from simulate_serial import generate_sensor_data
+
+
+def _make_batches(count):
+    batches = []
+    for i in range(count):
+        records = list(generate_sensor_data())
+        batches.append(SensorBatch([r.to_line() for r in records], records, float(i), float(i)))
+    return batches
+
+
+def _python_score(batch):
+    worst = 0.0
+    for record in batch.records:
+        for name, (low, high) in DEFAULT_RANGES[record.stage].items():
+            value = record.get(name)
+            if value is None or math.isnan(value):
+                continue
+            excess = max(low - value, value - high) / (high - low)
+            worst = max(worst, excess)
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batches", type=int, default=20000)
+    args = parser.parse_args()
+
+    batches = _make_batches(args.batches)
+    classifier = PreClassifier()
+
+    start = time.perf_counter()
+    for batch in batches:
+        classifier.classify(batch)
+    per_batch = (time.perf_counter() - start) / len(batches) * 1e6
+
+    start = time.perf_counter()
+    for batch in batches:
+        _python_score(batch)
+    python = (time.perf_counter() - start) / len(batches) * 1e6
+
+    # Flatten once; classify_many then scores every batch in a few array ops
+    stage_ids = np.fromiter((r.stage_id for b in batches for r in b.records), dtype=np.intp)
+    values = np.array([r.values for b in batches for r in b.records], dtype=np.float64)
+    starts = np.cumsum([0] + [len(b.records) for b in batches[:-1]])
+    start = time.perf_counter()
+    scores, tags = classifier.classify_many(stage_ids, values, starts)
+    vectorized = (time.perf_counter() - start) / len(batches) * 1e6
+
+    counts = np.bincount(tags, minlength=3)
+    print(f"{len(batches)} batches: normal={counts[0]} suspect={counts[1]} anomalous={counts[2]}")
+    print(f"{'method':<11} {'us/batch':>9}")
+    for name, value in (("per batch", per_batch), ("vectorized", vectorized), ("python", python)):
+        print(f"{name:<11} {value:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
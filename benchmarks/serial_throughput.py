@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Serial Framing Throughput Benchmark
+Compares per-line readline()/decode()/strip() against the bulk LineFramer
+on a pyserial loop:// port. No hardware required.
+
+The stream is written in buffer-sized pieces and only the read side is
+timed. loop:// moves bytes one at a time through a queue, so absolute
+numbers are far below a real UART driver; the per-line framing overhead
+is what the comparison shows.
+
+Usage: python -m benchmarks.serial_throughput [--lines 20000]
+"""
+import argparse
+import time
+from collections import deque
+
+import serial
+
+from mqtt.serial_framing import LineFramer
+
+SAMPLE_LINES = [
+    b"dirty_water,ph:6.12,tds:301.55,turbidity:12.40,water_level:55.10\r\n",
+    b"clean_water,ph:7.02,tds:120.31,turbidity:7.85,water_level:80.42\r\n",
+    b"hydroponics_water,ph:6.01,tds:850.77,humidity:60.12,ec:1020.55\r\n",
+    b"P1 ON\r\n",  # command acknowledgment, must be filtered
+]
+
+# loop:// keeps at most this many bytes; writes beyond it block
+LOOP_BUFFER_SIZE = 4096
+
+
+def _chunks(count, limit=LOOP_BUFFER_SIZE):
+    """Yield the benchmark stream in pieces that fit the loop:// buffer"""
+    piece = bytearray()
+    for i in range(count):
+        line = SAMPLE_LINES[i % len(SAMPLE_LINES)]
+        if len(piece) + len(line) > limit:
+            yield bytes(piece)
+            piece.clear()
+        piece += line
+    if piece:
+        yield bytes(piece)
+
+
+def bench_readline(count):
+    """Baseline: the original SerialManager.read_line loop"""
+    port = serial.serial_for_url("loop://", timeout=0)
+    accepted = nbytes = 0
+    elapsed = 0.0
+    for piece in _chunks(count):
+        port.write(piece)
+        nbytes += len(piece)
+        start = time.perf_counter()
+        while True:
+            raw = port.readline()
+            if not raw:
+                break
+            line = raw.decode().strip()
+            if not line or line.endswith(" ON") or line.endswith(" OFF") or line.startswith("ERR "):
+                continue
+            accepted += 1
+        elapsed += time.perf_counter() - start
+    port.close()
+    return accepted, nbytes, elapsed
+
+
+def bench_framer(count, chunk_size):
+    """Bulk reads of whatever is waiting (capped at chunk_size) into LineFramer"""
+    port = serial.serial_for_url("loop://", timeout=0)
+    framer = LineFramer()
+    lines = deque()
+    accepted = nbytes = 0
+    elapsed = 0.0
+    for piece in _chunks(count):
+        port.write(piece)
+        nbytes += len(piece)
+        start = time.perf_counter()
+        while True:
+            waiting = port.in_waiting
+            if not waiting:
+                break
+            framer.feed(port.read(min(waiting, chunk_size)), lines)
+            accepted += len(lines)
+            lines.clear()
+        elapsed += time.perf_counter() - start
+    port.close()
+    return accepted, nbytes, elapsed
+
+
+def _report(name, accepted, nbytes, elapsed):
+    print(f"{name:<24} {accepted:>8} lines  {elapsed * 1000:>9.1f} ms  "
+          f"{accepted / elapsed:>11,.0f} lines/s  {nbytes / elapsed / 1e6:>7.2f} MB/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lines", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"loop:// throughput, {args.lines} lines written (1 in {len(SAMPLE_LINES)} is an ack)\n")
+    _report("readline()", *bench_readline(args.lines))
+    for chunk_size in (64, 512, 4096):
+        _report(f"LineFramer ({chunk_size} B)", *bench_framer(args.lines, chunk_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Spool Throughput Benchmark
+Measures store-and-forward spool put/drain rates for each SQLite sync level
+and the raw fsync cost of the target filesystem. Run it on the Pi with
+--dir pointing at the SD card to size SPOOL_SYNC and SPOOL_DRAIN_RATE.
+
+Usage: python -m benchmarks.spool_throughput [--dir var/bench] [--messages 2000]
+"""
+import argparse
+import os
+import statistics
+import time
+
+from mqtt.spool import Spool
+
+SAMPLE_MESSAGE = (
+    "device_serial_number:BT-2025-0001\n"
+    "dirty_water,ph:6.12,tds:301.55,turbidity:12.40,water_level:55.10\n"
+    "clean_water,ph:7.02,tds:120.31,turbidity:7.85,water_level:80.42\n"
+    "hydroponics_water,ph:6.01,tds:850.77,humidity:60.12,ec:1020.55"
+).encode()
+
+
+def bench_fsync(directory, rounds):
+    """Latency of write + fsync of one message-sized block"""
+    path = os.path.join(directory, "fsync.bin")
+    samples = []
+    with open(path, "wb") as f:
+        for _ in range(rounds):
+            start = time.perf_counter()
+            f.write(SAMPLE_MESSAGE)
+            f.flush()
+            os.fsync(f.fileno())
+            samples.append(time.perf_counter() - start)
+    os.remove(path)
+    return samples
+
+
+def bench_spool(directory, sync, count):
+    path = os.path.join(directory, f"spool-{sync.lower()}.db")
+    spool = Spool(path, sync=sync)
+
+    put_samples = []
+    start = time.perf_counter()
+    for _ in range(count):
+        t = time.perf_counter()
+        spool.put("hydronew/ai/classification", SAMPLE_MESSAGE, qos=1)
+        put_samples.append(time.perf_counter() - t)
+    put_elapsed = time.perf_counter() - start
+
+    # Drain the way SpoolDrainer does: peek one, ack one
+    start = time.perf_counter()
+    while len(spool):
+        rows = spool.peek(1)
+        spool.ack([rows[0][0]])
+    drain_elapsed = time.perf_counter() - start
+
+    spool.close()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    return put_samples, put_elapsed, drain_elapsed
+
+
+def _ms(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dir", default=os.path.join("var", "bench"))
+    parser.add_argument("--messages", type=int, default=2000)
+    args = parser.parse_args()
+
+    created = not os.path.isdir(args.dir)
+    os.makedirs(args.dir, exist_ok=True)
+    print(f"Spool benchmark in {os.path.abspath(args.dir)}, {args.messages} messages of {len(SAMPLE_MESSAGE)} B\n")
+
+    fsync = bench_fsync(args.dir, min(args.messages, 200))
+    print(f"raw write+fsync       mean {statistics.mean(fsync) * 1000:7.3f} ms   "
+          f"p50 {_ms(fsync, 50):7.3f} ms   p99 {_ms(fsync, 99):7.3f} ms\n")
+
+    for sync in ("OFF", "NORMAL", "FULL"):
+        puts, put_elapsed, drain_elapsed = bench_spool(args.dir, sync, args.messages)
+        print(f"synchronous={sync:<7} put {args.messages / put_elapsed:9,.0f} msg/s   "
+              f"p50 {_ms(puts, 50):7.3f} ms   p99 {_ms(puts, 99):7.3f} ms   "
+              f"drain {args.messages / drain_elapsed:9,.0f} msg/s")
+
+    if created:
+        os.rmdir(args.dir)
+
+
+if __name__ == "__main__":
+    main()
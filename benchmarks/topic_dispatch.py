@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Topic Dispatch Microbenchmark
+Routes messages through hundreds of subscription filters two ways:
+- fan-out: every callback runs for every message and checks its own filter
+  (the old _callbacks behaviour, with the filter check a handler needs)
+- trie:    TopicRouter calls only the handlers of matching filters
+
+Usage: python -m benchmarks.topic_dispatch [--devices 100] [--messages 20000]
+"""
+import argparse
+import random
+import time
+
+from paho.mqtt.client import topic_matches_sub
+
+from mqtt.topic_router import TopicRouter
+
+FILTER_TEMPLATES = (
+    "mfc/{serial}/pump/+",
+    "hydroponics/{serial}/pump/+",
+    "reservoir/{serial}/pump/+",
+    "mfc/{serial}/valve/+",
+    "biotech/{serial}/#",
+)
+
+
+def build_filters(devices):
+    return [template.format(serial=f"BT-2025-{i:04d}")
+            for i in range(devices) for template in FILTER_TEMPLATES]
+
+
+def build_topics(devices, count):
+    rng = random.Random(7)
+    topics = []
+    for _ in range(count):
+        serial = f"BT-2025-{rng.randrange(devices):04d}"
+        kind = rng.choice(("mfc/{}/pump/1", "hydroponics/{}/pump/2", "mfc/{}/valve/3",
+                           "biotech/{}/wifi/set", "other/{}/ignored"))
+        topics.append(kind.format(serial))
+    return topics
+
+
+def bench_fanout(filters, topics):
+    hits = 0
+
+    def make_callback(topic_filter):
+        def callback(message, topic):
+            nonlocal hits
+            if topic_matches_sub(topic_filter, topic):
+                hits += 1
+        return callback
+
+    callbacks = [make_callback(f) for f in filters]
+    start = time.perf_counter()
+    for topic in topics:
+        for callback in callbacks:
+            callback("OPEN", topic)
+    return hits, time.perf_counter() - start
+
+
+def bench_trie(filters, topics):
+    hits = 0
+    router = TopicRouter()
+
+    def handler(message, topic, segments):
+        nonlocal hits
+        hits += 1
+
+    for topic_filter in filters:
+        # distinct handler objects so every filter keeps its own binding
+        router.add(topic_filter, lambda m, t, s: handler(m, t, s))
+    start = time.perf_counter()
+    for topic in topics:
+        router.dispatch("OPEN", topic)
+    return hits, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=20000)
+    args = parser.parse_args()
+
+    filters = build_filters(args.devices)
+    topics = build_topics(args.devices, args.messages)
+    print(f"{len(filters)} filters, {len(topics)} messages\n")
+
+    trie_hits, trie_time = bench_trie(filters, topics)
+    fan_messages = max(1, len(topics) // 20)
+    fan_hits, fan_time = bench_fanout(filters, topics[:fan_messages])
+    fan_per_msg = fan_time / fan_messages
+    trie_per_msg = trie_time / len(topics)
+    print(f"fan-out   {fan_per_msg * 1e6:10.1f} us/message  ({fan_hits} matches in first {fan_messages})")
+    print(f"trie      {trie_per_msg * 1e6:10.1f} us/message  ({trie_hits} matches)")
+    print(f"speed-up  {fan_per_msg / trie_per_msg:10.0f}x")
+
+
+if __name__ == "__main__":
+    main()
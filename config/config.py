@@ -5,16 +5,144 @@ import json
 load_dotenv()
 
 
+def _env_flag(name, default=False):
+    """Read a boolean switch from the environment (1/true/yes/on)"""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
 MQTT_BROKER=os.getenv("MQTT_BROKER")
 MQTT_PORT=int(os.getenv("MQTT_PORT", 8883))
 MQTT_USER=os.getenv("MQTT_USER")
 MQTT_PASSWORD=os.getenv("MQTT_PASSWORD")
+MQTT_TLS=_env_flag("MQTT_TLS", True)  # off only for a local test broker
+# Persistent session: stable client id and clean_session=False, so QoS 1
+# commands sent while the Pi is reconnecting are delivered afterwards
+MQTT_PERSISTENT_SESSION=_env_flag("MQTT_PERSISTENT_SESSION")
+MQTT_CLIENT_ID=os.getenv("MQTT_CLIENT_ID")  # prefix, "-<role>" is appended; default: biotech-<serial>
+MQTT_RECONNECT_MIN_DELAY=int(os.getenv("MQTT_RECONNECT_MIN_DELAY", 1))   # seconds
+MQTT_RECONNECT_MAX_DELAY=int(os.getenv("MQTT_RECONNECT_MAX_DELAY", 30))  # seconds
 
 SERIAL_BAUD=int(os.getenv("SERIAL_BAUD", 9600))
 SERIAL_PORT=os.getenv("SERIAL_PORT")
+# Full-duplex mode: a reader thread owns the receive side and commands go
+# through a writer queue, so writes never wait behind an idle readline()
+SERIAL_FULL_DUPLEX=_env_flag("SERIAL_FULL_DUPLEX")
+SERIAL_COMMAND_GAP=float(os.getenv("SERIAL_COMMAND_GAP", 0.05))      # seconds between queued commands
+SERIAL_COMMAND_TIMEOUT=float(os.getenv("SERIAL_COMMAND_TIMEOUT", 2))  # max wait for a queued command
+# Worker threads running pump/valve commands off the MQTT network thread
+COMMAND_WORKERS=int(os.getenv("COMMAND_WORKERS", 4))
+
+# Batch assembly: a partial cycle is flushed when the silence after a line
+# exceeds BATCH_GAP_FACTOR x the learned inter-line gap (at least
+# BATCH_MIN_GAP), or BATCH_CYCLE_DEADLINE seconds after its first line
+BATCH_CYCLE_DEADLINE=float(os.getenv("BATCH_CYCLE_DEADLINE", 1.0))
+BATCH_GAP_FACTOR=float(os.getenv("BATCH_GAP_FACTOR", 3.0))
+BATCH_MIN_GAP=float(os.getenv("BATCH_MIN_GAP", 0.02))
 
 BACKEND_API_URL=os.getenv("BACKEND_API_URL")
 
+# Follow NetworkManager through one `nmcli monitor` instead of polling nmcli
+NETWORK_MONITOR=_env_flag("NETWORK_MONITOR", True)
+
+# Background Wi-Fi scan every WIFI_SCAN_INTERVAL seconds while the hotspot is
+# up; /provision, Wi-Fi connects and GET /scan use the result while it is
+# under WIFI_SCAN_MAX_AGE
+WIFI_SCAN_ENABLED=_env_flag("WIFI_SCAN_ENABLED", True)
+WIFI_SCAN_INTERVAL=float(os.getenv("WIFI_SCAN_INTERVAL", 120))
+WIFI_SCAN_MAX_AGE=float(os.getenv("WIFI_SCAN_MAX_AGE", 180))
+
+# Sensor payload encoding on hydronew/ai/classification: "text" or "binary"
+# (see mqtt/payload.py for the binary layout)
+PAYLOAD_FORMAT=os.getenv("PAYLOAD_FORMAT", "text").lower()
+
+# Windowed publishing: pack up to PUBLISH_WINDOW_BATCHES batches, or
+# PUBLISH_WINDOW_SECONDS of batches, into one message (1 / 0 = off)
+PUBLISH_WINDOW_BATCHES=int(os.getenv("PUBLISH_WINDOW_BATCHES", 1))
+PUBLISH_WINDOW_SECONDS=float(os.getenv("PUBLISH_WINDOW_SECONDS", 0))
+PUBLISH_WINDOW_MAX_BYTES=int(os.getenv("PUBLISH_WINDOW_MAX_BYTES", 64 * 1024))
+
+# Store-and-forward spool for sensor data while MQTT is unreachable
+SPOOL_ENABLED=_env_flag("SPOOL_ENABLED", True)
+SPOOL_PATH=os.getenv("SPOOL_PATH", os.path.join(os.path.dirname(os.path.dirname(__file__)), "var", "spool.db"))
+SPOOL_MAX_BYTES=int(os.getenv("SPOOL_MAX_BYTES", 50 * 1024 * 1024))
+SPOOL_SYNC=os.getenv("SPOOL_SYNC", "NORMAL").upper()              # NORMAL or FULL
+SPOOL_DRAIN_RATE=float(os.getenv("SPOOL_DRAIN_RATE", 5))            # messages per second
+
+# Backend calls (device registration) are stored in an outbox and retried
+# with backoff (OUTBOX_RETRY_MIN doubling up to OUTBOX_RETRY_MAX seconds)
+# until delivered, across restarts. BACKEND_PROVISION_URL overrides the
+# registration endpoint, e.g. for a local stand-in (network/local_backend.py)
+BACKEND_PROVISION_URL=os.getenv("BACKEND_PROVISION_URL")
+BACKEND_CONNECT_TIMEOUT=float(os.getenv("BACKEND_CONNECT_TIMEOUT", 5))
+BACKEND_TIMEOUT=float(os.getenv("BACKEND_TIMEOUT", 10))
+OUTBOX_PATH=os.getenv("OUTBOX_PATH", os.path.join(os.path.dirname(os.path.dirname(__file__)), "var", "outbox.db"))
+OUTBOX_MAX_ATTEMPTS=int(os.getenv("OUTBOX_MAX_ATTEMPTS", 20))
+OUTBOX_MAX_AGE=float(os.getenv("OUTBOX_MAX_AGE", 24 * 3600))       # seconds
+OUTBOX_RETRY_MIN=float(os.getenv("OUTBOX_RETRY_MIN", 5))
+OUTBOX_RETRY_MAX=float(os.getenv("OUTBOX_RETRY_MAX", 600))
+
+# Asynchronous publish stage: publish() only queues, a worker thread sends.
+# PUBLISH_QUEUE_POLICY decides what happens when the queue is full:
+# drop_oldest, drop_newest, spill (to the spool) or block
+PUBLISH_ASYNC=_env_flag("PUBLISH_ASYNC")
+PUBLISH_QUEUE_SIZE=int(os.getenv("PUBLISH_QUEUE_SIZE", 1000))
+PUBLISH_QUEUE_POLICY=os.getenv("PUBLISH_QUEUE_POLICY", "drop_oldest").lower()
+MQTT_MAX_INFLIGHT=int(os.getenv("MQTT_MAX_INFLIGHT", 20))
+
+# Rolling per-stage statistics (needs numpy), published as JSON to
+# biotech/<serial>/stats every STATS_INTERVAL seconds
+STATS_ENABLED=_env_flag("STATS_ENABLED")
+STATS_WINDOW=int(os.getenv("STATS_WINDOW", 120))                   # samples per stage
+STATS_INTERVAL=float(os.getenv("STATS_INTERVAL", 60))              # seconds
+
+# Report-by-exception: only publish stage lines whose fields moved beyond
+# their deadband, e.g. DEADBAND_THRESHOLDS="ph=0.05,tds=2%,clean_water.turbidity=0.5"
+# (absolute or percentage; stage.field overrides field). A stage line is
+# sent anyway after DEADBAND_MAX_SILENCE seconds without one.
+DEADBAND_ENABLED=_env_flag("DEADBAND_ENABLED")
+DEADBAND_DEFAULT=os.getenv("DEADBAND_DEFAULT", "1%")
+DEADBAND_THRESHOLDS=os.getenv("DEADBAND_THRESHOLDS", "")
+DEADBAND_MAX_SILENCE=float(os.getenv("DEADBAND_MAX_SILENCE", 300))  # seconds
+
+# Local sensor history (queried through the provision API under /timeseries)
+TIMESERIES_ENABLED=_env_flag("TIMESERIES_ENABLED", True)
+TIMESERIES_PATH=os.getenv("TIMESERIES_PATH", os.path.join(os.path.dirname(os.path.dirname(__file__)), "var", "timeseries.db"))
+TIMESERIES_CHUNK_SECONDS=float(os.getenv("TIMESERIES_CHUNK_SECONDS", 60))
+TIMESERIES_RAW_DAYS=float(os.getenv("TIMESERIES_RAW_DAYS", 7))        # full-resolution data
+TIMESERIES_MINUTE_DAYS=float(os.getenv("TIMESERIES_MINUTE_DAYS", 30)) # 1-minute rollups
+TIMESERIES_HOUR_DAYS=float(os.getenv("TIMESERIES_HOUR_DAYS", 365))    # 1-hour rollups
+TIMESERIES_MAX_BYTES=int(os.getenv("TIMESERIES_MAX_BYTES", 100 * 1024 * 1024))
+
+# Local pre-classification (needs numpy): batches are tagged normal / suspect /
+# anomalous against per-field bands (data/preclassifier.py, override with e.g.
+# PRECLASSIFY_RANGES="ph=6:9,clean_water.tds=0:250"). Only 1 in
+# PRECLASSIFY_NORMAL_EVERY normal batches is published (1 = all, 0 = none).
+PRECLASSIFY_ENABLED=_env_flag("PRECLASSIFY_ENABLED")
+PRECLASSIFY_RANGES=os.getenv("PRECLASSIFY_RANGES", "")
+PRECLASSIFY_ANOMALY_SCORE=float(os.getenv("PRECLASSIFY_ANOMALY_SCORE", 0.5))
+PRECLASSIFY_NORMAL_EVERY=int(os.getenv("PRECLASSIFY_NORMAL_EVERY", 1))
+
+# Prometheus text metrics for main.py on http://METRICS_HOST:METRICS_PORT/metrics
+# (0 disables); provision.py serves its own on GET /metrics. Unauthenticated,
+# so loopback only by default: set METRICS_HOST=0.0.0.0 to scrape remotely
+# (that includes clients on the open BIOTECH hotspot)
+METRICS_PORT=int(os.getenv("METRICS_PORT", 9108))
+METRICS_HOST=os.getenv("METRICS_HOST", "127.0.0.1")
+
+# Logging (utils/log.py). Per-message detail (each publish, each command) is
+# DEBUG. Every call site may log LOG_RATE_BURST lines back to back and
+# LOG_RATE per second after that (0 = unlimited); LOG_ASYNC writes from a
+# thread through a LOG_QUEUE_SIZE record buffer. LOG_FORMAT: text | json
+LOG_LEVEL=os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT=os.getenv("LOG_FORMAT", "text")
+LOG_ASYNC=_env_flag("LOG_ASYNC", True)
+LOG_QUEUE_SIZE=int(os.getenv("LOG_QUEUE_SIZE", 1000))
+LOG_RATE=float(os.getenv("LOG_RATE", 1))
+LOG_RATE_BURST=int(os.getenv("LOG_RATE_BURST", 10))
+
 
 # Load device info from JSON
 DEVICE_CONFIG_PATH = os.path.join(os.path.dirname(__file__), "device_config.json")
@@ -1,4 +1,7 @@
 from mqtt.serial_manager import serial_manager
+from utils import log
+
+logger = log.get_logger(__name__)
 
 def control_device(device_type, number, state):
     """
@@ -7,7 +10,7 @@ def control_device(device_type, number, state):
     Returns True if command was sent to Arduino, False otherwise.
     """
     if not serial_manager.connected:
-        print(f"⚠ Cannot control {device_type}{number}: No serial connection")
+        logger.warning("⚠ Cannot control %s%s: No serial connection", device_type, number)
         return False
     
     # Format command for Arduino: P1=1, V2=0, etc.
@@ -15,7 +18,7 @@ def control_device(device_type, number, state):
     success = serial_manager.write_command(cmd)
     
     if not success:
-        print(f"✗ Failed to send command {cmd}")
+        logger.error("✗ Failed to send command %s", cmd)
     return success
 
 def open_valve(number):
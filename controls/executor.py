@@ -0,0 +1,87 @@
+"""
+Actuator Executor - Runs device commands off the MQTT network thread
+Commands for the same actuator (e.g. pump 1) run strictly in arrival order;
+commands for different actuators run in parallel on a small thread pool
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import log
+from utils.latency import LatencyRecorder
+
+logger = log.get_logger(__name__)
+
+
+class ActuatorExecutor:
+    """
+    Keyed serial executor: one FIFO per key, at most one worker per key
+
+    queue_latency: time a command waited before it started running
+    run_time:      time the command itself took (serial write + ack publish)
+    """
+
+    def __init__(self, max_workers=4):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="Actuator")
+        self._queues = {}  # key -> deque of (fn, args, submitted_at)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self.queue_latency = LatencyRecorder()
+        self.run_time = LatencyRecorder()
+        self.submitted = 0
+        self.failed = 0
+
+    def submit(self, key, fn, *args):
+        """Queue fn(*args) behind earlier commands for the same key; returns immediately"""
+        with self._lock:
+            self.submitted += 1
+            pending = self._queues.get(key)
+            if pending is None:
+                pending = self._queues[key] = deque()
+            pending.append((fn, args, time.monotonic()))
+            if len(pending) == 1:
+                self._pool.submit(self._drain, key)
+
+    def _drain(self, key):
+        while True:
+            with self._lock:
+                fn, args, submitted_at = self._queues[key][0]
+            started = time.monotonic()
+            self.queue_latency.record(started - submitted_at)
+            try:
+                fn(*args)
+            except Exception as e:
+                self.failed += 1
+                logger.error("✗ Command for %s failed: %s", key, e)
+            self.run_time.record(time.monotonic() - started)
+            with self._lock:
+                pending = self._queues[key]
+                pending.popleft()
+                if not pending:
+                    del self._queues[key]
+                    if not self._queues:
+                        self._idle.notify_all()
+                    return
+
+    def pending(self):
+        """Number of queued or running commands"""
+        with self._lock:
+            return sum(len(q) for q in self._queues.values())
+
+    def wait_idle(self, timeout=None):
+        """Block until every queued command has run"""
+        with self._lock:
+            return self._idle.wait_for(lambda: not self._queues, timeout)
+
+    def stats(self):
+        return {
+            "submitted": self.submitted,
+            "failed": self.failed,
+            "pending": self.pending(),
+            "queue_latency": self.queue_latency.snapshot(),
+            "run_time": self.run_time.snapshot(),
+        }
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
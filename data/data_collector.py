@@ -1,14 +1,15 @@
 from mqtt.serial_manager import serial_manager
 
-def read_batches():
+def read_batches(stop_event=None):
     """
     Generator that yields complete sensor data batches from Arduino
     Uses shared serial manager to prevent port conflicts
+    stop_event: threading.Event that ends the generator
     """
     print("Listening for serial data batches...")
     
     # Delegate all batch reading to the serial manager
-    for batch in serial_manager.read_batches():
+    for batch in serial_manager.read_batches(stop_event):
         yield batch
 
 def main():
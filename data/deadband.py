@@ -0,0 +1,145 @@
+"""
+Deadband - Report-by-exception filtering of sensor records
+A stage line is forwarded only when one of its fields moved beyond its
+deadband since the last line forwarded for that stage, or when the stage
+has been silent for max_silence seconds. Everything else is suppressed
+and counted.
+"""
+import math
+import time
+
+from .records import FIELD_INDEX, STAGES, STAGE_SCHEMAS
+
+
+def parse_threshold(text):
+    """'0.05' -> (0.05, 0.0) absolute, '2%' -> (0.0, 0.02) relative"""
+    text = text.strip()
+    if text.endswith("%"):
+        return 0.0, float(text[:-1]) / 100.0
+    return float(text), 0.0
+
+
+def parse_thresholds(spec, default="0"):
+    """
+    Build per-stage thresholds from a spec like
+        "ph=0.05,tds=2%,clean_water.turbidity=0.5"
+    A bare field applies to every stage; stage.field overrides it for one
+    stage. Fields not mentioned get the default threshold.
+    Returns {stage: {field: (absolute, relative)}}
+    """
+    base = parse_threshold(default)
+    thresholds = {stage: {name: base for name in STAGE_SCHEMAS[stage]} for stage in STAGES}
+    overrides = []
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        key, sep, value = item.partition("=")
+        if not sep:
+            raise ValueError(f"Deadband threshold '{item}' is not field=value")
+        stage, _, name = key.strip().rpartition(".")
+        if stage and stage not in thresholds:
+            raise ValueError(f"Unknown stage '{stage}' in deadband threshold '{item}'")
+        if name not in FIELD_INDEX:
+            raise ValueError(f"Unknown field '{name}' in deadband threshold '{item}'")
+        overrides.append((stage, name, parse_threshold(value)))
+    # Stage-specific entries win over bare fields regardless of order
+    for stage, name, threshold in sorted(overrides, key=lambda entry: bool(entry[0])):
+        for target in ([stage] if stage else STAGES):
+            if name in thresholds[target]:
+                thresholds[target][name] = threshold
+    return thresholds
+
+
+class DeadbandFilter:
+    """
+    Per-stage, per-field deadband
+
+    thresholds:  {stage: {field: (absolute, relative)}}, see parse_thresholds;
+                 a field moves when |value - last sent| exceeds the absolute
+                 threshold or relative x |last sent| (a zero threshold
+                 forwards any change)
+    max_silence: forward a stage line anyway after this many seconds
+                 without one (0 = never)
+    """
+
+    def __init__(self, thresholds, max_silence=300):
+        self.max_silence = max_silence
+        # stage id -> [(position, absolute, relative)]
+        self._checks = [
+            [(FIELD_INDEX[name], absolute, relative)
+             for name, (absolute, relative) in thresholds[stage].items()]
+            for stage in STAGES
+        ]
+        self._last_values = [None] * len(STAGES)
+        self._last_sent = [0.0] * len(STAGES)
+        self.sent = [0] * len(STAGES)
+        self.suppressed = [0] * len(STAGES)
+        self.forced = [0] * len(STAGES)
+        self.bytes_sent = 0
+        self.bytes_suppressed = 0
+
+    def _changed(self, stage_id, values):
+        last = self._last_values[stage_id]
+        if last is None:
+            return True
+        for position, absolute, relative in self._checks[stage_id]:
+            value, previous = values[position], last[position]
+            if math.isnan(value) or math.isnan(previous):
+                if math.isnan(value) != math.isnan(previous):
+                    return True
+                continue
+            delta = abs(value - previous)
+            if delta > absolute and delta > relative * abs(previous):
+                return True
+        return False
+
+    def accept(self, record, now=None):
+        """True if the record should be published (and remember it as sent)"""
+        now = time.monotonic() if now is None else now
+        stage_id = record.stage_id
+        if not self._changed(stage_id, record.values):
+            if not self.max_silence or now - self._last_sent[stage_id] < self.max_silence:
+                self.suppressed[stage_id] += 1
+                return False
+            self.forced[stage_id] += 1
+        self._last_values[stage_id] = record.values
+        self._last_sent[stage_id] = now
+        self.sent[stage_id] += 1
+        return True
+
+    def filter_batch(self, batch, now=None):
+        """
+        The batch reduced to the lines that must be published, or None if
+        every line was suppressed
+        """
+        now = time.monotonic() if now is None else now
+        lines, records = [], []
+        for line, record in zip(batch.lines, batch.records):
+            if self.accept(record, now):
+                lines.append(line)
+                records.append(record)
+                self.bytes_sent += len(line) + 1
+            else:
+                self.bytes_suppressed += len(line) + 1
+        if not lines:
+            return None
+        if len(lines) == len(batch.lines):
+            return batch
+        return type(batch)(lines, records, batch.first_ts, batch.last_ts,
+                           tag=getattr(batch, "tag", None), score=getattr(batch, "score", None))
+
+    def stats(self):
+        sent, suppressed = sum(self.sent), sum(self.suppressed)
+        total = sent + suppressed
+        return {
+            "sent": sent,
+            "suppressed": suppressed,
+            "forced": sum(self.forced),
+            "suppression_ratio": round(suppressed / total, 4) if total else 0.0,
+            "bytes_sent": self.bytes_sent,
+            "bytes_suppressed": self.bytes_suppressed,
+            "stages": {
+                stage: {"sent": self.sent[i], "suppressed": self.suppressed[i], "forced": self.forced[i]}
+                for i, stage in enumerate(STAGES)
+            },
+        }
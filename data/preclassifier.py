@@ -0,0 +1,155 @@
+"""
+Pre-classifier - Local range scoring of sensor batches
+Each field of each stage has a normal band [low, high]. A value's score is
+its distance outside the band divided by the band width (0 inside it); a
+batch scores the maximum over its records. Batches are tagged normal
+(score 0), suspect (below anomaly_score) or anomalous, so obviously normal
+batches can be kept off hydronew/ai/classification.
+"""
+try:
+    import numpy as np
+except ImportError:  # optional dependency, pre-classification is disabled without it
+    np = None
+
+from .records import FIELD_INDEX, FIELDS, STAGES, STAGE_SCHEMAS
+
+NORMAL = "normal"
+SUSPECT = "suspect"
+ANOMALOUS = "anomalous"
+TAGS = (NORMAL, SUSPECT, ANOMALOUS)
+
+# Normal operating bands per stage and field
+DEFAULT_RANGES = {
+    "dirty_water": {"ph": (5.0, 9.0), "tds": (0, 400), "turbidity": (0, 20), "water_level": (10, 95)},
+    "clean_water": {"ph": (6.5, 8.5), "tds": (0, 300), "turbidity": (0, 10), "water_level": (10, 95)},
+    "hydroponics_water": {"ph": (5.5, 6.5), "tds": (500, 1200), "humidity": (40, 80), "ec": (800, 1300)},
+}
+
+
+def parse_ranges(spec, base=None):
+    """
+    Override bands from a spec like "ph=6:9,clean_water.tds=0:250"
+    (a bare field applies to every stage that reports it)
+    Returns {stage: {field: (low, high)}}
+    """
+    ranges = {stage: dict(fields) for stage, fields in (base or DEFAULT_RANGES).items()}
+    overrides = []
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        key, sep, value = item.partition("=")
+        low, colon, high = value.partition(":")
+        if not sep or not colon:
+            raise ValueError(f"Pre-classifier range '{item}' is not field=low:high")
+        stage, _, name = key.strip().rpartition(".")
+        if stage and stage not in STAGE_SCHEMAS:
+            raise ValueError(f"Unknown stage '{stage}' in pre-classifier range '{item}'")
+        if name not in FIELD_INDEX:
+            raise ValueError(f"Unknown field '{name}' in pre-classifier range '{item}'")
+        low, high = float(low), float(high)
+        if high <= low:
+            raise ValueError(f"Empty pre-classifier range '{item}'")
+        overrides.append((stage, name, (low, high)))
+    for stage, name, band in sorted(overrides, key=lambda entry: bool(entry[0])):
+        for target in ([stage] if stage else STAGES):
+            if name in STAGE_SCHEMAS[target]:
+                ranges.setdefault(target, {})[name] = band
+    return ranges
+
+
+class PreClassifier:
+    """
+    Vectorized range scorer
+
+    ranges:        {stage: {field: (low, high)}}, see DEFAULT_RANGES
+    anomaly_score: batches scoring at least this are anomalous (0.5 = half
+                   a band width outside the band)
+    normal_every:  forward 1 in N normal batches (1 = all, 0 = none);
+                   suspect and anomalous batches are always forwarded
+    """
+
+    def __init__(self, ranges=None, anomaly_score=0.5, normal_every=1):
+        if np is None:
+            raise RuntimeError("numpy is required for the pre-classifier")
+        ranges = ranges or DEFAULT_RANGES
+        shape = (len(STAGES), len(FIELDS))
+        # Values are scaled so each band becomes [mid - 0.5, mid + 0.5]; the
+        # score is then |value * scale - mid| - 0.5. Fields without a band
+        # get scale 0 and never score.
+        self._scale = np.zeros(shape)
+        self._mid = np.zeros(shape)
+        for stage_id, stage in enumerate(STAGES):
+            for name, (low, high) in ranges.get(stage, {}).items():
+                position = FIELD_INDEX[name]
+                self._scale[stage_id, position] = 1.0 / (high - low)
+                self._mid[stage_id, position] = (low + high) / 2.0 / (high - low)
+        self._all_stages = list(range(len(STAGES)))
+        self.anomaly_score = anomaly_score
+        self.normal_every = normal_every
+        self.counts = dict.fromkeys(TAGS, 0)
+        self.forwarded = 0
+        self.held_back = 0
+        self._normal_seen = 0
+
+    def _distance(self, stage_ids, values):
+        # |value * scale - mid| per field; > 0.5 means outside the band
+        if isinstance(stage_ids, list) and stage_ids == self._all_stages:
+            # Complete batch: rows already line up with the band tables
+            return np.abs(values * self._scale - self._mid)
+        return np.abs(values * self._scale[stage_ids] - self._mid[stage_ids])
+
+    def score_records(self, stage_ids, values):
+        """
+        Scores of many records at once
+        stage_ids: int array (n,), values: float array (n, len(FIELDS)), NaN = missing
+        """
+        distance = self._distance(stage_ids, values)
+        # NaN (missing) and in-band (negative) values both score 0
+        return np.fmax(distance - 0.5, 0.0).max(axis=1)
+
+    def score(self, batch):
+        """Score of one SensorBatch (max over its records)"""
+        records = batch.records
+        if not records:
+            return 0.0
+        stage_ids = [record.stage_id for record in records]
+        values = np.frombuffer(b"".join([record.values.tobytes() for record in records]))
+        worst = np.fmax.reduce(self._distance(stage_ids, values.reshape(len(records), -1)), axis=None)
+        # All-NaN batches reduce to NaN, which compares False
+        return float(worst) - 0.5 if worst > 0.5 else 0.0
+
+    def tag_for(self, score):
+        if score <= 0.0:
+            return NORMAL
+        return SUSPECT if score < self.anomaly_score else ANOMALOUS
+
+    def classify(self, batch):
+        """(tag, score) of one batch"""
+        score = self.score(batch)
+        return self.tag_for(score), score
+
+    def classify_many(self, stage_ids, values, batch_starts):
+        """
+        Tags of many batches from flattened records
+        batch_starts: index of each batch's first record in stage_ids/values
+        Returns (scores, tags) with one entry per batch
+        """
+        scores = np.maximum.reduceat(self.score_records(stage_ids, values), batch_starts)
+        tags = np.where(scores <= 0.0, 0, np.where(scores < self.anomaly_score, 1, 2))
+        return scores, tags
+
+    def should_forward(self, tag):
+        """Apply the forward policy and count the decision"""
+        self.counts[tag] += 1
+        forward = True
+        if tag == NORMAL:
+            self._normal_seen += 1
+            forward = bool(self.normal_every) and self._normal_seen % self.normal_every == 0
+        if forward:
+            self.forwarded += 1
+        else:
+            self.held_back += 1
+        return forward
+
+    def stats(self):
+        return {**self.counts, "forwarded": self.forwarded, "held_back": self.held_back}
@@ -0,0 +1,141 @@
+"""
+Sensor Records - Schema-driven parsing of Arduino stage lines
+Turns "dirty_water,ph:6.1,tds:300,..." into compact SensorRecord objects:
+a stage id plus a fixed-position array of floats (NaN = not reported)
+"""
+import math
+from array import array
+
+# Stage ids are positions in this tuple
+STAGES = ("dirty_water", "clean_water", "hydroponics_water")
+
+# Fixed field positions shared by every stage
+FIELDS = ("ph", "tds", "turbidity", "water_level", "ec", "humidity")
+FIELD_INDEX = {name: index for index, name in enumerate(FIELDS)}
+
+# Fields each stage reports
+STAGE_SCHEMAS = {
+    "dirty_water": ("ph", "tds", "turbidity", "water_level"),
+    "clean_water": ("ph", "tds", "turbidity", "water_level"),
+    "hydroponics_water": ("ph", "tds", "humidity", "ec"),
+}
+
+_NAN = float("nan")
+_EMPTY_VALUES = array("d", [_NAN] * len(FIELDS))
+# stage name -> (stage id, {field name: position})
+_STAGE_LOOKUP = {
+    stage: (STAGES.index(stage), {name: FIELD_INDEX[name] for name in fields})
+    for stage, fields in STAGE_SCHEMAS.items()
+}
+
+
+class SensorRecord:
+    """One stage reading: stage id and a fixed-position float array"""
+    __slots__ = ("stage_id", "values")
+
+    def __init__(self, stage_id, values=None):
+        self.stage_id = stage_id
+        self.values = array("d", _EMPTY_VALUES) if values is None else values
+
+    @property
+    def stage(self):
+        return STAGES[self.stage_id]
+
+    def get(self, field):
+        """Value of a field, or None if the stage did not report it"""
+        value = self.values[FIELD_INDEX[field]]
+        return None if math.isnan(value) else value
+
+    def as_dict(self):
+        return {
+            name: self.values[FIELD_INDEX[name]]
+            for name in STAGE_SCHEMAS[self.stage]
+            if not math.isnan(self.values[FIELD_INDEX[name]])
+        }
+
+    def to_line(self, precision=2):
+        """Format back into the Arduino line format"""
+        fields = ",".join(f"{name}:{value:.{precision}f}" for name, value in self.as_dict().items())
+        return f"{self.stage},{fields}"
+
+    def __repr__(self):
+        return f"SensorRecord({self.stage}, {self.as_dict()})"
+
+
+class SampleParser:
+    """
+    Parses stage lines into SensorRecords and counts what it rejects
+
+    A line is malformed when its stage is unknown, a field is not name:value,
+    a value is not a number, or a field is repeated. Fields that are not part
+    of the stage schema are skipped and counted. A non-finite value (a sensor
+    printing nan or inf) is stored as NaN and counted, keeping the rest of
+    the line.
+    """
+
+    def __init__(self):
+        self.parsed = 0
+        self.malformed = 0
+        self.unknown_fields = 0
+        self.missing_fields = 0
+        self.invalid_values = 0
+
+    def parse(self, line):
+        """Return a SensorRecord, or None if the line is malformed"""
+        parts = line.split(",")
+        lookup = _STAGE_LOOKUP.get(parts[0])
+        if lookup is None:
+            self.malformed += 1
+            return None
+
+        stage_id, positions = lookup
+        values = array("d", _EMPTY_VALUES)
+        seen = 0   # bit per position
+        count = 0
+        for token in parts[1:]:
+            name, sep, text = token.partition(":")
+            if not sep:
+                self.malformed += 1
+                return None
+            position = positions.get(name.strip())
+            if position is None:
+                self.unknown_fields += 1
+                continue
+            try:
+                value = float(text)
+            except ValueError:
+                self.malformed += 1
+                return None
+            bit = 1 << position
+            if seen & bit:
+                self.malformed += 1
+                return None
+            seen |= bit
+            count += 1
+            if not math.isfinite(value):
+                self.invalid_values += 1
+                continue
+            values[position] = value
+
+        if count < len(positions):
+            self.missing_fields += len(positions) - count
+        self.parsed += 1
+        return SensorRecord(stage_id, values)
+
+    def stats(self):
+        return {
+            "parsed": self.parsed,
+            "malformed": self.malformed,
+            "unknown_fields": self.unknown_fields,
+            "missing_fields": self.missing_fields,
+            "invalid_values": self.invalid_values,
+        }
+
+
+def make_record(stage, **fields):
+    """Build a SensorRecord from keyword fields, e.g. make_record("clean_water", ph=7.0)"""
+    stage_id, positions = _STAGE_LOOKUP[stage]
+    record = SensorRecord(stage_id)
+    for name, value in fields.items():
+        record.values[positions[name]] = value
+    return record
@@ -0,0 +1,137 @@
+"""
+Rolling Stats - On-device rolling statistics over sensor records
+Each stage keeps a NumPy ring buffer (window x fields). Running sums,
+sums of squares, valid counts and EWMAs are updated for all fields at once,
+so the per-sample cost does not depend on the window size; min/max are
+taken from the buffer only when a summary is requested.
+"""
+import math
+import threading
+import time
+import warnings
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency, the stats stage is disabled without it
+    np = None
+
+from .records import FIELDS, STAGES, STAGE_SCHEMAS
+
+
+class _StageWindow:
+    """Ring buffer and running aggregates for one stage"""
+
+    def __init__(self, window, nfields):
+        self.buffer = np.full((window, nfields), np.nan)
+        self.sum = np.zeros(nfields)
+        self.sumsq = np.zeros(nfields)
+        self.count = np.zeros(nfields)
+        self.ewma = np.full(nfields, np.nan)
+        self.index = 0
+        self.samples = 0
+        self.last_update = None
+
+
+class RollingStats:
+    """
+    Rolling mean/min/max/stddev/EWMA per stage and field
+
+    window:      samples kept per stage
+    ewma_alpha:  weight of the newest sample in the EWMA
+    NaN values (fields a stage does not report) are ignored everywhere.
+    """
+
+    def __init__(self, window=120, ewma_alpha=0.1):
+        if np is None:
+            raise RuntimeError("numpy is required for rolling statistics")
+        self.window = window
+        self.ewma_alpha = ewma_alpha
+        self._stages = [_StageWindow(window, len(FIELDS)) for _ in STAGES]
+        self._lock = threading.Lock()
+        self.updates = 0
+
+    def update(self, record):
+        """Add one SensorRecord (O(fields), independent of the window size)"""
+        row = np.frombuffer(record.values, dtype=np.float64)
+        with self._lock:
+            stage = self._stages[record.stage_id]
+            old = stage.buffer[stage.index]
+
+            new_valid = ~np.isnan(row)
+            old_valid = ~np.isnan(old)
+            new_values = np.where(new_valid, row, 0.0)
+            old_values = np.where(old_valid, old, 0.0)
+            stage.sum += new_values - old_values
+            stage.sumsq += new_values * new_values - old_values * old_values
+            stage.count += new_valid.astype(np.float64) - old_valid
+
+            ewma = stage.ewma
+            first = new_valid & np.isnan(ewma)
+            ewma[first] = row[first]
+            blend = new_valid & ~first
+            ewma[blend] += self.ewma_alpha * (row[blend] - ewma[blend])
+
+            stage.buffer[stage.index] = row
+            stage.index = (stage.index + 1) % self.window
+            stage.samples += 1
+            stage.last_update = time.time()
+            # Re-derive the running sums once per lap to cancel float drift
+            if stage.index == 0:
+                self._resync(stage)
+            self.updates += 1
+
+    def update_batch(self, batch):
+        for record in batch.records:
+            self.update(record)
+
+    @staticmethod
+    def _resync(stage):
+        valid = ~np.isnan(stage.buffer)
+        values = np.where(valid, stage.buffer, 0.0)
+        stage.sum = values.sum(axis=0)
+        stage.sumsq = (values * values).sum(axis=0)
+        stage.count = valid.sum(axis=0).astype(np.float64)
+
+    def summary(self):
+        """
+        {stage: {"samples", "updated_at", "fields": {field: {n, mean, min, max, std, ewma}}}}
+        Only stages with data and fields in the stage schema are included.
+        """
+        result = {}
+        with self._lock:
+            for stage_id, stage in enumerate(self._stages):
+                if not stage.samples:
+                    continue
+                filled = stage.buffer if stage.samples >= self.window else stage.buffer[:stage.index]
+                with np.errstate(all="ignore"), warnings.catch_warnings():
+                    # Fields a stage never reports are all-NaN columns
+                    warnings.simplefilter("ignore", RuntimeWarning)
+                    mins = np.nanmin(filled, axis=0) if filled.size else None
+                    maxs = np.nanmax(filled, axis=0) if filled.size else None
+                    means = stage.sum / stage.count
+                    variances = np.maximum(stage.sumsq / stage.count - means * means, 0.0)
+                fields = {}
+                for name in STAGE_SCHEMAS[STAGES[stage_id]]:
+                    position = FIELDS.index(name)
+                    n = int(stage.count[position])
+                    if not n:
+                        continue
+                    fields[name] = {
+                        "n": n,
+                        "mean": _round(means[position]),
+                        "min": _round(mins[position]),
+                        "max": _round(maxs[position]),
+                        "std": _round(math.sqrt(variances[position]) if n > 1 else 0.0),
+                        "ewma": _round(stage.ewma[position]),
+                    }
+                result[STAGES[stage_id]] = {
+                    "samples": stage.samples,
+                    "updated_at": stage.last_update,
+                    "fields": fields,
+                }
+        return result
+
+
+def _round(value, digits=4):
+    value = float(value)
+    return None if math.isnan(value) else round(value, digits)
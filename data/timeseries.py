@@ -0,0 +1,393 @@
+"""
+Time Series Store - Local history of sensor records
+Records are buffered per stage and written every chunk_seconds as one
+compressed columnar chunk (ms offsets + float32 column per field) in SQLite.
+Per-minute and per-hour rollups (n, sum, min, max) are maintained as chunks
+are written, so long-range queries never touch raw data. Old data is
+removed by age, and by size when the database exceeds max_bytes.
+
+The publisher process writes; the provision API reads the same file
+(SQLite WAL allows both at once). Data becomes visible when its chunk is
+written, i.e. at most chunk_seconds late.
+
+Offsets within a chunk are unsigned, so a chunk never spans a clock step:
+a timestamp earlier than the previous one (NTP stepping a Pi without an
+RTC back) or past chunk_seconds starts a new chunk.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from array import array
+
+from config import config
+from utils import log
+from .records import FIELD_INDEX, STAGES, STAGE_SCHEMAS
+
+logger = log.get_logger(__name__)
+
+RESOLUTIONS = (60, 3600)  # rollup bucket sizes (seconds)
+MAX_CHUNK_SPAN = (2 ** 32 - 1) / 1000  # seconds a chunk's uint32 ms offsets can cover
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS chunks (
+        stage   INTEGER NOT NULL,
+        start   REAL    NOT NULL,
+        end     REAL    NOT NULL,
+        count   INTEGER NOT NULL,
+        data    BLOB    NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS chunks_stage_start ON chunks (stage, start)",
+    """
+    CREATE TABLE IF NOT EXISTS rollups (
+        stage      INTEGER NOT NULL,
+        resolution INTEGER NOT NULL,
+        bucket     REAL    NOT NULL,
+        field      INTEGER NOT NULL,
+        n          INTEGER NOT NULL,
+        total      REAL    NOT NULL,
+        min        REAL    NOT NULL,
+        max        REAL    NOT NULL,
+        PRIMARY KEY (stage, resolution, field, bucket)
+    ) WITHOUT ROWID
+    """,
+)
+
+_UPSERT_ROLLUP = """
+INSERT INTO rollups (stage, resolution, bucket, field, n, total, min, max)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (stage, resolution, field, bucket) DO UPDATE SET
+    n = n + excluded.n,
+    total = total + excluded.total,
+    min = MIN(min, excluded.min),
+    max = MAX(max, excluded.max)
+"""
+
+# Positions of each stage's fields, in schema order (the chunk column order)
+_STAGE_POSITIONS = [[FIELD_INDEX[name] for name in STAGE_SCHEMAS[stage]] for stage in STAGES]
+
+
+def encode_chunk(start, timestamps, columns):
+    """zlib(uint32 ms offsets from start + one float32 column per field)"""
+    offsets = array("I", (int(round((ts - start) * 1000)) for ts in timestamps))
+    body = offsets.tobytes() + b"".join(array("f", column).tobytes() for column in columns)
+    return zlib.compress(body, 6)
+
+
+def decode_chunk(start, count, ncolumns, data):
+    """Inverse of encode_chunk: (timestamps, [column, ...])"""
+    body = zlib.decompress(data)
+    offsets = array("I")
+    offsets.frombytes(body[:count * 4])
+    timestamps = [start + offset / 1000.0 for offset in offsets]
+    columns = []
+    position = count * 4
+    for _ in range(ncolumns):
+        column = array("f")
+        column.frombytes(body[position:position + count * 4])
+        columns.append(column)
+        position += count * 4
+    return timestamps, columns
+
+
+class TimeSeriesStore:
+    """
+    Chunked, compressed sensor history with rollups and retention
+
+    chunk_seconds: buffered span per stage before a chunk is written
+    retention:     {"raw": s, 60: s, 3600: s} max age of raw chunks and of
+                   each rollup resolution
+    max_bytes:     database size cap; the oldest raw chunks (then minute
+                   rollups) are deleted beyond it. Freed pages are reused by
+                   SQLite, so the file stays near this size.
+    """
+
+    def __init__(self, path, chunk_seconds=60, retention=None, max_bytes=100 * 1024 * 1024):
+        self.path = path
+        self.chunk_seconds = min(chunk_seconds, MAX_CHUNK_SPAN)
+        self.retention = retention or {"raw": 7 * 86400, 60: 30 * 86400, 3600: 365 * 86400}
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            self._db.execute(statement)
+        # stage id -> (timestamps, [column per schema field])
+        self._buffers = [([], [[] for _ in positions]) for positions in _STAGE_POSITIONS]
+        self._last_retention = 0.0
+        self.records_written = 0
+        self.chunks_written = 0
+        self.bytes_written = 0
+        self.deleted_chunks = 0
+        self.records_dropped = 0
+
+    # ---------------- writing ----------------
+
+    def append(self, record, timestamp):
+        """Buffer one SensorRecord taken at unix time timestamp"""
+        timestamps, columns = self._buffers[record.stage_id]
+        values = record.values
+        with self._lock:
+            # Close the chunk before a record it cannot hold: the clock went
+            # back, or the chunk's span is used up
+            if timestamps and (timestamp < timestamps[-1] or timestamp - timestamps[0] >= self.chunk_seconds):
+                self._flush_locked()
+            timestamps.append(timestamp)
+            for column, position in zip(columns, _STAGE_POSITIONS[record.stage_id]):
+                column.append(values[position])
+
+    def append_batch(self, batch, timestamp=None):
+        timestamp = batch.wall_time() if timestamp is None else timestamp
+        for record in batch.records:
+            self.append(record, timestamp)
+
+    def flush(self):
+        """Write every buffered stage as a chunk"""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        db = self._db
+        db.execute("BEGIN")
+        try:
+            for stage_id, (timestamps, columns) in enumerate(self._buffers):
+                if not timestamps:
+                    continue
+                start = timestamps[0]
+                try:
+                    data = encode_chunk(start, timestamps, columns)
+                except (OverflowError, ValueError) as e:
+                    # Cannot be stored as one chunk; retrying would fail the same way
+                    logger.warning("⚠ Dropping %d %s record(s) from sensor history: %s",
+                                   len(timestamps), STAGES[stage_id], e)
+                    self._drop_buffer(stage_id)
+                    continue
+                db.execute(
+                    "INSERT INTO chunks (stage, start, end, count, data) VALUES (?, ?, ?, ?, ?)",
+                    (stage_id, start, timestamps[-1], len(timestamps), data),
+                )
+                db.executemany(_UPSERT_ROLLUP, self._rollup_rows(stage_id, timestamps, columns))
+                self.records_written += len(timestamps)
+                self.chunks_written += 1
+                self.bytes_written += len(data)
+                timestamps.clear()
+                for column in columns:
+                    column.clear()
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            # Don't keep buffering onto chunks that failed to write
+            for stage_id in range(len(self._buffers)):
+                self._drop_buffer(stage_id)
+            raise
+        now = time.time()
+        if now - self._last_retention > 600:
+            self._last_retention = now
+            self._apply_retention(now)
+
+    def _drop_buffer(self, stage_id):
+        timestamps, columns = self._buffers[stage_id]
+        self.records_dropped += len(timestamps)
+        timestamps.clear()
+        for column in columns:
+            column.clear()
+
+    @staticmethod
+    def _rollup_rows(stage_id, timestamps, columns):
+        rows = []
+        for resolution in RESOLUTIONS:
+            for column, position in zip(columns, _STAGE_POSITIONS[stage_id]):
+                buckets = {}  # bucket -> [n, total, min, max]
+                for ts, value in zip(timestamps, column):
+                    if math.isnan(value):
+                        continue
+                    bucket = ts - ts % resolution
+                    entry = buckets.get(bucket)
+                    if entry is None:
+                        buckets[bucket] = [1, value, value, value]
+                    else:
+                        entry[0] += 1
+                        entry[1] += value
+                        if value < entry[2]:
+                            entry[2] = value
+                        if value > entry[3]:
+                            entry[3] = value
+                for bucket, (n, total, low, high) in buckets.items():
+                    rows.append((stage_id, resolution, bucket, position, n, total, low, high))
+        return rows
+
+    # ---------------- retention ----------------
+
+    def _used_bytes(self):
+        page_size = self._db.execute("PRAGMA page_size").fetchone()[0]
+        pages = self._db.execute("PRAGMA page_count").fetchone()[0]
+        free = self._db.execute("PRAGMA freelist_count").fetchone()[0]
+        return (pages - free) * page_size
+
+    def _apply_retention(self, now):
+        # Caller holds the lock
+        db = self._db
+        cursor = db.execute("DELETE FROM chunks WHERE end < ?", (now - self.retention["raw"],))
+        self.deleted_chunks += cursor.rowcount
+        for resolution in RESOLUTIONS:
+            db.execute(
+                "DELETE FROM rollups WHERE resolution = ? AND bucket < ?",
+                (resolution, now - self.retention[resolution]),
+            )
+        # Size cap: drop the oldest raw chunks first, then the oldest minute rollups
+        while self._used_bytes() > self.max_bytes:
+            cursor = db.execute(
+                "DELETE FROM chunks WHERE rowid IN (SELECT rowid FROM chunks ORDER BY start LIMIT 256)"
+            )
+            if cursor.rowcount:
+                self.deleted_chunks += cursor.rowcount
+                continue
+            cursor = db.execute(
+                "DELETE FROM rollups WHERE resolution = ? AND bucket IN "
+                "(SELECT DISTINCT bucket FROM rollups WHERE resolution = ? ORDER BY bucket LIMIT 60)",
+                (RESOLUTIONS[0], RESOLUTIONS[0]),
+            )
+            if not cursor.rowcount:
+                break
+
+    # ---------------- queries ----------------
+
+    def query(self, stage, fields=None, start=None, end=None, resolution="auto"):
+        """
+        Columnar series for one stage between unix times start and end
+        resolution: "raw", 60, 3600 or "auto" (raw up to 2 h, minutes up to
+        7 days, hours beyond)
+        Raw:     {"resolution": "raw", "t": [...], "fields": {field: [...]}}
+        Rollups: {"resolution": 60, "t": [...],
+                  "fields": {field: {"mean": [...], "min": [...], "max": [...], "n": [...]}}}
+        Missing values are None.
+        """
+        if stage not in STAGE_SCHEMAS:
+            raise ValueError(f"Unknown stage '{stage}'")
+        schema = STAGE_SCHEMAS[stage]
+        fields = list(fields) if fields else list(schema)
+        unknown = [name for name in fields if name not in schema]
+        if unknown:
+            raise ValueError(f"Stage '{stage}' has no field(s) {', '.join(unknown)}")
+        end = time.time() if end is None else end
+        start = end - 86400 if start is None else start
+        if resolution == "auto":
+            span = end - start
+            resolution = "raw" if span <= 2 * 3600 else 60 if span <= 7 * 86400 else 3600
+        elif resolution != "raw":
+            resolution = int(resolution)
+            if resolution not in RESOLUTIONS:
+                raise ValueError(f"Resolution must be 'raw', 'auto' or one of {RESOLUTIONS}")
+
+        stage_id = STAGES.index(stage)
+        if resolution == "raw":
+            return self._query_raw(stage_id, fields, start, end)
+        return self._query_rollup(stage_id, fields, start, end, resolution)
+
+    def _query_raw(self, stage_id, fields, start, end):
+        schema = STAGE_SCHEMAS[STAGES[stage_id]]
+        wanted = [schema.index(name) for name in fields]
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT start, count, data FROM chunks WHERE stage = ? AND start <= ? AND end >= ? "
+                "ORDER BY start",
+                (stage_id, end, start),
+            ).fetchall()
+        times = []
+        series = {name: [] for name in fields}
+        for chunk_start, count, data in rows:
+            timestamps, columns = decode_chunk(chunk_start, count, len(schema), data)
+            first = 0 if timestamps[0] >= start else next(i for i, ts in enumerate(timestamps) if ts >= start)
+            last = count if timestamps[-1] <= end else next(i for i, ts in enumerate(timestamps) if ts > end)
+            times.extend(round(ts, 3) for ts in timestamps[first:last])
+            for name, index in zip(fields, wanted):
+                series[name].extend(_clean(value) for value in columns[index][first:last])
+        return {"resolution": "raw", "t": times, "fields": series}
+
+    def _query_rollup(self, stage_id, fields, start, end, resolution):
+        positions = {FIELD_INDEX[name]: name for name in fields}
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT bucket, field, n, total, min, max FROM rollups "
+                f"WHERE stage = ? AND resolution = ? AND field IN ({','.join('?' * len(positions))}) "
+                f"AND bucket >= ? AND bucket <= ? ORDER BY bucket",
+                (stage_id, resolution, *positions, start - start % resolution, end),
+            ).fetchall()
+        buckets = sorted({row[0] for row in rows})
+        slot = {bucket: index for index, bucket in enumerate(buckets)}
+        series = {
+            name: {key: [None] * len(buckets) for key in ("mean", "min", "max", "n")}
+            for name in fields
+        }
+        for bucket, position, n, total, low, high in rows:
+            entry, index = series[positions[position]], slot[bucket]
+            entry["mean"][index] = round(total / n, 4)
+            entry["min"][index] = round(low, 4)
+            entry["max"][index] = round(high, 4)
+            entry["n"][index] = n
+        return {"resolution": resolution, "t": buckets, "fields": series}
+
+    def stats(self):
+        with self._lock:
+            chunks, records, first = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(count), 0), MIN(start) FROM chunks"
+            ).fetchone()
+            used = self._used_bytes()
+            buffered = sum(len(timestamps) for timestamps, _ in self._buffers)
+        return {
+            "chunks": chunks,
+            "records": records,
+            "oldest": first,
+            "buffered": buffered,
+            "db_bytes": used,
+            "max_bytes": self.max_bytes,
+            "records_written": self.records_written,
+            "chunks_written": self.chunks_written,
+            "deleted_chunks": self.deleted_chunks,
+            "records_dropped": self.records_dropped,
+        }
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._db.close()
+
+
+def _clean(value):
+    return None if math.isnan(value) else round(value, 4)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_timeseries_store():
+    """Shared TimeSeriesStore from config, or None when disabled or unusable"""
+    global _store
+    if not config.TIMESERIES_ENABLED:
+        return None
+    with _store_lock:
+        if _store is None:
+            try:
+                _store = TimeSeriesStore(
+                    config.TIMESERIES_PATH,
+                    chunk_seconds=config.TIMESERIES_CHUNK_SECONDS,
+                    retention={
+                        "raw": config.TIMESERIES_RAW_DAYS * 86400,
+                        60: config.TIMESERIES_MINUTE_DAYS * 86400,
+                        3600: config.TIMESERIES_HOUR_DAYS * 86400,
+                    },
+                    max_bytes=config.TIMESERIES_MAX_BYTES,
+                )
+            except sqlite3.Error as e:
+                logger.warning("⚠ Time series store unavailable: %s", e)
+                return None
+    return _store
@@ -1,14 +1,21 @@
-import threading
-from mqtt.subscriber import main as subscriber_main
+from config import config
+from utils import metrics
+from mqtt.mqtt_client import init_mqtt
+from mqtt.subscriber import subscribe_commands
 from mqtt.publisher import main as publisher_main
 
 def main():
     print("Starting IoT device services...")
     
-    # Run MQTT subscriber in a separate thread (listens for commands)
-    mqtt_thread = threading.Thread(target=subscriber_main, daemon=True, name="MQTT-Subscriber")
-    mqtt_thread.start()
-    print("✓ MQTT subscriber thread started (listening for commands)")
+    if config.METRICS_PORT:
+        metrics.start_http_server(config.METRICS_PORT, config.METRICS_HOST)
+    
+    # One MQTT client for both services, with one fixed client id so a
+    # persistent session survives restarts. Command handlers are bound
+    # before connecting; paho's network thread dispatches them.
+    subscribe_commands()
+    init_mqtt(role="device")
+    print("✓ MQTT command handlers bound (listening for commands)")
     
     # Run publisher in main thread (collects & publishes sensor data)
     print("✓ Starting data publisher (reading serial + publishing to MQTT)...")
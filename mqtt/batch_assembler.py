@@ -0,0 +1,159 @@
+"""
+Batch Assembler - Groups Arduino stage lines into per-cycle batches
+A cycle is flushed as soon as all three stages arrived, when the gap since
+the last line exceeds the learned inter-line threshold, or when the cycle
+deadline (measured from the first line) expires
+"""
+import time
+
+from data.records import STAGES, SampleParser
+
+
+class SensorBatch:
+    """
+    One Arduino cycle: stage lines in STAGES order, their parsed
+    SensorRecords, and the monotonic arrival time of the first and last
+    line. str(batch) gives the newline-joined lines, the format published
+    to MQTT. tag/score are set by the pre-classifier (None without one).
+    """
+    __slots__ = ("lines", "records", "first_ts", "last_ts", "tag", "score")
+
+    def __init__(self, lines, records, first_ts, last_ts, tag=None, score=None):
+        self.lines = lines
+        self.records = records
+        self.first_ts = first_ts
+        self.last_ts = last_ts
+        self.tag = tag
+        self.score = score
+
+    def __str__(self):
+        return "\n".join(self.lines)
+
+    def wall_time(self):
+        """Unix time of the first line (converted from the monotonic clock)"""
+        return time.time() - (time.monotonic() - self.first_ts)
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __repr__(self):
+        return f"SensorBatch({len(self.lines)} lines, span={(self.last_ts - self.first_ts) * 1000:.1f}ms)"
+
+
+class BatchAssembler:
+    """
+    Incremental batch builder with a learned inter-line gap threshold
+
+    cycle_deadline: max seconds from a cycle's first line to its flush
+    gap_factor:     flush when the silence after a line exceeds
+                    gap_factor x the average gap seen inside cycles
+    min_gap:        lower bound for the learned gap threshold
+    """
+
+    def __init__(self, cycle_deadline=1.0, gap_factor=3.0, min_gap=0.02, alpha=0.2, parser=None):
+        self.cycle_deadline = cycle_deadline
+        self.gap_factor = gap_factor
+        self.min_gap = min_gap
+        self.alpha = alpha
+        self.avg_gap = None  # EWMA of gaps between lines of the same cycle
+        self.parser = parser or SampleParser()
+        self._slots = [None] * len(STAGES)  # reused across cycles
+        self._records = [None] * len(STAGES)
+        self._count = 0
+        self._first_ts = 0.0
+        self._last_ts = 0.0
+        self.batches_complete = 0
+        self.batches_partial = 0
+
+    @property
+    def gap_threshold(self):
+        """Silence (seconds) after which a partial cycle is considered finished"""
+        if self.avg_gap is None:
+            return self.cycle_deadline
+        return min(self.cycle_deadline, max(self.min_gap, self.gap_factor * self.avg_gap))
+
+    def time_until_flush(self, now):
+        """Seconds until the pending cycle must be flushed, or None if nothing is pending"""
+        if not self._count:
+            return None
+        deadline = min(self._first_ts + self.cycle_deadline, self._last_ts + self.gap_threshold)
+        return max(0.0, deadline - now)
+
+    def add(self, line, now):
+        """
+        Add one stage line received at monotonic time now
+        Returns a SensorBatch if this line completes (or closes) a cycle, else None
+        Lines that do not parse (unknown stage, bad fields) are counted by
+        the parser and ignored
+        """
+        record = self.parser.parse(line)
+        if record is None:
+            return None
+        index = record.stage_id
+
+        flushed = None
+        # Line arrived after the cycle should have closed, or its stage was
+        # already seen this cycle: it starts a new cycle
+        if self._count and (self.time_until_flush(now) == 0.0 or self._slots[index] is not None):
+            flushed = self.flush()
+
+        if self._count:
+            self._learn_gap(now - self._last_ts)
+        else:
+            self._first_ts = now
+        if self._slots[index] is None:
+            self._count += 1
+        self._slots[index] = line
+        self._records[index] = record
+        self._last_ts = now
+
+        if self._count == len(STAGES):
+            return self.flush()
+        return flushed
+
+    def flush_due(self, now):
+        """Flush the pending cycle if its deadline has passed"""
+        remaining = self.time_until_flush(now)
+        if remaining is not None and remaining <= 0.0:
+            return self.flush()
+        return None
+
+    def flush(self):
+        """Emit whatever the pending cycle holds (None if empty) and reset it"""
+        if not self._count:
+            return None
+        slots, records = self._slots, self._records
+        batch = SensorBatch(
+            [line for line in slots if line is not None],
+            [record for record in records if record is not None],
+            self._first_ts,
+            self._last_ts,
+        )
+        if self._count == len(STAGES):
+            self.batches_complete += 1
+        else:
+            self.batches_partial += 1
+        for index in range(len(slots)):
+            slots[index] = None
+            records[index] = None
+        self._count = 0
+        return batch
+
+    def _learn_gap(self, gap):
+        # Ignore gaps that already exceed the threshold (idle periods, not
+        # cadence) and lines that arrived in the same read (no gap measured)
+        if gap <= 0:
+            return
+        if self.avg_gap is None:
+            self.avg_gap = gap
+        elif gap <= self.gap_threshold:
+            self.avg_gap += self.alpha * (gap - self.avg_gap)
+
+    def stats(self):
+        return {
+            "batches_complete": self.batches_complete,
+            "batches_partial": self.batches_partial,
+            "avg_gap_ms": round(self.avg_gap * 1000, 3) if self.avg_gap is not None else None,
+            "gap_threshold_ms": round(self.gap_threshold * 1000, 3),
+            **self.parser.stats(),
+        }
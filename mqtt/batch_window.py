@@ -0,0 +1,107 @@
+"""
+Batch Window - Packs several sensor batches into one MQTT message
+A window is flushed when it holds max_batches, when max_seconds passed since
+its first batch, when the next batch would push it past max_bytes, or on close()
+"""
+import threading
+import time
+
+from utils import log
+from .payload import FORMAT_TEXT, estimate_size, header_size
+
+logger = log.get_logger(__name__)
+
+
+class BatchWindow:
+    """
+    Collects (batch, unix timestamp) pairs and hands full windows to on_flush
+
+    on_flush(batches, timestamps) is called from the thread that added the
+    batch, from the window timer thread (time-based flush) or from close().
+    Calls are serialised, so windows are published in order.
+    """
+
+    def __init__(self, on_flush, serial_number, max_batches=10, max_seconds=0.0,
+                 max_bytes=64 * 1024, payload_format=FORMAT_TEXT):
+        self.on_flush = on_flush
+        self.max_batches = max(1, max_batches)
+        self.max_seconds = max_seconds
+        self.max_bytes = max_bytes
+        self.payload_format = payload_format
+        self._header_bytes = header_size(serial_number, payload_format)
+        self._batches = []
+        self._timestamps = []
+        self._bytes = 0
+        self._deadline = None
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._closed = False
+        self.windows_sent = 0
+        self.batches_sent = 0
+        self._timer = None
+        if max_seconds > 0:
+            self._timer = threading.Thread(target=self._timer_loop, daemon=True, name="Batch-Window")
+            self._timer.start()
+
+    def add(self, batch, timestamp=None):
+        """Add one batch; may flush the current window"""
+        if timestamp is None:
+            timestamp = batch.wall_time()
+        size = estimate_size(batch, self.payload_format)
+        with self._lock:
+            # Would overflow the size limit: send what we have first
+            if self._batches and self._header_bytes + self._bytes + size > self.max_bytes:
+                self._flush_locked()
+            if not self._batches and self.max_seconds > 0:
+                self._deadline = time.monotonic() + self.max_seconds
+                self._cond.notify()
+            self._batches.append(batch)
+            self._timestamps.append(timestamp)
+            self._bytes += size
+            if len(self._batches) >= self.max_batches or self._header_bytes + self._bytes >= self.max_bytes:
+                self._flush_locked()
+
+    def flush(self):
+        """Send the pending window now (if any)"""
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        """Flush the pending window and stop the timer (e.g. on shutdown)"""
+        with self._lock:
+            self._flush_locked()
+            self._closed = True
+            self._cond.notify()
+
+    def _flush_locked(self):
+        if not self._batches:
+            return
+        batches, timestamps = self._batches, self._timestamps
+        self._batches, self._timestamps = [], []
+        self._bytes = 0
+        self._deadline = None
+        self.windows_sent += 1
+        self.batches_sent += len(batches)
+        try:
+            self.on_flush(batches, timestamps)
+        except Exception as e:
+            logger.error("✗ Failed to publish batch window: %s", e)
+
+    def _timer_loop(self):
+        with self._lock:
+            while not self._closed:
+                if self._deadline is None:
+                    self._cond.wait()
+                    continue
+                remaining = self._deadline - time.monotonic()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+                self._flush_locked()
+
+    def stats(self):
+        return {
+            "windows_sent": self.windows_sent,
+            "batches_sent": self.batches_sent,
+            "pending_batches": len(self._batches),
+        }
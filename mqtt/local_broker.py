@@ -0,0 +1,266 @@
+"""
+Local Broker - Small asyncio MQTT 3.1.1 broker stand-in for tests and load runs
+Supports QoS 0/1/2 publishes (delivered at most at QoS 1), + and #
+subscriptions (routed with TopicRouter), retained messages, will messages,
+keepalive and client-id takeover. Sessions are always clean: nothing is
+kept for a client after it disconnects and nothing is retried.
+
+Usage: python -m mqtt.local_broker [--host 127.0.0.1] [--port 1883]
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+from . import mqtt_wire as wire
+from .topic_router import TopicRouter
+
+
+class _Session:
+    __slots__ = ("client_id", "writer", "next_id", "filters", "will")
+
+    def __init__(self, client_id, writer, will):
+        self.client_id = client_id
+        self.writer = writer
+        self.next_id = 0
+        self.filters = {}   # topic filter -> (session, granted qos) handler
+        self.will = will
+
+    def packet_id(self):
+        self.next_id = self.next_id % 65535 + 1
+        return self.next_id
+
+
+class LocalBroker:
+    """
+    Asyncio MQTT broker
+
+    max_buffer: bytes a client may have waiting in its socket buffer; messages
+                for a client beyond that are dropped (counted as slow_drops)
+                instead of growing memory without bound
+    """
+
+    def __init__(self, host="127.0.0.1", port=1883, max_buffer=8 * 1024 * 1024):
+        self.host = host
+        self.port = port
+        self.max_buffer = max_buffer
+        self._router = TopicRouter()
+        self._sessions = {}   # client id -> _Session
+        self._retained = {}   # topic -> (payload, qos)
+        self._server = None
+        self._loop = None
+        self._handlers = set()
+        self.started_at = None
+        self.connections = 0
+        self.peak_clients = 0
+        self.messages_in = 0
+        self.messages_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.slow_drops = 0
+
+    async def start(self):
+        """Start listening; port 0 picks a free port (see self.port)"""
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, backlog=4096)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self.started_at = time.monotonic()
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            for session in list(self._sessions.values()):
+                session.writer.close()
+            # Closed sockets end each handler's read loop; let them finish
+            await asyncio.gather(*self._handlers, return_exceptions=True)
+            await self._server.wait_closed()
+
+    # ---------------- connection handling ----------------
+
+    async def _handle(self, reader, writer):
+        session = None
+        clean_exit = False
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        try:
+            packet_type, _, body = await asyncio.wait_for(wire.read_packet(reader), timeout=10)
+            if packet_type != wire.CONNECT:
+                return
+            info = wire.parse_connect(body)
+            client_id = info["client_id"] or f"auto-{id(writer):x}"
+            previous = self._sessions.get(client_id)
+            if previous is not None:
+                # Client-id takeover: the older connection is closed (and its will sent)
+                self._drop_session(previous)
+                previous.writer.close()
+                if previous.will:
+                    self.route(*previous.will)
+                    previous.will = None
+            session = _Session(client_id, writer, info["will"])
+            self._sessions[client_id] = session
+            self.connections += 1
+            self.peak_clients = max(self.peak_clients, len(self._sessions))
+            writer.write(wire.connack(0, session_present=False))
+
+            timeout = info["keepalive"] * 1.5 if info["keepalive"] else None
+            while True:
+                packet_type, flags, body = await asyncio.wait_for(wire.read_packet(reader), timeout)
+                if packet_type == wire.PUBLISH:
+                    topic, payload, qos, retain, packet_id = wire.parse_publish(flags, body)
+                    self.messages_in += 1
+                    self.bytes_in += len(payload)
+                    if qos == 1:
+                        writer.write(wire.ack(wire.PUBACK, packet_id))
+                    elif qos == 2:
+                        writer.write(wire.ack(wire.PUBREC, packet_id))
+                    self.route(topic, payload, qos, retain)
+                elif packet_type == wire.PUBREL:
+                    writer.write(wire.ack(wire.PUBCOMP, wire.parse_packet_id(body)))
+                elif packet_type == wire.SUBSCRIBE:
+                    packet_id, filters = wire.parse_subscribe(body)
+                    codes = [self._subscribe(session, topic_filter, qos) for topic_filter, qos in filters]
+                    writer.write(wire.suback(packet_id, codes))
+                    for topic_filter, _ in filters:
+                        self._send_retained(session, topic_filter)
+                elif packet_type == wire.UNSUBSCRIBE:
+                    packet_id, topics = wire.parse_unsubscribe(body)
+                    for topic_filter in topics:
+                        handler = session.filters.pop(topic_filter, None)
+                        if handler is not None:
+                            self._router.remove(topic_filter, handler)
+                    writer.write(wire.ack(wire.UNSUBACK, packet_id))
+                elif packet_type == wire.PINGREQ:
+                    writer.write(wire.PINGRESP_PACKET)
+                elif packet_type == wire.DISCONNECT:
+                    clean_exit = True
+                    return
+                # PUBACK/PUBREC/PUBCOMP from subscribers need no action: nothing is retried
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError, wire.ProtocolError):
+            pass
+        finally:
+            if session is not None and self._sessions.get(session.client_id) is session:
+                self._drop_session(session)
+                if session.will and not clean_exit:
+                    topic, payload, qos, retain = session.will
+                    self.route(topic, payload, qos, retain)
+            writer.close()
+            self._handlers.discard(task)
+
+    def _subscribe(self, session, topic_filter, qos):
+        granted = min(qos, 1)
+        try:
+            old = session.filters.get(topic_filter)
+            if old is not None:
+                self._router.remove(topic_filter, old)
+            handler = (session, granted)
+            self._router.add(topic_filter, handler)
+            session.filters[topic_filter] = handler
+            return granted
+        except ValueError:
+            return 0x80
+
+    def _drop_session(self, session):
+        for topic_filter, handler in session.filters.items():
+            self._router.remove(topic_filter, handler)
+        session.filters.clear()
+        del self._sessions[session.client_id]
+
+    # ---------------- routing ----------------
+
+    def route(self, topic, payload, qos=0, retain=False):
+        """Deliver a message to every matching subscriber (call on the broker's loop)"""
+        if retain:
+            if payload:
+                self._retained[topic] = (payload, qos)
+            else:
+                self._retained.pop(topic, None)
+        targets = {}
+        for session, granted in self._router.match(topic.split("/")):
+            targets[session] = max(targets.get(session, 0), granted)
+        for session, granted in targets.items():
+            self._deliver(session, topic, payload, min(qos, granted))
+
+    def _deliver(self, session, topic, payload, qos, retain=False):
+        transport = session.writer.transport
+        if transport.is_closing():
+            return
+        if transport.get_write_buffer_size() > self.max_buffer:
+            self.slow_drops += 1
+            return
+        session.writer.write(wire.publish(topic, payload, qos, retain, session.packet_id() if qos else 0))
+        self.messages_out += 1
+        self.bytes_out += len(payload)
+
+    def _send_retained(self, session, topic_filter):
+        if not self._retained:
+            return
+        matcher = TopicRouter()
+        matcher.add(topic_filter, True)
+        for topic, (payload, qos) in self._retained.items():
+            if matcher.match(topic.split("/")):
+                self._deliver(session, topic, payload, min(qos, 1), retain=True)
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0.0
+        return {
+            "clients": len(self._sessions),
+            "peak_clients": self.peak_clients,
+            "connections": self.connections,
+            "messages_in": self.messages_in,
+            "messages_out": self.messages_out,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "slow_drops": self.slow_drops,
+            "retained": len(self._retained),
+            "uptime": round(elapsed, 1),
+        }
+
+
+def start_in_thread(host="127.0.0.1", port=0, **kwargs):
+    """Run a LocalBroker on its own event loop in a daemon thread; returns it once listening"""
+    broker = LocalBroker(host, port, **kwargs)
+    ready = threading.Event()
+    errors = []
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(broker.start())
+        except Exception as e:
+            errors.append(e)
+            ready.set()
+            return
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True, name="LocalBroker").start()
+    ready.wait()
+    if errors:
+        raise errors[0]
+    return broker
+
+
+async def _serve(host, port, report):
+    broker = await LocalBroker(host, port).start()
+    print(f"✓ Local MQTT broker listening on {host}:{broker.port}")
+    while True:
+        await asyncio.sleep(report)
+        print(f"[{time.strftime('%H:%M:%S')}] {broker.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--report", type=float, default=10, help="seconds between stats lines")
+    args = parser.parse_args()
+    try:
+        asyncio.run(_serve(args.host, args.port, args.report))
+    except KeyboardInterrupt:
+        print("\nBroker shutting down...")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+MQTT Asyncio - Drives a paho client from an asyncio event loop
+Replaces client.loop_start(): paho's socket callbacks register the socket
+with the loop (add_reader / add_writer), keepalive runs from a task, and
+(re)connects happen with exponential backoff in a worker thread so a slow
+TCP/TLS handshake never stalls the loop. No paho network thread is started.
+
+publish() stays callable from any thread: paho asks for write interest
+through on_socket_register_write, which is forwarded to the loop.
+"""
+import asyncio
+import threading
+
+import paho.mqtt.client as mqtt
+
+from utils import log
+
+logger = log.get_logger(__name__)
+
+
+class AsyncioMqttLoop:
+    """
+    Network loop for one paho client on an asyncio loop
+
+    Call client.connect_async(...) first; start() then connects, and
+    reconnects after every disconnect, waiting min_delay..max_delay seconds
+    (doubling) between failed attempts.
+    """
+
+    def __init__(self, client, loop, min_delay=1, max_delay=30):
+        self.client = client
+        self.loop = loop
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self._task = None
+        self._closed = None   # asyncio.Event set when the socket closes
+        self._stopping = False
+        self.connects = 0
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    # paho may call these from any thread (connect runs in a worker, publish
+    # in the caller's thread); the loop's selector is only touched on the loop
+    def _call(self, fn, *args):
+        if self.loop.is_closed():
+            return
+        if threading.get_ident() == self._loop_thread:
+            fn(*args)
+        else:
+            self.loop.call_soon_threadsafe(fn, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._call(self.loop.add_reader, sock, self._read, sock)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._call(self._socket_closed, sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._call(self.loop.add_writer, sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._call(self.loop.remove_writer, sock)
+
+    def _socket_closed(self, sock):
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+        if self._closed is not None:
+            self._closed.set()
+
+    def _read(self, sock):
+        self.client.loop_read()
+        # TLS can hold decrypted bytes the selector will not report
+        pending = getattr(sock, "pending", None)
+        while pending is not None and self.client.socket() is sock and pending():
+            self.client.loop_read()
+
+    # ---------------- lifecycle ----------------
+
+    def start(self):
+        """Start connecting; callable from any thread"""
+        def begin():
+            self._loop_thread = threading.get_ident()
+            self._task = self.loop.create_task(self._run(), name="MQTT-Loop")
+        self._loop_thread = None
+        self.loop.call_soon_threadsafe(begin)
+        return self
+
+    async def _run(self):
+        delay = self.min_delay
+        while not self._stopping:
+            self._closed = asyncio.Event()
+            try:
+                await asyncio.to_thread(self.client.reconnect)
+            except (OSError, ValueError) as e:
+                logger.warning("⚠ MQTT connect failed: %s - retrying in %ss", e, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_delay)
+                continue
+            self.connects += 1
+            delay = self.min_delay
+            # Keepalive pings and timeouts until the socket closes
+            while not self._closed.is_set():
+                if self.client.loop_misc() != mqtt.MQTT_ERR_SUCCESS:
+                    break
+                try:
+                    await asyncio.wait_for(self._closed.wait(), timeout=1)
+                except asyncio.TimeoutError:
+                    pass
+            if not self._stopping:
+                await asyncio.sleep(delay)
+
+    async def stop(self, timeout=2.0):
+        """Send DISCONNECT, wait briefly for the socket to close and stop reconnecting"""
+        self._stopping = True
+        if self.client.socket() is not None and self._closed is not None:
+            self.client.disconnect()
+            try:
+                await asyncio.wait_for(self._closed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
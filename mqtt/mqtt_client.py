@@ -1,112 +1,321 @@
 # scripts/mqtt_client.py
+import threading
+import time
 import paho.mqtt.client as mqtt
 from config import config
+from utils import log, metrics
+from utils.latency import LatencyRecorder
+from .spool import Spool, SpoolDrainer
+from .publish_queue import PublishPipeline, PublishTracker
+from .topic_router import TopicRouter
+
+logger = log.get_logger(__name__)
 
 client = None
-_callbacks = set()  # set of callback functions to prevent duplicates
+_init_lock = threading.Lock()  # one client per process, whichever thread asks first
+_router = TopicRouter()  # subscription filter -> callbacks, matched with a trie
+_spool = None
+_spool_drainer = None
+_tracker = PublishTracker()  # in-flight messages and publish-to-PUBACK latency
+_pipeline = None
+_loop_driver = None  # AsyncioMqttLoop when the client runs on an asyncio loop
+
+# Connection tracking (reconnects, outage length, reconnect-to-first-message)
+_session_subscriptions = set()  # filters the broker holds in our persistent session
+_connected_at = None            # monotonic time of the last CONNACK
+_disconnected_at = None
+_awaiting_first_message = False
+reconnects = 0
+outage_time = LatencyRecorder()
+reconnect_to_first_message = LatencyRecorder()
 
 
 def _on_connect(c, userdata, flags, rc):
+    global _connected_at, _awaiting_first_message, reconnects
     if rc == 0:
-        print("✓ MQTT connected successfully")
-        # Subscribe to all registered topics with QoS 1 for guaranteed delivery
-        for topic in _subscriptions:
+        now = time.monotonic()
+        session_present = bool(flags.get("session present"))
+        if _disconnected_at is not None:
+            reconnects += 1
+            outage_time.record(now - _disconnected_at)
+            _awaiting_first_message = True
+        _connected_at = now
+        logger.info("✓ MQTT connected successfully (session present: %s)", session_present)
+
+        if not session_present:
+            _session_subscriptions.clear()
+        # Subscribe to all registered topics with QoS 1 for guaranteed delivery;
+        # a resumed persistent session already holds the ones subscribed before
+        for topic in _subscriptions - _session_subscriptions:
             c.subscribe(topic, qos=1)
-            print(f"✓ Subscribed to {topic} (QoS 1)")
+            logger.info("✓ Subscribed to %s (QoS 1)", topic)
+        if config.MQTT_PERSISTENT_SESSION:
+            _session_subscriptions.update(_subscriptions)
     else:
-        print(f"✗ MQTT connection failed with code {rc}")
+        logger.error("✗ MQTT connection failed with code %s", rc)
 
 
 def _on_disconnect(c, userdata, rc):
+    global _disconnected_at
+    _disconnected_at = time.monotonic()
     if rc != 0:
-        print(f"⚠ MQTT unexpected disconnect (code {rc}). Reconnecting...")
+        logger.warning("⚠ MQTT unexpected disconnect (code %s). Reconnecting...", rc)
     else:
-        print("MQTT disconnected cleanly")
+        logger.info("MQTT disconnected cleanly")
+
+
+def connection_stats():
+    """Reconnect count, outage durations and reconnect-to-first-message latency"""
+    return {
+        "connected": client is not None and client.is_connected(),
+        "persistent_session": config.MQTT_PERSISTENT_SESSION,
+        "reconnects": reconnects,
+        "outage": outage_time.snapshot(),
+        "reconnect_to_first_message": reconnect_to_first_message.snapshot(),
+    }
+
+
+_PUBLISH_COUNTERS = {key: "counter" for key in (
+    "published", "acked", "failed", "expired", "queued", "dropped", "spilled", "backpressure_waits")}
+_SPOOL_COUNTERS = {"spooled": "counter", "forwarded": "counter", "evicted": "counter"}
+
+
+def _collect_mqtt():
+    """Scrape-time bridge from the tracker, pipeline and spool counters to metrics"""
+    stats = {**_tracker.stats(), "reconnects": reconnects,
+             "connected": client is not None and client.is_connected()}
+    if _pipeline is not None:
+        stats.update(_pipeline.stats())
+    families = metrics.stats_families("mqtt", stats, {**_PUBLISH_COUNTERS, "reconnects": "counter"},
+                                      help_prefix="MQTT ")
+    if _spool is not None:
+        families += metrics.stats_families("mqtt_spool", _spool.stats(), _SPOOL_COUNTERS,
+                                           help_prefix="MQTT spool ")
+    families += [
+        metrics.latency_family("mqtt_publish_to_ack_seconds", "Publish-to-PUBACK latency",
+                               _tracker.publish_to_ack),
+        metrics.latency_family("mqtt_enqueue_to_ack_seconds", "Enqueue-to-PUBACK latency",
+                               _tracker.enqueue_to_ack),
+        metrics.latency_family("mqtt_outage_seconds", "Broker outage length", outage_time),
+        metrics.latency_family("mqtt_reconnect_to_first_message_seconds",
+                               "First message after a reconnect", reconnect_to_first_message),
+    ]
+    return families
+
+
+metrics.register_collector(_collect_mqtt)
 
 
 def _on_message(c, userdata, msg):
-    import time
-    receive_time = time.time()
+    global _awaiting_first_message
+    if _awaiting_first_message:
+        # First message after a reconnect (e.g. a command queued by the broker)
+        _awaiting_first_message = False
+        latency = time.monotonic() - _connected_at
+        reconnect_to_first_message.record(latency)
+        logger.info("✓ First MQTT message %.0f ms after reconnect", latency * 1000)
     
     topic = msg.topic
     message = msg.payload.decode().strip()
-    print(f"[MQTT {time.strftime('%H:%M:%S')}] {topic}: {message}")
+    logger.debug("[MQTT] %s: %s", topic, message)
 
-    # Call all registered callbacks, passing actual topic
-    for callback in _callbacks:
-        try:
-            callback(message, topic)
-        except Exception as e:
-            print(f"[MQTT] Callback error: {e}")
+    # Call only the callbacks whose filters match, with the topic pre-split
+    if not _router.dispatch(message, topic):
+        logger.warning("[MQTT] No handler for %s", topic)
 
 
 _subscriptions = set()
 
 
-def init_mqtt():
-    """Initialize MQTT client singleton"""
-    global client
+def client_id_for(role):
+    """
+    Stable client id so the broker can keep our session between connections;
+    always ends in the role, so processes sharing MQTT_CLIENT_ID do not
+    take over each other's session
+    """
+    if config.MQTT_CLIENT_ID:
+        return f"{config.MQTT_CLIENT_ID}-{role}"
+    return f"biotech-{config.SERIAL_NUMBER}-{role}"
+
+
+def init_mqtt(role="device", loop=None):
+    """
+    Initialize MQTT client singleton
+    role: distinguishes processes of the same device in the client id
+    (each process needs its own id or the broker disconnects the other one)
+    loop: run the client's network I/O on this asyncio loop (runtime.py)
+    instead of paho's own thread; connecting then happens in the background
+    An existing client is returned as is, whatever its role.
+    """
     if client is not None:
         return client
+    with _init_lock:
+        if client is not None:
+            return client
+        return _create_client(role, loop)
+
+
+def _create_client(role, loop):
+    # Caller holds _init_lock
+    global client, _loop_driver
 
     # Validate MQTT configuration before attempting connection
     if not config.MQTT_BROKER or config.MQTT_BROKER == "None":
-        print("⚠ MQTT broker not configured. Check your .env file.")
-        print("⏳ MQTT client not initialized - program will continue without MQTT")
+        logger.warning("⚠ MQTT broker not configured. Check your .env file.")
+        logger.warning("⏳ MQTT client not initialized - program will continue without MQTT")
         return None
     
     if not config.MQTT_USER or not config.MQTT_PASSWORD:
-        print("⚠ MQTT credentials not configured. Check your .env file.")
-        print("⏳ MQTT client not initialized - program will continue without MQTT")
+        logger.warning("⚠ MQTT credentials not configured. Check your .env file.")
+        logger.warning("⏳ MQTT client not initialized - program will continue without MQTT")
         return None
 
     try:
-        # Create client with clean session for faster reconnects
-        client = mqtt.Client(clean_session=True)
+        if config.MQTT_PERSISTENT_SESSION:
+            # Stable client id + persistent session: the broker queues QoS 1
+            # commands while we are offline and remembers our subscriptions
+            client = mqtt.Client(client_id=client_id_for(role), clean_session=False)
+            logger.info("✓ MQTT persistent session as %s", client_id_for(role))
+        else:
+            # Create client with clean session for faster reconnects
+            client = mqtt.Client(clean_session=True)
         client.username_pw_set(config.MQTT_USER, config.MQTT_PASSWORD)
-        client.tls_set()
+        if config.MQTT_TLS:
+            client.tls_set()
 
         client.on_connect = _on_connect
         client.on_message = _on_message
         client.on_disconnect = _on_disconnect
+        client.on_publish = _tracker.on_publish
+        client.max_inflight_messages_set(config.MQTT_MAX_INFLIGHT)
+        # Exponential reconnect backoff used by the loop_start() thread
+        client.reconnect_delay_set(config.MQTT_RECONNECT_MIN_DELAY, config.MQTT_RECONNECT_MAX_DELAY)
         
         # Reduce keepalive for faster detection of connection issues
         # Default is 60s, reducing to 20s for faster responsiveness
-        client.connect(config.MQTT_BROKER, config.MQTT_PORT, keepalive=20)
-        
-        # Start network loop immediately to process callbacks
-        client.loop_start()
-        print("MQTT client started and connecting...")
+        if loop is not None:
+            from .mqtt_asyncio import AsyncioMqttLoop
+            client.connect_async(config.MQTT_BROKER, config.MQTT_PORT, keepalive=20)
+            _loop_driver = AsyncioMqttLoop(
+                client, loop, config.MQTT_RECONNECT_MIN_DELAY, config.MQTT_RECONNECT_MAX_DELAY
+            ).start()
+            logger.info("MQTT client attached to the event loop and connecting...")
+        else:
+            client.connect(config.MQTT_BROKER, config.MQTT_PORT, keepalive=20)
+
+            # Start network loop immediately to process callbacks
+            client.loop_start()
+            logger.info("MQTT client started and connecting...")
+
+        # Forward anything left in the spool from a previous outage
+        get_spool()
+
+        if config.PUBLISH_ASYNC:
+            _start_pipeline()
         return client
     except Exception as e:
-        print(f"⚠ Failed to initialize MQTT client: {e}")
-        print("⏳ Program will continue without MQTT")
+        logger.warning("⚠ Failed to initialize MQTT client: %s", e)
+        logger.warning("⏳ Program will continue without MQTT")
         return None
 
 
+async def close_async():
+    """Disconnect a client started with init_mqtt(loop=...)"""
+    if _loop_driver is not None:
+        await _loop_driver.stop()
+
+
 def subscribe(topic, callback):
-    """Subscribe to a topic with wildcard support and QoS 1"""
+    """
+    Subscribe to a topic with wildcard support and QoS 1
+    callback(message, topic, segments) is called only for messages matching
+    this filter; segments is the topic split on '/'
+
+    May be called before init_mqtt(): the handler is bound right away and
+    the broker subscription is made on connection, so messages a persistent
+    session delivers straight after CONNACK already find their handler
+    """
     global _subscriptions
-    if client is None:
-        print(f"⚠ MQTT not available - cannot subscribe to {topic}")
-        return
-    
     if topic not in _subscriptions:
         _subscriptions.add(topic)
-        if client.is_connected():
+        if client is not None and client.is_connected():
             client.subscribe(topic, qos=1)
-            print(f"✓ Subscribed to {topic} (QoS 1)")
+            logger.info("✓ Subscribed to %s (QoS 1)", topic)
+            if config.MQTT_PERSISTENT_SESSION:
+                _session_subscriptions.add(topic)
         else:
-            print(f"⏳ Will subscribe to {topic} on connection")
+            logger.info("⏳ Will subscribe to %s on connection", topic)
     
-    # Add callback to set (prevents duplicates automatically)
-    _callbacks.add(callback)
+    # Bind callback to this filter (binding the same pair twice is a no-op)
+    _router.add(topic, callback)
 
 
-def publish(topic, message, QoS=0, retain=False):
-    if client is None:
-        print(f"⚠ MQTT not available - skipping publish to {topic}")
+def get_spool():
+    """
+    Store-and-forward spool singleton (None when SPOOL_ENABLED is off)
+    Starts the drainer that forwards spooled messages once MQTT is connected
+    """
+    global _spool, _spool_drainer
+    if _spool is None and config.SPOOL_ENABLED:
+        try:
+            _spool = Spool(config.SPOOL_PATH, max_bytes=config.SPOOL_MAX_BYTES, sync=config.SPOOL_SYNC)
+        except Exception as e:
+            logger.warning("⚠ Spool unavailable at %s: %s", config.SPOOL_PATH, e)
+            return None
+        _spool_drainer = SpoolDrainer(_spool, lambda: client, rate=config.SPOOL_DRAIN_RATE, tracker=_tracker)
+        _spool_drainer.start()
+        if len(_spool):
+            logger.info("✓ Spool holds %d message(s) from a previous outage", len(_spool))
+    return _spool
+
+
+def _start_pipeline():
+    global _pipeline
+    if _pipeline is None:
+        _pipeline = PublishPipeline(
+            _tracker,
+            lambda: client,
+            get_spool,
+            maxsize=config.PUBLISH_QUEUE_SIZE,
+            policy=config.PUBLISH_QUEUE_POLICY,
+            max_inflight=config.MQTT_MAX_INFLIGHT,
+        )
+        logger.info("✓ Async publish queue (size %d, policy %s)", config.PUBLISH_QUEUE_SIZE, config.PUBLISH_QUEUE_POLICY)
+    return _pipeline
+
+
+def publish_stats():
+    """Queue depth, in-flight count, delivery counters and PUBACK latency histograms"""
+    stats = _tracker.stats()
+    if _pipeline is not None:
+        stats.update(_pipeline.stats())
+    if _spool is not None:
+        stats["spool"] = _spool.stats()
+    return stats
+
+
+def publish(topic, message, QoS=0, retain=False, spool=False):
+    """
+    Publish a message
+    spool=True: if MQTT is unavailable or disconnected, keep the message in
+    the on-disk spool and forward it after reconnecting instead of dropping it
+    With PUBLISH_ASYNC the message is queued and sent by a worker thread.
+    """
+    if _pipeline is not None:
+        if _pipeline.submit(topic, message, qos=QoS, retain=retain, spool=spool):
+            logger.debug("[MQTT] Message queued for %s: %s", topic, message)
+        else:
+            logger.warning("⚠ Publish queue full - dropped message for %s", topic)
+        return
+
+    if client is None or (spool and not client.is_connected()):
+        store = get_spool() if spool else None
+        if store is not None:
+            store.put(topic, message, qos=QoS, retain=retain)
+            logger.info("⏳ MQTT offline - spooled message for %s (%d queued)", topic, len(store))
+            return
+        logger.warning("⚠ MQTT not available - skipping publish to %s", topic)
         return
-    client.publish(topic, payload=message, qos=QoS, retain=retain)
-    print(f"[MQTT] Message published to {topic}: {message}")
+    _tracker.publish(client, topic, message, qos=QoS, retain=retain)
+    logger.debug("[MQTT] Message published to %s: %s", topic, message)
 
@@ -0,0 +1,185 @@
+"""
+MQTT Wire - Minimal MQTT 3.1.1 packet codec for asyncio streams
+Just enough of the protocol for the local broker stand-in and the fleet
+simulator: CONNECT/CONNACK, PUBLISH with QoS 0-2, SUBSCRIBE/UNSUBSCRIBE,
+PINGREQ/PINGRESP and DISCONNECT. No MQTT 5 properties, no will messages
+on the client side.
+"""
+import struct
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+_U16 = struct.Struct("!H")
+
+
+class ProtocolError(ValueError):
+    """Raised on a packet that does not follow MQTT 3.1.1"""
+
+
+def _remaining_length(length):
+    out = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        out.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(out)
+
+
+def _string(text):
+    data = text.encode() if isinstance(text, str) else text
+    return _U16.pack(len(data)) + data
+
+
+def packet(packet_type, body=b"", flags=0):
+    return bytes([packet_type << 4 | flags]) + _remaining_length(len(body)) + body
+
+
+async def read_packet(reader):
+    """(type, flags, body) of the next packet; raises IncompleteReadError at EOF"""
+    first = (await reader.readexactly(1))[0]
+    length, multiplier = 0, 1
+    for _ in range(4):
+        byte = (await reader.readexactly(1))[0]
+        length += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            break
+        multiplier *= 128
+    else:
+        raise ProtocolError("Remaining length longer than 4 bytes")
+    body = await reader.readexactly(length) if length else b""
+    return first >> 4, first & 0x0F, body
+
+
+def read_string(body, offset):
+    (length,) = _U16.unpack_from(body, offset)
+    start = offset + 2
+    return body[start:start + length], start + length
+
+
+# ---------------- builders ----------------
+
+def connect(client_id, keepalive=60, clean_session=True, username=None, password=None):
+    flags = 0x02 if clean_session else 0
+    payload = _string(client_id)
+    if username is not None:
+        flags |= 0x80
+        payload += _string(username)
+        if password is not None:
+            flags |= 0x40
+            payload += _string(password)
+    return packet(CONNECT, _string("MQTT") + bytes([4, flags]) + _U16.pack(keepalive) + payload)
+
+
+def connack(return_code=0, session_present=False):
+    return packet(CONNACK, bytes([int(session_present), return_code]))
+
+
+def publish(topic, payload, qos=0, retain=False, packet_id=0, dup=False):
+    if isinstance(payload, str):
+        payload = payload.encode()
+    body = _string(topic) + (_U16.pack(packet_id) if qos else b"") + payload
+    return packet(PUBLISH, body, flags=(dup << 3) | (qos << 1) | int(retain))
+
+
+def ack(packet_type, packet_id):
+    """PUBACK, PUBREC, PUBREL, PUBCOMP or UNSUBACK"""
+    return packet(packet_type, _U16.pack(packet_id), flags=0x02 if packet_type == PUBREL else 0)
+
+
+def subscribe(packet_id, filters):
+    """filters: iterable of (topic filter, qos)"""
+    body = _U16.pack(packet_id) + b"".join(_string(topic) + bytes([qos]) for topic, qos in filters)
+    return packet(SUBSCRIBE, body, flags=0x02)
+
+
+def suback(packet_id, return_codes):
+    return packet(SUBACK, _U16.pack(packet_id) + bytes(return_codes))
+
+
+def unsubscribe(packet_id, topics):
+    return packet(UNSUBSCRIBE, _U16.pack(packet_id) + b"".join(_string(topic) for topic in topics), flags=0x02)
+
+
+PINGREQ_PACKET = packet(PINGREQ)
+PINGRESP_PACKET = packet(PINGRESP)
+DISCONNECT_PACKET = packet(DISCONNECT)
+
+
+# ---------------- parsers ----------------
+
+def parse_connect(body):
+    """{"client_id", "clean_session", "keepalive", "will", "username", "password"}"""
+    protocol, offset = read_string(body, 0)
+    if protocol not in (b"MQTT", b"MQIsdp"):
+        raise ProtocolError(f"Unknown protocol name {protocol!r}")
+    level, flags = body[offset], body[offset + 1]
+    (keepalive,) = _U16.unpack_from(body, offset + 2)
+    offset += 4
+    client_id, offset = read_string(body, offset)
+    will = None
+    if flags & 0x04:
+        will_topic, offset = read_string(body, offset)
+        will_message, offset = read_string(body, offset)
+        will = (will_topic.decode(), will_message, (flags >> 3) & 0x03, bool(flags & 0x20))
+    username = password = None
+    if flags & 0x80:
+        username, offset = read_string(body, offset)
+    if flags & 0x40:
+        password, offset = read_string(body, offset)
+    return {
+        "level": level,
+        "client_id": client_id.decode(),
+        "clean_session": bool(flags & 0x02),
+        "keepalive": keepalive,
+        "will": will,
+        "username": username.decode() if username is not None else None,
+        "password": password,
+    }
+
+
+def parse_publish(flags, body):
+    """(topic, payload bytes, qos, retain, packet_id)"""
+    qos = (flags >> 1) & 0x03
+    topic, offset = read_string(body, 0)
+    packet_id = 0
+    if qos:
+        (packet_id,) = _U16.unpack_from(body, offset)
+        offset += 2
+    return topic.decode(), body[offset:], qos, bool(flags & 0x01), packet_id
+
+
+def parse_packet_id(body):
+    return _U16.unpack_from(body, 0)[0]
+
+
+def parse_subscribe(body):
+    """(packet_id, [(topic filter, qos), ...])"""
+    packet_id, offset = parse_packet_id(body), 2
+    filters = []
+    while offset < len(body):
+        topic, offset = read_string(body, offset)
+        filters.append((topic.decode(), body[offset] & 0x03))
+        offset += 1
+    return packet_id, filters
+
+
+def parse_unsubscribe(body):
+    packet_id, offset = parse_packet_id(body), 2
+    topics = []
+    while offset < len(body):
+        topic, offset = read_string(body, offset)
+        topics.append(topic.decode())
+    return packet_id, topics
@@ -0,0 +1,218 @@
+"""
+Payload - Encoders/decoders for sensor batches sent to hydronew/ai/classification
+
+Two formats:
+- text (default): "device_serial_number:<serial>" followed by the stage lines;
+  a multi-batch window separates batches with a blank line and, when
+  timestamps are given, starts each one with "timestamp:<unix seconds>".
+  A pre-classified batch starts with "precheck:<tag>,score:<score>".
+- binary (PAYLOAD_FORMAT=binary): versioned fixed struct layout keyed by a
+  schema id, little-endian:
+
+    header  "BT" | version u8 | schema_id u8 | serial_len u8 | serial utf-8
+            | base_ts f64 (unix seconds) | batch_count u16
+    batch   offset_ms u32 (from base_ts) | record_count u8
+            | (version 2 only) tag u8 (index in TAGS, 255 = none) | score f32
+            | records
+    record  stage_id u8 | one float32 per field of the stage schema (NaN = missing)
+
+  Version 2 is only used when a batch carries a pre-classifier tag, so
+  payloads without one stay version 1.
+
+  Field names and the serial number's label are never sent; the schema id
+  tells the decoder which stage/field layout to use.
+"""
+import struct
+from operator import itemgetter
+
+from data.preclassifier import TAGS
+from data.records import FIELD_INDEX, STAGES, STAGE_SCHEMAS, SensorRecord
+
+MAGIC = b"BT"
+VERSION = 1
+VERSION_TAGGED = 2
+NO_TAG = 255
+SCHEMA_ID = 1
+FORMAT_TEXT = "text"
+FORMAT_BINARY = "binary"
+TEXT_PREFIX = "device_serial_number:"
+TIMESTAMP_PREFIX = "timestamp:"
+PRECHECK_PREFIX = "precheck:"
+
+# schema id -> {stage id: field positions in SensorRecord.values}
+SCHEMAS = {
+    1: {STAGES.index(stage): tuple(FIELD_INDEX[name] for name in fields)
+        for stage, fields in STAGE_SCHEMAS.items()},
+}
+
+_HEADER = struct.Struct("<2sBBB")
+_BASE = struct.Struct("<dH")
+_BATCH = struct.Struct("<IB")
+_TAG = struct.Struct("<Bf")
+_RECORD_STRUCTS = {
+    schema_id: {stage_id: struct.Struct(f"<B{len(positions)}f") for stage_id, positions in stages.items()}
+    for schema_id, stages in SCHEMAS.items()
+}
+_FIELD_GETTERS = {
+    schema_id: {stage_id: itemgetter(*positions) for stage_id, positions in stages.items()}
+    for schema_id, stages in SCHEMAS.items()
+}
+
+
+class PayloadError(ValueError):
+    """Raised when a binary payload cannot be decoded"""
+
+
+def is_binary(payload):
+    return isinstance(payload, (bytes, bytearray, memoryview)) and bytes(payload[:2]) == MAGIC
+
+
+def _tag_of(batch):
+    return getattr(batch, "tag", None)
+
+
+def precheck_line(tag, score):
+    return f"{PRECHECK_PREFIX}{tag},score:{score:.3f}"
+
+
+def _text_block(batch):
+    tag = _tag_of(batch)
+    return str(batch) if tag is None else f"{precheck_line(tag, batch.score)}\n{batch}"
+
+
+def encode_text(serial_number, batches, timestamps=None):
+    """Current text format; several batches are separated by a blank line"""
+    if timestamps is None:
+        blocks = [_text_block(batch) for batch in batches]
+    else:
+        blocks = [f"{TIMESTAMP_PREFIX}{ts:.3f}\n{_text_block(batch)}" for batch, ts in zip(batches, timestamps)]
+    return f"{TEXT_PREFIX}{serial_number}\n" + "\n\n".join(blocks)
+
+
+def encode_binary(serial_number, batches, timestamps):
+    """
+    Pack batches (objects with .records) and their unix timestamps
+    into one binary payload
+    """
+    serial = serial_number.encode()
+    if len(serial) > 255:
+        raise PayloadError("serial number too long")
+    base_ts = timestamps[0] if timestamps else 0.0
+    structs = _RECORD_STRUCTS[SCHEMA_ID]
+    getters = _FIELD_GETTERS[SCHEMA_ID]
+
+    tagged = any(_tag_of(batch) is not None for batch in batches)
+    out = bytearray(_HEADER.pack(MAGIC, VERSION_TAGGED if tagged else VERSION, SCHEMA_ID, len(serial)))
+    out += serial
+    out += _BASE.pack(base_ts, len(batches))
+    for batch, ts in zip(batches, timestamps):
+        records = batch.records
+        out += _BATCH.pack(max(0, round((ts - base_ts) * 1000)), len(records))
+        if tagged:
+            tag = _tag_of(batch)
+            out += _TAG.pack(NO_TAG, 0.0) if tag is None else _TAG.pack(TAGS.index(tag), batch.score)
+        for record in records:
+            stage_id = record.stage_id
+            out += structs[stage_id].pack(stage_id, *getters[stage_id](record.values))
+    return bytes(out)
+
+
+def decode_binary(payload):
+    """
+    Decode a binary payload
+    Returns {"version", "schema_id", "serial_number",
+             "batches": [{"timestamp": float, "records": [SensorRecord, ...],
+                          "tag": str or None, "score": float or None}]}
+    """
+    view = memoryview(payload)
+    try:
+        magic, version, schema_id, serial_len = _HEADER.unpack_from(view, 0)
+        if magic != MAGIC:
+            raise PayloadError("not a binary sensor payload")
+        if version not in (VERSION, VERSION_TAGGED):
+            raise PayloadError(f"unsupported payload version {version}")
+        layout = SCHEMAS.get(schema_id)
+        if layout is None:
+            raise PayloadError(f"unknown schema id {schema_id}")
+        structs = _RECORD_STRUCTS[schema_id]
+
+        offset = _HEADER.size
+        serial_number = str(view[offset:offset + serial_len], "utf-8")
+        offset += serial_len
+        base_ts, batch_count = _BASE.unpack_from(view, offset)
+        offset += _BASE.size
+
+        batches = []
+        for _ in range(batch_count):
+            offset_ms, record_count = _BATCH.unpack_from(view, offset)
+            offset += _BATCH.size
+            tag = score = None
+            if version == VERSION_TAGGED:
+                code, score = _TAG.unpack_from(view, offset)
+                offset += _TAG.size
+                if code == NO_TAG:
+                    score = None
+                elif code < len(TAGS):
+                    tag = TAGS[code]
+                else:
+                    raise PayloadError(f"unknown tag code {code}")
+            records = []
+            for _ in range(record_count):
+                stage_id = view[offset]
+                record_struct = structs.get(stage_id)
+                if record_struct is None:
+                    raise PayloadError(f"unknown stage id {stage_id}")
+                unpacked = record_struct.unpack_from(view, offset)
+                offset += record_struct.size
+                record = SensorRecord(stage_id)
+                for position, value in zip(layout[stage_id], unpacked[1:]):
+                    record.values[position] = value
+                records.append(record)
+            batches.append({"timestamp": base_ts + offset_ms / 1000, "records": records,
+                            "tag": tag, "score": score})
+    except (struct.error, IndexError) as e:
+        raise PayloadError(f"truncated payload: {e}") from e
+
+    return {
+        "version": version,
+        "schema_id": schema_id,
+        "serial_number": serial_number,
+        "batches": batches,
+    }
+
+
+def decoded_to_text(decoded):
+    """Render a decoded binary payload in the text format (for text-only consumers)"""
+    return f"{TEXT_PREFIX}{decoded['serial_number']}\n" + "\n\n".join(
+        "\n".join(([precheck_line(batch["tag"], batch["score"])] if batch.get("tag") else [])
+                  + [record.to_line() for record in batch["records"]])
+        for batch in decoded["batches"]
+    )
+
+
+def estimate_size(batch, payload_format=FORMAT_TEXT):
+    """Bytes a batch adds to an encoded window (text estimate assumes timestamps)"""
+    tagged = _tag_of(batch) is not None
+    if payload_format == FORMAT_BINARY:
+        structs = _RECORD_STRUCTS[SCHEMA_ID]
+        return (_BATCH.size + (_TAG.size if tagged else 0)
+                + sum(structs[record.stage_id].size for record in batch.records))
+    precheck = len(precheck_line(batch.tag, batch.score)) + 1 if tagged else 0
+    return len(TIMESTAMP_PREFIX) + 16 + precheck + sum(len(line) + 1 for line in batch.lines)
+
+
+def header_size(serial_number, payload_format=FORMAT_TEXT):
+    """Bytes of an encoded payload before the first batch"""
+    if payload_format == FORMAT_BINARY:
+        return _HEADER.size + len(serial_number.encode()) + _BASE.size
+    return len(TEXT_PREFIX) + len(serial_number) + 1
+
+
+def encode(serial_number, batches, timestamps, payload_format=FORMAT_TEXT, text_timestamps=False):
+    """
+    Encode batches in the configured payload format
+    text_timestamps: prefix each text batch with its timestamp (binary always has them)
+    """
+    if payload_format == FORMAT_BINARY:
+        return encode_binary(serial_number, batches, timestamps)
+    return encode_text(serial_number, batches, timestamps if text_timestamps else None)
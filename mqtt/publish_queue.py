@@ -0,0 +1,261 @@
+"""
+Publish Queue - Bounded asynchronous publish stage with delivery tracking
+
+PublishTracker follows every QoS 1/2 message from client.publish() to its
+PUBACK (paho's on_publish) and keeps in-flight counts and latency
+histograms. PublishPipeline puts a bounded queue and a worker thread in
+front of client.publish so producers never wait on the network, and applies
+a drop/spill policy when the link cannot keep up.
+"""
+import queue
+import threading
+import time
+
+from utils import log
+from utils.latency import LatencyRecorder
+
+logger = log.get_logger(__name__)
+
+POLICY_DROP_OLDEST = "drop_oldest"
+POLICY_DROP_NEWEST = "drop_newest"
+POLICY_SPILL = "spill"      # overflow goes to the on-disk spool
+POLICY_BLOCK = "block"      # producer waits for room
+POLICIES = (POLICY_DROP_OLDEST, POLICY_DROP_NEWEST, POLICY_SPILL, POLICY_BLOCK)
+
+
+class PublishTracker:
+    """
+    Matches paho message ids to PUBACKs
+
+    enqueue_to_ack: time from publish() being called (or the message being
+                    queued) to its PUBACK
+    publish_to_ack: time from client.publish() to its PUBACK
+    expire() runs every expire_interval seconds from publish(), so entries
+    for messages lost in a disconnect never pile up.
+    """
+    EARLY_MAX_AGE = 5  # seconds an unmatched PUBACK may wait for its publish() to return
+
+    def __init__(self, expire_after=300, expire_interval=30):
+        self._lock = threading.RLock()
+        self._window_open = threading.Condition(self._lock)
+        self._inflight = {}     # mid -> (published_at, enqueued_at)
+        self._early = {}        # mid -> time of a PUBACK seen before publish() returned the mid
+        self._publishing = 0    # QoS 1/2 publish() calls waiting for client.publish()
+        self.expire_after = expire_after
+        self.expire_interval = expire_interval
+        self._last_expire = time.monotonic()
+        self.publish_to_ack = LatencyRecorder()
+        self.enqueue_to_ack = LatencyRecorder()
+        self.published = 0
+        self.acked = 0
+        self.failed = 0
+        self.expired = 0
+
+    def publish(self, c, topic, payload, qos=0, retain=False, enqueued_at=None):
+        """Call c.publish and track the message; returns the MQTTMessageInfo"""
+        published_at = time.monotonic()
+        if qos:
+            with self._lock:
+                self._publishing += 1
+        # Not under self._lock: paho holds its own message mutex while it
+        # calls on_publish, which takes self._lock
+        try:
+            info = c.publish(topic, payload=payload, qos=qos, retain=retain)
+        finally:
+            if qos:
+                with self._lock:
+                    self._publishing -= 1
+        with self._lock:
+            self.published += 1
+            if info.rc != 0:
+                self.failed += 1
+            if qos == 0:
+                self._early.pop(info.mid, None)
+            elif self._early.pop(info.mid, None) is not None:
+                self._record(published_at, enqueued_at or published_at)
+            else:
+                self._inflight[info.mid] = (published_at, enqueued_at or published_at)
+        if published_at - self._last_expire > self.expire_interval:
+            self.expire()
+        return info
+
+    def on_publish(self, c, userdata, mid):
+        """paho on_publish callback (PUBACK for QoS 1, PUBCOMP for QoS 2)"""
+        with self._lock:
+            entry = self._inflight.pop(mid, None)
+            if entry is None:
+                # Only a QoS 1/2 publish() still inside client.publish() can
+                # be waiting for this mid; anything else is a QoS 0 message
+                if self._publishing:
+                    self._early[mid] = time.monotonic()
+                return
+            self._record(*entry)
+
+    def _record(self, published_at, enqueued_at):
+        now = time.monotonic()
+        self.acked += 1
+        self.publish_to_ack.record(now - published_at)
+        self.enqueue_to_ack.record(now - enqueued_at)
+        self._window_open.notify_all()
+
+    def wait_for_window(self, limit, timeout=None):
+        """Block until fewer than limit messages are in flight; False on timeout"""
+        with self._lock:
+            return self._window_open.wait_for(lambda: len(self._inflight) < limit, timeout)
+
+    @property
+    def inflight(self):
+        return len(self._inflight)
+
+    def expire(self):
+        """Forget messages that never got a PUBACK within expire_after seconds"""
+        now = time.monotonic()
+        cutoff = now - self.expire_after
+        with self._lock:
+            self._last_expire = now
+            stale = [mid for mid, (published_at, _) in self._inflight.items() if published_at < cutoff]
+            for mid in stale:
+                del self._inflight[mid]
+            self.expired += len(stale)
+            if stale:
+                self._window_open.notify_all()
+            # An unmatched PUBACK must not ack a later message after mid wraparound
+            early_cutoff = now - self.EARLY_MAX_AGE
+            for mid in [mid for mid, seen in self._early.items() if seen < early_cutoff]:
+                del self._early[mid]
+
+    def stats(self):
+        return {
+            "published": self.published,
+            "acked": self.acked,
+            "failed": self.failed,
+            "expired": self.expired,
+            "inflight": self.inflight,
+            "publish_to_ack": self.publish_to_ack.snapshot(),
+            "enqueue_to_ack": self.enqueue_to_ack.snapshot(),
+        }
+
+
+class PublishPipeline:
+    """
+    Bounded queue + worker thread in front of client.publish
+
+    maxsize:      queued messages before the overflow policy applies
+    policy:       drop_oldest | drop_newest | spill | block
+    max_inflight: the worker stops sending while this many messages await
+                  their PUBACK, so a slow link backs up into the bounded
+                  queue (and its policy) instead of paho's unbounded one
+    get_client / get_spool: callables returning the current paho client and
+    the on-disk spool (either may return None)
+    """
+
+    def __init__(self, tracker, get_client, get_spool, maxsize=1000, policy=POLICY_DROP_OLDEST,
+                 max_inflight=20):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown publish queue policy '{policy}', expected one of {POLICIES}")
+        self.tracker = tracker
+        self.get_client = get_client
+        self.get_spool = get_spool
+        self.policy = policy
+        self.max_inflight = max_inflight
+        self.backpressure_waits = 0
+        self._queue = queue.Queue(maxsize=maxsize)
+        self.queued = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.high_watermark = 0
+        self._thread = threading.Thread(target=self._run, daemon=True, name="MQTT-Publisher")
+        self._thread.start()
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def submit(self, topic, payload, qos=0, retain=False, spool=False):
+        """Queue a message; returns False if it was dropped"""
+        item = (topic, payload, qos, retain, spool, time.monotonic())
+        if self.policy == POLICY_BLOCK:
+            self._queue.put(item)
+        else:
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                if not self._overflow(item):
+                    return False
+        self.queued += 1
+        depth = self._queue.qsize()
+        if depth > self.high_watermark:
+            self.high_watermark = depth
+        return True
+
+    def _overflow(self, item):
+        if self.policy == POLICY_DROP_NEWEST:
+            self.dropped += 1
+            return False
+        if self.policy == POLICY_SPILL:
+            store = self.get_spool()
+            if store is not None:
+                topic, payload, qos, retain = item[:4]
+                store.put(topic, payload, qos=qos, retain=retain)
+                self.spilled += 1
+                return True
+            self.dropped += 1
+            return False
+        # drop_oldest: make room for the newest message
+        try:
+            self._queue.get_nowait()
+            self.dropped += 1
+        except queue.Empty:
+            pass
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def _run(self):
+        last_expire = time.monotonic()
+        while True:
+            try:
+                topic, payload, qos, retain, spool, enqueued_at = self._queue.get(timeout=30)
+            except queue.Empty:
+                self.tracker.expire()
+                continue
+
+            c = self.get_client()
+            if c is None or (spool and not c.is_connected()):
+                store = self.get_spool() if spool else None
+                if store is not None:
+                    store.put(topic, payload, qos=qos, retain=retain)
+                else:
+                    self.dropped += 1
+                continue
+
+            if self.tracker.inflight >= self.max_inflight:
+                self.backpressure_waits += 1
+                # Expired entries also reopen the window, so this cannot stall forever
+                while not self.tracker.wait_for_window(self.max_inflight, timeout=30):
+                    self.tracker.expire()
+
+            try:
+                self.tracker.publish(c, topic, payload, qos=qos, retain=retain, enqueued_at=enqueued_at)
+            except Exception as e:
+                logger.error("✗ MQTT publish to %s failed: %s", topic, e)
+                self.tracker.failed += 1
+
+            now = time.monotonic()
+            if now - last_expire > 30:
+                self.tracker.expire()
+                last_expire = now
+
+    def stats(self):
+        return {
+            "queue_depth": self.depth,
+            "queued": self.queued,
+            "queue_high_watermark": self.high_watermark,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "backpressure_waits": self.backpressure_waits,
+            "policy": self.policy,
+        }
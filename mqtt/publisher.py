@@ -1,20 +1,33 @@
 # scripts/publisher.py
 from .mqtt_client import init_mqtt, publish
+from .payload import encode
+from .batch_window import BatchWindow
 from data.data_collector import read_batches
+from data.deadband import DeadbandFilter, parse_thresholds
+from data.timeseries import get_timeseries_store
+from network.network_state import get_network_state, run_nmcli
 from config import config
+from utils import log
+import json
 import time
 import threading
-import subprocess
 
 HEARTBEAT_TOPIC = "biotech/{serial}/heartbeat"
 HEARTBEAT_INTERVAL = 45  # seconds
+STATS_TOPIC = "biotech/{serial}/stats"
 HOTSPOT_NAME = "BIOTECH"
+CLASSIFICATION_TOPIC = "hydronew/ai/classification"
+
+logger = log.get_logger(__name__)
 
 
 def is_ap_active() -> bool:
     """True if the BIOTECH hotspot is active (device in AP mode, no internet)."""
+    state = get_network_state(HOTSPOT_NAME)
+    if state is not None:
+        return state.is_ap_active()
     try:
-        result = subprocess.run(
+        result = run_nmcli(
             ["nmcli", "-t", "-f", "NAME,DEVICE", "connection", "show", "--active"],
             capture_output=True,
             text=True,
@@ -35,8 +48,77 @@ def _heartbeat_loop(serial_number: str, stop_event: threading.Event):
             publish(topic, "1", QoS=1)
 
 
-def main():
-    client = init_mqtt()
+def _stats_loop(serial_number: str, stats, stop_event: threading.Event):
+    """Publish the rolling statistics summary as JSON every STATS_INTERVAL seconds."""
+    topic = STATS_TOPIC.format(serial=serial_number)
+    while not stop_event.wait(timeout=config.STATS_INTERVAL):
+        summary = stats.summary()
+        if summary:
+            publish(topic, json.dumps({"serial_number": serial_number, "stages": summary}), QoS=1)
+
+
+def _create_stats(serial_number, stop_event):
+    """RollingStats plus its publishing thread, or None when disabled or numpy is missing"""
+    if not config.STATS_ENABLED:
+        return None
+    try:
+        from data.rolling_stats import RollingStats
+        stats = RollingStats(window=config.STATS_WINDOW)
+    except RuntimeError as e:
+        logger.warning("⚠ Rolling statistics disabled: %s", e)
+        return None
+    threading.Thread(
+        target=_stats_loop,
+        args=(serial_number, stats, stop_event),
+        daemon=True,
+        name="Stats",
+    ).start()
+    logger.info("✓ Rolling statistics (%d samples/stage) every %gs → %s",
+                config.STATS_WINDOW, config.STATS_INTERVAL, STATS_TOPIC.format(serial=serial_number))
+    return stats
+
+
+def _create_preclassifier():
+    """PreClassifier from config, or None when disabled or numpy is missing"""
+    if not config.PRECLASSIFY_ENABLED:
+        return None
+    try:
+        from data.preclassifier import PreClassifier, parse_ranges
+        classifier = PreClassifier(
+            parse_ranges(config.PRECLASSIFY_RANGES),
+            anomaly_score=config.PRECLASSIFY_ANOMALY_SCORE,
+            normal_every=config.PRECLASSIFY_NORMAL_EVERY,
+        )
+    except RuntimeError as e:
+        logger.warning("⚠ Pre-classifier disabled: %s", e)
+        return None
+    if config.PRECLASSIFY_NORMAL_EVERY:
+        logger.info("✓ Pre-classifier: forwarding 1 in %d normal batches", config.PRECLASSIFY_NORMAL_EVERY)
+    else:
+        logger.info("✓ Pre-classifier: forwarding suspect/anomalous batches only")
+    return classifier
+
+
+def _publish_batches(serial_number, batches, timestamps, windowed=False):
+    """Encode one or more batches into a single message and publish it"""
+    # Text format: serial number on first line, sensor data on the next lines
+    # Binary format (PAYLOAD_FORMAT=binary): see mqtt/payload.py
+    message = encode(serial_number, batches, timestamps, config.PAYLOAD_FORMAT, text_timestamps=windowed)
+
+    # Publish with QoS 1 for guaranteed delivery; spooled to disk while offline
+    publish(CLASSIFICATION_TOPIC, message, QoS=1, spool=True)
+    logger.debug("✓ %d batch(es) published to MQTT", len(batches), extra=log.fields(bytes=len(message)))
+
+
+def main(stop_event=None, heartbeat=True, role="publisher"):
+    """
+    Read serial batches and publish them until interrupted
+    stop_event: threading.Event that ends the loop (within one serial read timeout)
+    heartbeat:  run the heartbeat thread here (runtime.py runs its own)
+    role:       client id role if this creates the MQTT client (main.py and
+                runtime.py create it first, as "device")
+    """
+    client = init_mqtt(role=role)
 
     # Give MQTT client time to establish connection
     time.sleep(1)
@@ -45,41 +127,98 @@ def main():
     heartbeat_topic = HEARTBEAT_TOPIC.format(serial=serial_number)
 
     stop_heartbeat = threading.Event()
-    heartbeat_thread = threading.Thread(
-        target=_heartbeat_loop,
-        args=(serial_number, stop_heartbeat),
-        daemon=True,
-        name="Heartbeat",
-    )
-    heartbeat_thread.start()
+    if heartbeat:
+        threading.Thread(
+            target=_heartbeat_loop,
+            args=(serial_number, stop_heartbeat),
+            daemon=True,
+            name="Heartbeat",
+        ).start()
+
+    logger.info("=" * 60)
+    logger.info("✓ Publisher running for device: %s", serial_number)
+    logger.info("✓ Heartbeat every %ds → %s", HEARTBEAT_INTERVAL, heartbeat_topic)
+    logger.info("✓ Publishing sensor data with QoS 1 (guaranteed delivery)")
+    logger.info("=" * 60)
+
+    window = None
+    if config.PUBLISH_WINDOW_BATCHES > 1 or config.PUBLISH_WINDOW_SECONDS > 0:
+        window = BatchWindow(
+            lambda batches, timestamps: _publish_batches(serial_number, batches, timestamps, windowed=True),
+            serial_number,
+            max_batches=config.PUBLISH_WINDOW_BATCHES if config.PUBLISH_WINDOW_BATCHES > 1 else 10_000,
+            max_seconds=config.PUBLISH_WINDOW_SECONDS,
+            max_bytes=config.PUBLISH_WINDOW_MAX_BYTES,
+            payload_format=config.PAYLOAD_FORMAT,
+        )
+        logger.info("✓ Windowed publishing: up to %d batches / %ss / %d B per message",
+                    config.PUBLISH_WINDOW_BATCHES, config.PUBLISH_WINDOW_SECONDS, config.PUBLISH_WINDOW_MAX_BYTES)
 
-    print(f"\n{'='*60}")
-    print(f"✓ Publisher running for device: {serial_number}")
-    print(f"✓ Heartbeat every {HEARTBEAT_INTERVAL}s → {heartbeat_topic}")
-    print(f"✓ Publishing sensor data with QoS 1 (guaranteed delivery)")
-    print(f"{'='*60}\n")
+    stats = _create_stats(serial_number, stop_heartbeat)
 
-    print("Listening for serial data batches...")
+    history = get_timeseries_store()
+    if history is not None:
+        logger.info("✓ Recording sensor history → %s", history.path)
 
-    try:
-        for batch_data in read_batches():
-            print(f"[{time.strftime('%H:%M:%S')}] Batch received from serial")
+    classifier = _create_preclassifier()
 
-            # Format: serial number on first line, sensor data on second line
-            message = f"device_serial_number:{serial_number}\n{batch_data}"
+    deadband = None
+    if config.DEADBAND_ENABLED:
+        deadband = DeadbandFilter(
+            parse_thresholds(config.DEADBAND_THRESHOLDS, default=config.DEADBAND_DEFAULT),
+            max_silence=config.DEADBAND_MAX_SILENCE,
+        )
+        logger.info("✓ Deadband publishing: default %s, max silence %gs",
+                    config.DEADBAND_DEFAULT, config.DEADBAND_MAX_SILENCE)
+
+    logger.info("Listening for serial data batches...")
 
-            # Publish with QoS 1 for guaranteed delivery
-            publish("hydronew/ai/classification", message, QoS=1)
-            print(f"[{time.strftime('%H:%M:%S')}] ✓ Batch published to MQTT\n")
+    try:
+        for batch_data in read_batches(stop_event):
+            logger.debug("Batch received from serial")
+            if stats is not None:
+                stats.update_batch(batch_data)
+            if history is not None:
+                try:
+                    history.append_batch(batch_data)
+                except Exception as e:
+                    logger.warning("⚠ Failed to record sensor history: %s", e)
+            if classifier is not None:
+                tag, score = classifier.classify(batch_data)
+                batch_data.tag, batch_data.score = tag, score  # sent with the batch (mqtt/payload.py)
+                if not classifier.should_forward(tag):
+                    logger.debug("⏳ Batch %s (score %.2f), not published", tag, score)
+                    continue
+                if tag != "normal":
+                    logger.warning("⚠ Batch %s (score %.2f)", tag, score)
+            if deadband is not None:
+                batch_data = deadband.filter_batch(batch_data)
+                if batch_data is None:
+                    logger.debug("⏳ Batch within deadband, not published")
+                    continue
+            if window is not None:
+                window.add(batch_data)
+            else:
+                _publish_batches(serial_number, [batch_data], [batch_data.wall_time()])
     except KeyboardInterrupt:
-        print("\nPublisher shutting down...")
+        logger.info("Publisher shutting down...")
     except Exception as e:
-        print(f"Error in publisher: {e}")
+        logger.error("Error in publisher: %s", e)
         raise
     finally:
+        if window is not None:
+            window.close()  # Don't lose a partly filled window on shutdown
+        if history is not None:
+            history.close()  # Write the partly filled chunks
+        if classifier is not None:
+            logger.info("✓ Pre-classifier: %s", classifier.stats())
+        if deadband is not None:
+            counts = deadband.stats()
+            logger.info("✓ Deadband: %d lines sent, %d suppressed (%d B saved)",
+                        counts["sent"], counts["suppressed"], counts["bytes_suppressed"])
         stop_heartbeat.set()
         publish(heartbeat_topic, "0", QoS=1)
-        print("✓ Heartbeat published 0 (offline)")
+        logger.info("✓ Heartbeat published 0 (offline)")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,102 @@
+"""
+Serial Framing - Incremental, buffer-based line framer for Arduino output
+Bytes are appended to one reusable bytearray, complete lines are located in
+place and only lines that survive the ack/error filter are decoded
+"""
+
+# Arduino command acknowledgments (V1 ON, P2 OFF, ...) and error messages
+ACK_SUFFIXES = (b" ON", b" OFF")
+ERROR_PREFIX = b"ERR "
+
+_WHITESPACE = frozenset(b" \t\r\n\x0b\x0c")
+
+
+class LineFramer:
+    """
+    Splits a byte stream into filtered, decoded lines
+
+    feed() may be called with arbitrary chunks; a line split across two
+    chunks is completed on the next call. Partial lines longer than
+    max_line_length are discarded so a noisy port cannot grow the buffer;
+    the rest of such a line is skipped up to its newline rather than
+    framed as a line of its own.
+    """
+
+    def __init__(self, max_line_length=1024):
+        self.max_line_length = max_line_length
+        self._buf = bytearray()
+        self._scan_from = 0
+        self._discarding = False    # inside an overlong line, skip to the next newline
+        self.lines_framed = 0       # complete lines seen (including filtered ones)
+        self.lines_filtered = 0     # acks, errors and blank lines
+        self.lines_undecodable = 0  # lines that were not valid UTF-8
+        self.bytes_discarded = 0    # overlong partial lines
+
+    def reset(self):
+        """Drop any buffered partial line (e.g. after a reconnect)"""
+        self._buf.clear()
+        self._scan_from = 0
+        self._discarding = False
+
+    def feed(self, data, out):
+        """
+        Append data to the buffer and append every complete, accepted line
+        to out (any object with append()). Returns the number of lines added.
+        """
+        if self._discarding:
+            newline = data.find(b"\n")
+            if newline == -1:
+                self.bytes_discarded += len(data)
+                return 0
+            self.bytes_discarded += newline + 1
+            self._discarding = False
+            data = data[newline + 1:]
+        buf = self._buf
+        buf += data
+        added = 0
+        start = 0
+        newline = buf.find(b"\n", self._scan_from)
+
+        with memoryview(buf) as view:
+            while newline != -1:
+                begin, end = start, newline
+                while begin < end and buf[begin] in _WHITESPACE:
+                    begin += 1
+                while end > begin and buf[end - 1] in _WHITESPACE:
+                    end -= 1
+                start = newline + 1
+                newline = buf.find(b"\n", start)
+                self.lines_framed += 1
+
+                if (
+                    begin == end
+                    or buf.endswith(ACK_SUFFIXES, begin, end)
+                    or buf.startswith(ERROR_PREFIX, begin, end)
+                ):
+                    self.lines_filtered += 1
+                    continue
+
+                try:
+                    out.append(str(view[begin:end], "utf-8"))
+                    added += 1
+                except UnicodeDecodeError:
+                    self.lines_undecodable += 1
+
+        # Compact once per feed instead of once per line
+        if start:
+            del buf[:start]
+        if len(buf) > self.max_line_length:
+            self.bytes_discarded += len(buf)
+            buf.clear()
+            self._discarding = True
+        self._scan_from = len(buf)
+        return added
+
+    def stats(self):
+        return {
+            "lines_framed": self.lines_framed,
+            "lines_filtered": self.lines_filtered,
+            "lines_undecodable": self.lines_undecodable,
+            "bytes_discarded": self.bytes_discarded,
+            "buffered_bytes": len(self._buf),
+        }
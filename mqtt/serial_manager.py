@@ -1,11 +1,57 @@
 """
 Serial Manager - Single shared serial connection for Arduino communication
 Handles both reading sensor data batches and sending control commands
+
+Two modes are supported:
+- half-duplex (default): reads and writes share one lock
+- full-duplex (SERIAL_FULL_DUPLEX=1): a reader thread owns the receive side
+  and commands go through a writer queue, so a pump/valve command never
+  waits behind an idle readline()
 """
+import queue
 import serial
 import time
 import threading
+from collections import deque
 from config import config
+from utils import metrics
+from utils.latency import LatencyRecorder
+from .serial_framing import LineFramer
+from .batch_assembler import BatchAssembler
+
+READ_TIMEOUT = 2          # seconds, serial read timeout
+POLL_TIMEOUT = 0.02       # seconds, port timeout while waiting against a shorter deadline
+RX_QUEUE_SIZE = 256       # lines buffered between reader thread and consumers
+
+
+class _PendingCommand:
+    """A command waiting in the writer queue"""
+    __slots__ = ("command", "enqueued_at", "done", "sent", "started", "cancelled", "_lock")
+
+    def __init__(self, command):
+        self.command = command
+        self.enqueued_at = time.monotonic()
+        self.done = threading.Event()
+        self.sent = False
+        self.started = False
+        self.cancelled = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Writer side: claim the command for writing; False if it was cancelled"""
+        with self._lock:
+            if self.cancelled:
+                return False
+            self.started = True
+            return True
+
+    def cancel(self):
+        """Caller side: drop the command if the writer has not started it; False if too late"""
+        with self._lock:
+            if self.started:
+                return False
+            self.cancelled = True
+            return True
 
 
 class SerialManager:
@@ -28,8 +74,26 @@ class SerialManager:
         self.ser = None
         self.connected = False
         self._write_lock = threading.Lock()
+        self.full_duplex = config.SERIAL_FULL_DUPLEX
+        self.command_gap = config.SERIAL_COMMAND_GAP
+        # Enqueue-to-wire latency of every command (full-duplex mode)
+        self.command_latency = LatencyRecorder()
+        self.rx_dropped = 0
+        # Bulk line framing: one reusable buffer, decoded lines wait here
+        self._framer = LineFramer()
+        self._pending_lines = deque()
+        self._pending_ts = deque()  # arrival time of each line in _pending_lines
+        self.assembler = None  # created by read_batches()
+        self._tx_queue = queue.Queue()
+        self._rx_queue = queue.Queue(maxsize=RX_QUEUE_SIZE)
+        self._stop_io = threading.Event()
+        self._port_ready = threading.Event()  # cleared while reconnect() replaces the port
+        self._port_ready.set()
+        self._io_threads = []
         self._initialized = True
         self._connect()
+        if self.full_duplex:
+            self._start_io_threads()
     
     def _connect(self):
         """Establish serial connection with retry logic"""
@@ -37,7 +101,7 @@ class SerialManager:
             self.ser = serial.Serial(
                 config.SERIAL_PORT, 
                 config.SERIAL_BAUD, 
-                timeout=2,          # Increased read timeout for stability
+                timeout=READ_TIMEOUT,  # Increased read timeout for stability
                 write_timeout=1     # Write timeout to prevent blocking
             )
             self.connected = True
@@ -48,56 +112,128 @@ class SerialManager:
             self.connected = False
     
     def reconnect(self):
-        """Attempt to reconnect to serial port"""
-        if self.ser:
-            try:
-                self.ser.close()
-            except Exception:
-                pass
-        
-        print("Attempting to reconnect...")
-        time.sleep(2)
-        
+        """
+        Attempt to reconnect to serial port
+        The full-duplex writer pauses until the new port is in place; the
+        old port is closed and the new one opened under the write lock.
+        """
+        _RECONNECTS.inc()
+        self._port_ready.clear()
         try:
-            self.ser = serial.Serial(
-                config.SERIAL_PORT, 
-                config.SERIAL_BAUD, 
-                timeout=2,          # Increased read timeout for stability
-                write_timeout=1     # Write timeout to prevent blocking
-            )
-            self.connected = True
-            print("✓ Serial port reconnected!")
-            return True
-        except Exception as e:
-            print(f"Reconnection failed: {e}")
-            self.connected = False
-            return False
+            with self._write_lock:
+                if self.ser:
+                    try:
+                        self.ser.close()
+                    except Exception:
+                        pass
+            
+            print("Attempting to reconnect...")
+            time.sleep(2)
+            self._framer.reset()
+            self._pending_lines.clear()
+            self._pending_ts.clear()
+            
+            with self._write_lock:
+                try:
+                    self.ser = serial.Serial(
+                        config.SERIAL_PORT, 
+                        config.SERIAL_BAUD, 
+                        timeout=READ_TIMEOUT,  # Increased read timeout for stability
+                        write_timeout=1     # Write timeout to prevent blocking
+                    )
+                    self.connected = True
+                    print("✓ Serial port reconnected!")
+                    return True
+                except Exception as e:
+                    print(f"Reconnection failed: {e}")
+                    self.connected = False
+                    return False
+        finally:
+            self._port_ready.set()
     
-    def wait_for_connection(self):
-        """Block until serial connection is established"""
+    def wait_for_connection(self, stop_event=None):
+        """
+        Block until serial connection is established
+        stop_event: threading.Event that ends the wait early
+        Returns: True once connected, False if stop_event was set first
+        """
         if self.connected:
-            return
+            return True
         
         print("Waiting for serial connection...")
+        stop_event = stop_event or threading.Event()
         while not self.connected:
-            time.sleep(5)
+            if stop_event.wait(5):
+                return False
             print("Still waiting for serial port... (program continues running)")
-            if self.reconnect():
+            # In full-duplex mode the reader thread owns reconnects
+            if not self.full_duplex and self.reconnect():
                 break
+        return True
     
-    def write_command(self, command):
-        """
-        Send a command to Arduino with thread safety
-        Commands should be formatted as: "P1=1\n" or "V2=0\n"
-        Returns: True if sent successfully, False otherwise
-        
-        Uses shared lock to prevent simultaneous read/write operations
-        """
-        if not self.connected or self.ser is None:
-            print(f"⚠ Cannot send command: No serial connection")
-            return False
-        
+    def _start_io_threads(self):
+        """Start the reader and writer threads used in full-duplex mode"""
+        if self._io_threads:
+            return
+        self._stop_io.clear()
+        for target, name in ((self._reader_loop, "Serial-Reader"),
+                             (self._writer_loop, "Serial-Writer")):
+            thread = threading.Thread(target=target, daemon=True, name=name)
+            thread.start()
+            self._io_threads.append(thread)
+        print("✓ Serial full-duplex mode (reader thread + command queue)")
+    
+    def _reader_loop(self):
+        """Full-duplex reader: the only thread that touches the receive side"""
+        while not self._stop_io.is_set():
+            if not self.connected or self.ser is None:
+                time.sleep(3)
+                if not self._stop_io.is_set():
+                    self.reconnect()
+                continue
+            
+            stamped = self._read_stamped_line()
+            if stamped is None:
+                continue
+            try:
+                self._rx_queue.put_nowait(stamped)
+            except queue.Full:
+                # Consumer is behind: drop the oldest line, keep the newest
+                try:
+                    self._rx_queue.get_nowait()
+                except queue.Empty:
+                    pass
+                self.rx_dropped += 1
+                self._rx_queue.put_nowait(stamped)
+    
+    def _writer_loop(self):
+        """Full-duplex writer: drains the command queue onto the wire"""
+        while not self._stop_io.is_set():
+            pending = self._tx_queue.get()
+            if pending is None:
+                break
+            # Hold commands while reconnect() swaps the port
+            while not self._port_ready.wait(timeout=READ_TIMEOUT):
+                if self._stop_io.is_set():
+                    return
+            if not pending.start():
+                continue  # caller timed out and already reported failure
+            pending.sent = self._write_now(pending.command)
+            if pending.sent:
+                self.command_latency.record(time.monotonic() - pending.enqueued_at)
+            pending.done.set()
+            # Give the Arduino time to consume the command; only delays the
+            # next queued command, never the read side
+            if self.command_gap:
+                time.sleep(self.command_gap)
+    
+    def _write_now(self, command):
+        """Write one command to the port. Returns True on success"""
+        started = time.perf_counter()
         with self._write_lock:
+            _WRITE_LOCK_WAIT.observe(time.perf_counter() - started)
+            if not self.connected or self.ser is None:
+                return False
             try:
                 # Ensure command ends with newline
                 if not command.endswith('\n'):
@@ -105,9 +241,6 @@ class SerialManager:
                 
                 self.ser.write(command.encode())
                 self.ser.flush()  # Force immediate transmission
-                time.sleep(0.05)  # Small delay for buffer to settle (50ms)
-                # Don't wait for response - Arduino response will be ignored
-                # This prevents timing delays and data corruption
                 return True
             except serial.SerialException as e:
                 print(f"✗ Serial write error: {e}")
@@ -117,45 +250,138 @@ class SerialManager:
                 print(f"✗ Unexpected error during write: {e}")
                 return False
     
-    def read_line(self):
+    def write_command(self, command, wait=True):
+        """
+        Send a command to Arduino with thread safety
+        Commands should be formatted as: "P1=1\n" or "V2=0\n"
+        Returns: True if sent successfully, False otherwise
+        
+        Half-duplex: uses shared lock to prevent simultaneous read/write operations
+        Full-duplex: enqueues for the writer thread; with wait=True blocks until
+        the command is on the wire (or SERIAL_COMMAND_TIMEOUT expires)
+        """
+        if not self.connected or self.ser is None:
+            print(f"⚠ Cannot send command: No serial connection")
+            return False
+        
+        if self.full_duplex:
+            pending = _PendingCommand(command)
+            self._tx_queue.put(pending)
+            if not wait:
+                return True
+            if not pending.done.wait(timeout=config.SERIAL_COMMAND_TIMEOUT):
+                if pending.cancel():
+                    print(f"✗ Serial command timed out in queue: {command.strip()}")
+                    return False
+                # Already being written: the result is moments away (write_timeout)
+                pending.done.wait()
+            return pending.sent
+        
+        sent = self._write_now(command)
+        if sent:
+            time.sleep(self.command_gap)  # Small delay for buffer to settle (50ms)
+        # Don't wait for response - Arduino response will be ignored
+        # This prevents timing delays and data corruption
+        return sent
+    
+    def framing_stats(self):
+        """Counters from the line framer (framed, filtered, undecodable lines)"""
+        return self._framer.stats()
+    
+    def command_stats(self):
+        """Enqueue-to-wire latency summary for queued commands (milliseconds)"""
+        stats = self.command_latency.snapshot()
+        stats["queued"] = self._tx_queue.qsize()
+        return stats
+    
+    def _set_read_timeout(self, timeout):
+        # Changing the timeout reconfigures the port (tcsetattr), so callers
+        # only ever use READ_TIMEOUT or POLL_TIMEOUT
+        if self.ser.timeout != timeout:
+            self.ser.timeout = timeout
+    
+    def _read_stamped_line(self, timeout=None):
+        """
+        Return the next filtered line from the port (caller handles locking)
+        Returns: (monotonic arrival time, decoded string) or None on timeout / error
+        timeout: seconds to wait for a complete line (default READ_TIMEOUT)
+
+        Reads whatever is waiting in one call and frames it with LineFramer;
+        command acknowledgments (V1 ON, P2 OFF, ...) and ERR messages are
+        dropped before decoding so they never reach batch assembly.
+        """
+        pending = self._pending_lines
+        if pending:
+            return self._pending_ts.popleft(), pending.popleft()
+        
+        deadline = None
+        if timeout is not None and timeout < READ_TIMEOUT:
+            # Poll in POLL_TIMEOUT steps instead of setting the port timeout
+            # to the remaining time on every call
+            deadline = time.monotonic() + timeout
+        try:
+            self._set_read_timeout(READ_TIMEOUT if deadline is None else POLL_TIMEOUT)
+            while not pending:
+                waiting = self.ser.in_waiting
+                if not waiting and deadline is not None and time.monotonic() >= deadline:
+                    return None
+                # Nothing waiting: block for the first byte (up to the port timeout)
+                chunk = self.ser.read(waiting or 1)
+                if not chunk:
+                    if deadline is None:
+                        return None
+                    continue
+                if not waiting:
+                    waiting = self.ser.in_waiting
+                    if waiting:
+                        chunk += self.ser.read(waiting)
+                arrived = time.monotonic()
+                before = len(pending)
+                self._framer.feed(chunk, pending)
+                self._pending_ts.extend([arrived] * (len(pending) - before))
+            return self._pending_ts.popleft(), pending.popleft()
+        except serial.SerialException as e:
+            print(f"Serial connection lost: {e}")
+            self.connected = False
+            return None
+        except Exception as e:
+            print(f"Read error: {e}")
+            return None
+    
+    def read_line(self, timeout=None):
         """
         Read a single line from Arduino
         Returns: decoded string or None if failed
         Filters out command acknowledgments to prevent data corruption
+        timeout: seconds to wait for a line (default READ_TIMEOUT)
         
-        Uses shared lock to prevent simultaneous read/write operations
+        Half-duplex: uses shared lock to prevent simultaneous read/write operations
+        Full-duplex: takes the next line buffered by the reader thread
         """
+        stamped = self._next_line(timeout)
+        return stamped[1] if stamped is not None else None
+    
+    def _next_line(self, timeout=None):
+        """read_line() with the line's arrival time: (monotonic time, line) or None"""
+        if self.full_duplex:
+            try:
+                return self._rx_queue.get(timeout=READ_TIMEOUT if timeout is None else timeout)
+            except queue.Empty:
+                return None
+        
         if not self.connected or self.ser is None:
             return None
         
+        started = time.perf_counter()
         with self._write_lock:  # Share the same lock for thread safety
-            try:
-                raw = self.ser.readline().decode().strip()
-                if not raw:
-                    return None
-                
-                # Filter out command acknowledgments (V1 ON, P2 OFF, etc.)
-                # These don't match sensor data format and should be ignored
-                if raw.endswith(" ON") or raw.endswith(" OFF"):
-                    # This is a command acknowledgment, skip it
-                    return None
-                
-                # Filter out error messages
-                if raw.startswith("ERR "):
-                    return None
-                    
-                return raw
-            except serial.SerialException as e:
-                print(f"Serial connection lost: {e}")
-                self.connected = False
-                return None
-            except Exception as e:
-                print(f"Read error: {e}")
-                return None
+            _READ_LOCK_WAIT.observe(time.perf_counter() - started)
+            return self._read_stamped_line(timeout)
     
-    def read_batches(self):
+    def read_batches(self, stop_event=None):
         """
-        Generator that yields sensor data batches.
+        Generator that yields sensor data batches (SensorBatch objects).
+        stop_event: threading.Event that ends the generator (within one read
+        timeout), after yielding any partly collected cycle.
 
         Behavior:
         - Arduino prints between 1 and 3 stage lines per cycle:
@@ -163,74 +389,58 @@ class SerialManager:
         - We group together all stage lines that arrive in the same cycle.
         - If only one or two stages are printed (because of level thresholds),
           we still yield a batch with just those lines.
-        - Batches are separated by idle periods on the serial line (read timeout)
-          or when all 3 stages have been seen.
+        - A batch is yielded as soon as all 3 stages have been seen, when the
+          line stops for longer than the learned inter-line gap, or when the
+          cycle deadline (from the first line) expires.
+        - str(batch) is the newline-joined stage lines; batch.first_ts and
+          batch.last_ts are the monotonic arrival times of its first/last line.
         """
-        self.wait_for_connection()
+        if not self.wait_for_connection(stop_event):
+            return
         
-        batch = {
-            "dirty_water": None,
-            "clean_water": None,
-            "hydroponics_water": None
-        }
+        self.assembler = assembler = BatchAssembler(
+            cycle_deadline=config.BATCH_CYCLE_DEADLINE,
+            gap_factor=config.BATCH_GAP_FACTOR,
+            min_gap=config.BATCH_MIN_GAP,
+        )
         
         while True:
-            raw = self.read_line()
+            if stop_event is not None and stop_event.is_set():
+                batch = assembler.flush()
+                if batch is not None:
+                    yield batch
+                return
+            # Wait only as long as the pending cycle may stay open
+            stamped = self._next_line(timeout=assembler.time_until_flush(time.monotonic()))
 
             # Handle disconnection
-            if raw is None:
-                if not self.connected:
+            if stamped is None:
+                now = time.monotonic()
+                if not self.connected and not self.full_duplex:
                     self.reconnect()
                     continue
 
-                # Timeout / idle period but still connected:
+                # Deadline reached / idle period but still connected:
                 # if we have at least one stage collected, flush it as a batch.
-                if any(batch.values()):
-                    combined_lines = [
-                        line for key, line in batch.items() if line is not None
-                    ]
-                    if combined_lines:
-                        yield "\n".join(combined_lines)
-
-                    # Reset for next cycle
-                    batch = {
-                        "dirty_water": None,
-                        "clean_water": None,
-                        "hydroponics_water": None
-                    }
-                continue
-
-            if not raw:
-                continue
-
-            try:
-                parts = raw.split(",")
-                stage = parts[0]
-
-                # Store the raw line as-is
-                if stage in batch:
-                    batch[stage] = raw
-            except Exception:
+                batch = assembler.flush_due(now)
+                if batch is None and not self.connected:
+                    batch = assembler.flush()
+                if batch is not None:
+                    yield batch
                 continue
 
-            # All 3 stages complete → yield as separate lines immediately
-            if all(batch.values()):
-                combined = "\n".join([
-                    batch["dirty_water"],
-                    batch["clean_water"],
-                    batch["hydroponics_water"]
-                ])
-                yield combined
-
-                # Reset for next cycle
-                batch = {
-                    "dirty_water": None,
-                    "clean_water": None,
-                    "hydroponics_water": None
-                }
+            # Arrival time, not dequeue time: lines can wait in the rx queue
+            arrived, raw = stamped
+            batch = assembler.add(raw, arrived)
+            if batch is not None:
+                yield batch
     
     def close(self):
         """Close serial connection"""
+        if self._io_threads:
+            self._stop_io.set()
+            self._tx_queue.put(None)  # Wake the writer thread
+            self._io_threads = []
         if self.ser:
             try:
                 self.ser.close()
@@ -242,5 +452,39 @@ class SerialManager:
                 self.ser = None
 
 
+_lock_wait = metrics.histogram(
+    "serial_lock_wait_seconds", "Time spent waiting for the serial port lock", ("op",))
+_WRITE_LOCK_WAIT = _lock_wait.labels("write")
+_READ_LOCK_WAIT = _lock_wait.labels("read")
+_RECONNECTS = metrics.counter("serial_reconnects_total", "Serial port reconnect attempts")
+
+_SERIAL_COUNTERS = {
+    "lines_framed": "counter", "lines_filtered": "counter", "lines_undecodable": "counter",
+    "bytes_discarded": "counter", "rx_dropped": "counter", "parsed": "counter", "malformed": "counter",
+    "unknown_fields": "counter", "missing_fields": "counter", "invalid_values": "counter",
+    "batches_complete": "counter", "batches_partial": "counter",
+}
+
+
+def _collect_serial():
+    """Scrape-time bridge from SerialManager's own counters to metrics"""
+    manager = SerialManager._instance
+    if manager is None or not getattr(manager, "_initialized", False):
+        return []
+    stats = {**manager.framing_stats(), "rx_dropped": manager.rx_dropped,
+             "rx_queue_depth": manager._rx_queue.qsize(), "tx_queue_depth": manager._tx_queue.qsize(),
+             "connected": manager.connected}
+    if manager.assembler is not None:
+        stats.update(manager.assembler.stats())
+        stats.pop("avg_gap_ms", None)
+        stats.pop("gap_threshold_ms", None)
+    families = metrics.stats_families("serial", stats, _SERIAL_COUNTERS, help_prefix="Serial ")
+    families.append(metrics.latency_family(
+        "serial_command_latency_seconds", "Command enqueue-to-wire latency", manager.command_latency))
+    return families
+
+
+metrics.register_collector(_collect_serial)
+
 # Create singleton instance
 serial_manager = SerialManager()
@@ -0,0 +1,201 @@
+"""
+Spool - Crash-safe store-and-forward queue for MQTT messages
+Messages that cannot be published (no client, broker or Wi-Fi down) are kept
+in an SQLite database in WAL mode, bounded in size with oldest-first
+eviction, and drained at a controlled rate once the client is connected
+"""
+import os
+import sqlite3
+import threading
+import time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS spool (
+    id      INTEGER PRIMARY KEY AUTOINCREMENT,
+    topic   TEXT    NOT NULL,
+    payload BLOB    NOT NULL,
+    qos     INTEGER NOT NULL,
+    retain  INTEGER NOT NULL,
+    created REAL    NOT NULL
+)
+"""
+
+
+class Spool:
+    """
+    Bounded on-disk FIFO of (topic, payload, qos, retain)
+
+    max_bytes: total payload size kept; the oldest messages are evicted first
+    sync:      SQLite synchronous level. "NORMAL" (default) survives process
+               crashes and only risks the last commits on power loss; "FULL"
+               fsyncs every put
+    """
+
+    def __init__(self, path, max_bytes=50 * 1024 * 1024, sync="NORMAL"):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(f"PRAGMA synchronous={sync}")
+        self._db.execute(_SCHEMA)
+        count, size = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM spool"
+        ).fetchone()
+        self._count = count
+        self._bytes = size
+        self.evicted = 0
+        self.spooled = 0
+        self.forwarded = 0
+        self.not_empty = threading.Event()
+        if count:
+            self.not_empty.set()
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def put(self, topic, payload, qos=1, retain=False):
+        """Append one message, evicting the oldest ones if over max_bytes"""
+        if isinstance(payload, str):
+            payload = payload.encode()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO spool (topic, payload, qos, retain, created) VALUES (?, ?, ?, ?, ?)",
+                (topic, payload, qos, int(retain), time.time()),
+            )
+            self._count += 1
+            self._bytes += len(payload)
+            self.spooled += 1
+            if self._bytes > self.max_bytes:
+                self._evict()
+        self.not_empty.set()
+
+    def _evict(self):
+        # Caller holds the lock
+        while self._bytes > self.max_bytes and self._count > 1:
+            rows = self._db.execute(
+                "SELECT id, LENGTH(payload) FROM spool ORDER BY id LIMIT 64"
+            ).fetchall()
+            victims = []
+            for row_id, size in rows:
+                if self._bytes <= self.max_bytes or self._count - len(victims) <= 1:
+                    break
+                victims.append(row_id)
+                self._bytes -= size
+            self._delete(victims)
+            self.evicted += len(victims)
+
+    def peek(self, limit=1, after_id=0):
+        """Oldest messages with id > after_id: list of (id, topic, payload, qos, retain)"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT id, topic, payload, qos, retain FROM spool WHERE id > ? ORDER BY id LIMIT ?",
+                (after_id, limit),
+            ).fetchall()
+
+    def ack(self, ids):
+        """Remove delivered messages"""
+        if not ids:
+            return
+        with self._lock:
+            sizes = self._db.execute(
+                f"SELECT COALESCE(SUM(LENGTH(payload)), 0) FROM spool WHERE id IN ({','.join('?' * len(ids))})",
+                list(ids),
+            ).fetchone()[0]
+            self._bytes -= sizes
+            self.forwarded += self._delete(ids)
+            if not self._count:
+                self.not_empty.clear()
+
+    def _delete(self, ids):
+        # Caller holds the lock; returns the number of rows removed
+        if not ids:
+            return 0
+        cursor = self._db.execute(
+            f"DELETE FROM spool WHERE id IN ({','.join('?' * len(ids))})", list(ids)
+        )
+        self._count -= cursor.rowcount
+        return cursor.rowcount
+
+    def stats(self):
+        return {
+            "queued": self._count,
+            "bytes": self._bytes,
+            "spooled": self.spooled,
+            "forwarded": self.forwarded,
+            "evicted": self.evicted,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class SpoolDrainer:
+    """
+    Background thread that forwards spooled messages once MQTT is connected
+
+    rate:         max spooled messages published per second, so live data
+                  keeps most of the link and paho's in-flight window
+    max_inflight: spooled messages awaiting PUBACK at any time
+    tracker:      PublishTracker to publish through, so drained messages are
+                  tracked like live ones
+    A message is removed from the spool only after its PUBACK (QoS 1/2) or
+    after paho wrote it to the socket (QoS 0).
+    """
+
+    def __init__(self, spool, get_client, rate=5.0, max_inflight=10, tracker=None):
+        self.spool = spool
+        self.get_client = get_client
+        self.tracker = tracker
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.max_inflight = max_inflight
+        self._inflight = {}  # spool id -> MQTTMessageInfo
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="MQTT-Spool-Drainer")
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.spool.not_empty.set()  # Wake the thread
+
+    def _settle(self):
+        done = [row_id for row_id, info in self._inflight.items() if info.is_published()]
+        for row_id in done:
+            del self._inflight[row_id]
+        self.spool.ack(done)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.spool.not_empty.wait()
+            if self._stop.is_set():
+                break
+
+            c = self.get_client()
+            if c is None or not c.is_connected():
+                # Anything in flight will be re-sent from the spool later
+                self._inflight.clear()
+                self._stop.wait(1)
+                continue
+
+            self._settle()
+            if len(self._inflight) < self.max_inflight:
+                after_id = max(self._inflight, default=0)
+                for row_id, topic, payload, qos, retain in self.spool.peek(1, after_id):
+                    if self.tracker is not None:
+                        info = self.tracker.publish(c, topic, payload, qos=qos, retain=bool(retain))
+                    else:
+                        info = c.publish(topic, payload=payload, qos=qos, retain=bool(retain))
+                    self._inflight[row_id] = info
+            self._stop.wait(self.interval or 0.01)
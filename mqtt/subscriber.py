@@ -1,9 +1,32 @@
 from .mqtt_client import init_mqtt, subscribe, publish
 from controls.controls import open_valve, close_valve, open_pump, close_pump
+from controls.executor import ActuatorExecutor
 from config import config
+from utils import log, metrics
 
 SERIAL_NUMBER = config.SERIAL_NUMBER  # loaded from device_config.json
 
+logger = log.get_logger(__name__)
+
+# Commands run here, not on paho's network thread: in order per actuator,
+# in parallel across actuators
+command_executor = ActuatorExecutor(max_workers=config.COMMAND_WORKERS)
+
+
+def _collect_commands():
+    stats = command_executor.stats()
+    return [
+        ("commands_submitted_total", "counter", "Actuator commands submitted", [({}, stats["submitted"])]),
+        ("commands_failed_total", "counter", "Actuator commands that raised", [({}, stats["failed"])]),
+        ("commands_pending", "gauge", "Actuator commands waiting or running", [({}, stats["pending"])]),
+        metrics.latency_family("command_queue_latency_seconds", "Command submit-to-start latency",
+                               command_executor.queue_latency),
+        metrics.latency_family("command_run_seconds", "Command run time", command_executor.run_time),
+    ]
+
+
+metrics.register_collector(_collect_commands)
+
 
 def _publish_ack(topic, ack_message):
     """Publish acknowledgment to topic/ack so clients know the command was executed."""
@@ -18,13 +41,12 @@ def _publish_state(topic, state):
 
 
 def valve_callback(message, valve_number, topic):
-    import time
-    print(f"[{time.strftime('%H:%M:%S')}] valve/{valve_number} received: {message}")
+    logger.debug("valve/%s received: %s", valve_number, message)
     try:
         if message.upper() == "OPEN":
             success = open_valve(valve_number)
             if success:
-                print(f"✓ Valve {valve_number} opened")
+                logger.info("✓ Valve %s opened", valve_number)
                 _publish_ack(topic, "1")
                 _publish_state(topic, "1")
             else:
@@ -32,25 +54,24 @@ def valve_callback(message, valve_number, topic):
         elif message.upper() == "CLOSE":
             success = close_valve(valve_number)
             if success:
-                print(f"✓ Valve {valve_number} closed")
+                logger.info("✓ Valve %s closed", valve_number)
                 _publish_ack(topic, "1")
                 _publish_state(topic, "0")
             else:
                 _publish_ack(topic, "0")
         else:
-            print(f"⚠ Unknown valve command: {message}")
+            logger.warning("⚠ Unknown valve command: %s", message)
     except Exception as e:
-        print(f"✗ Error controlling valve {valve_number}: {e}")
+        logger.error("✗ Error controlling valve %s: %s", valve_number, e)
 
 
 def pump_callback(message, pump_number, topic):
-    import time
-    print(f"[{time.strftime('%H:%M:%S')}] pump/{pump_number} received: {message}")
+    logger.debug("pump/%s received: %s", pump_number, message)
     try:
         if message.upper() == "OPEN":
             success = open_pump(pump_number)
             if success:
-                print(f"✓ Pump {pump_number} opened")
+                logger.info("✓ Pump %s opened", pump_number)
                 _publish_ack(topic, "1")
                 _publish_state(topic, "1")
             else:
@@ -58,61 +79,54 @@ def pump_callback(message, pump_number, topic):
         elif message.upper() == "CLOSE":
             success = close_pump(pump_number)
             if success:
-                print(f"✓ Pump {pump_number} closed")
+                logger.info("✓ Pump %s closed", pump_number)
                 _publish_ack(topic, "1")
                 _publish_state(topic, "0")
             else:
                 _publish_ack(topic, "0")
         else:
-            print(f"⚠ Unknown pump command: {message}")
+            logger.warning("⚠ Unknown pump command: %s", message)
     except Exception as e:
-        print(f"✗ Error controlling pump {pump_number}: {e}")
+        logger.error("✗ Error controlling pump %s: %s", pump_number, e)
 
 
-def message_callback(message, topic):
+def message_callback(message, topic, segments=None):
     """
     Parses topic like hydroponics/<serial>/pump/1 or hydroponics/<serial>/valve/2
-    Calls correct callback dynamically
+    segments: the topic already split on '/' (passed by the topic router)
+    Hands the correct callback to the command executor and returns immediately,
+    so a slow serial line never stalls the MQTT network thread
     """
-    import time
-    
-    parts = topic.split("/")
+    parts = segments if segments is not None else topic.split("/")
     if len(parts) != 4:
-        print(f"⚠ Malformed topic: {topic} (expected format: prefix/serial/type/number)")
+        logger.warning("⚠ Malformed topic: %s (expected format: prefix/serial/type/number)", topic)
         return
 
     _, serial, device_type, number = parts
 
     # Only process messages for this device
     if serial != SERIAL_NUMBER:
-        print(f"⏩ Ignoring message for {serial}, this device is {SERIAL_NUMBER}")
+        logger.debug("⏩ Ignoring message for %s, this device is %s", serial, SERIAL_NUMBER)
         return
 
     try:
         device_number = int(number)
     except ValueError:
-        print(f"⚠ Invalid device number in topic: {topic}")
+        logger.warning("⚠ Invalid device number in topic: %s", topic)
         return
 
-    print(f"[{time.strftime('%H:%M:%S')}] Processing {device_type}/{device_number}: {message}")
+    logger.debug("Processing %s/%s: %s", device_type, device_number, message)
     
     if device_type.lower() == "pump":
-        pump_callback(message, device_number, topic)
+        command_executor.submit(("pump", device_number), pump_callback, message, device_number, topic)
     elif device_type.lower() == "valve":
-        valve_callback(message, device_number, topic)
+        command_executor.submit(("valve", device_number), valve_callback, message, device_number, topic)
     else:
-        print(f"⚠ Unknown device type '{device_type}' in topic: {topic}")
-
-
-def main():
-    import time
-    
-    client = init_mqtt()
+        logger.warning("⚠ Unknown device type '%s' in topic: %s", device_type, topic)
 
-    # Give the client a moment to establish connection
-    time.sleep(1)
 
-    # Subscribe to all pumps and valves for this device
+def subscribe_commands():
+    """Subscribe to all pumps and valves for this device"""
     subscribe(f"mfc/{SERIAL_NUMBER}/pump/+", message_callback)
     subscribe(f"hydroponics/{SERIAL_NUMBER}/pump/+", message_callback)
     subscribe(f"reservoir_fallback/{SERIAL_NUMBER}/pump/+", message_callback)
@@ -120,19 +134,29 @@ def main():
     subscribe(f"mfc/{SERIAL_NUMBER}/valve/+", message_callback)
     subscribe(f"mfc_fallback/{SERIAL_NUMBER}/valve/+", message_callback)
 
-    print(f"\n{'='*60}")
-    print(f"✓ Subscriber running for device: {SERIAL_NUMBER}")
-    print(f"✓ Listening for messages with QoS 1 (guaranteed delivery)")
-    print(f"{'='*60}\n")
+    logger.info("=" * 60)
+    logger.info("✓ Subscriber running for device: %s", SERIAL_NUMBER)
+    logger.info("✓ Listening for messages with QoS 1 (guaranteed delivery)")
+    logger.info("=" * 60)
+
+
+def main(role="device"):
+    import time
+    
+    # Bind handlers first: a persistent session delivers queued commands
+    # right after CONNACK
+    subscribe_commands()
+    client = init_mqtt(role=role)
     
     # Keep the main thread alive (loop_start already handles message processing)
     try:
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
-        print("\nShutting down subscriber...")
-        client.loop_stop()
-        client.disconnect()
+        logger.info("Shutting down subscriber...")
+        if client is not None:
+            client.loop_stop()
+            client.disconnect()
 
 
 if __name__ == "__main__":
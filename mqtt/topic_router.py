@@ -0,0 +1,125 @@
+"""
+Topic Router - Trie-based MQTT topic dispatcher
+Subscription filters (with + and # wildcards) are compiled into a trie so
+each incoming message reaches only the handlers bound to matching filters.
+Handlers are called as handler(message, topic, segments) where segments is
+the topic already split on '/'.
+"""
+import threading
+
+from utils import log
+
+logger = log.get_logger(__name__)
+
+
+class _Node:
+    __slots__ = ("children", "plus", "hash_handlers", "handlers")
+
+    def __init__(self):
+        self.children = {}        # literal segment -> _Node
+        self.plus = None          # '+' child
+        self.hash_handlers = []   # handlers of '<prefix>/#'
+        self.handlers = []        # handlers of a filter ending exactly here
+
+
+def _validate(topic_filter):
+    segments = topic_filter.split("/")
+    for index, segment in enumerate(segments):
+        if segment == "#" and index != len(segments) - 1:
+            raise ValueError(f"'#' must be the last level of a topic filter: {topic_filter}")
+        if segment not in ("+", "#") and ("+" in segment or "#" in segment):
+            raise ValueError(f"Wildcards must occupy a whole level: {topic_filter}")
+    return segments
+
+
+class TopicRouter:
+    """Maps topic filters to handlers and routes topics to matching handlers"""
+
+    def __init__(self):
+        self._root = _Node()
+        self._lock = threading.Lock()
+        self._filters = {}  # filter -> list of handlers
+
+    def add(self, topic_filter, handler):
+        """Bind handler to topic_filter (binding the same pair twice is a no-op)"""
+        segments = _validate(topic_filter)
+        with self._lock:
+            bound = self._filters.setdefault(topic_filter, [])
+            if handler in bound:
+                return
+            bound.append(handler)
+            node = self._root
+            for segment in segments:
+                if segment == "#":
+                    node.hash_handlers.append(handler)
+                    return
+                if segment == "+":
+                    if node.plus is None:
+                        node.plus = _Node()
+                    node = node.plus
+                else:
+                    child = node.children.get(segment)
+                    if child is None:
+                        child = node.children[segment] = _Node()
+                    node = child
+            node.handlers.append(handler)
+
+    def remove(self, topic_filter, handler):
+        """Unbind handler from topic_filter (empty trie nodes are left in place)"""
+        with self._lock:
+            bound = self._filters.get(topic_filter)
+            if not bound or handler not in bound:
+                return
+            bound.remove(handler)
+            if not bound:
+                del self._filters[topic_filter]
+            node = self._root
+            for segment in topic_filter.split("/"):
+                if segment == "#":
+                    node.hash_handlers.remove(handler)
+                    return
+                node = node.plus if segment == "+" else node.children[segment]
+            node.handlers.remove(handler)
+
+    def filters(self):
+        return list(self._filters)
+
+    def match(self, segments):
+        """Handlers whose filters match the split topic, without duplicates"""
+        matched = []
+        # Topics starting with '$' are not matched by a leading wildcard
+        dollar = bool(segments) and segments[0].startswith("$")
+        nodes = [self._root]
+        last = len(segments) - 1
+        for depth, segment in enumerate(segments):
+            next_nodes = []
+            for node in nodes:
+                if node.hash_handlers and not (dollar and depth == 0):
+                    matched.extend(node.hash_handlers)
+                child = node.children.get(segment)
+                if child is not None:
+                    next_nodes.append(child)
+                if node.plus is not None and not (dollar and depth == 0):
+                    next_nodes.append(node.plus)
+            if not next_nodes:
+                break
+            nodes = next_nodes
+            if depth == last:
+                for node in nodes:
+                    matched.extend(node.handlers)
+                    # 'a/#' also matches 'a'
+                    matched.extend(node.hash_handlers)
+        if len(matched) > 1:
+            matched = list(dict.fromkeys(matched))
+        return matched
+
+    def dispatch(self, message, topic):
+        """Call every matching handler; returns the number of handlers called"""
+        segments = topic.split("/")
+        handlers = self.match(segments)
+        for handler in handlers:
+            try:
+                handler(message, topic, segments)
+            except Exception as e:
+                logger.error("[MQTT] Callback error on %s: %s", topic, e)
+        return len(handlers)
@@ -0,0 +1,323 @@
+"""
+Backend Outbox - Durable, retrying delivery of backend HTTP calls
+Requests go through one keep-alive requests.Session (no new TCP+TLS
+handshake per call) and are written to an SQLite outbox first, so a
+pairing survives a failed call and a restart: a worker thread retries due
+entries with exponential backoff until they are delivered (2xx), rejected
+(4xx other than 408/425/429) or give up (OUTBOX_MAX_ATTEMPTS / OUTBOX_MAX_AGE).
+"""
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import config
+from utils import log, metrics
+
+logger = log.get_logger(__name__)
+
+PENDING = "pending"
+DELIVERED = "delivered"
+FAILED = "failed"
+
+RETRY_STATUS = {408, 425, 429}   # plus every 5xx
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    url          TEXT    NOT NULL,
+    body         TEXT,             -- NULL once the entry is no longer pending
+    ref          TEXT,
+    state        TEXT    NOT NULL,
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    created      REAL    NOT NULL,
+    updated      REAL    NOT NULL,
+    next_attempt REAL    NOT NULL,
+    status_code  INTEGER,
+    response     TEXT,
+    error        TEXT
+)
+"""
+_COLUMNS = ("id", "url", "body", "ref", "state", "attempts", "created", "updated", "next_attempt",
+            "status_code", "response", "error")
+
+_REQUEST_SECONDS = metrics.histogram(
+    "backend_request_seconds", "Backend HTTP request time by outcome", ("result",))
+
+
+class BackendClient:
+    """
+    Shared keep-alive HTTP session for backend calls
+    timeout: (connect, read) seconds; retries are the outbox's job, not urllib3's
+    """
+
+    def __init__(self, timeout=(5, 10), pool_size=2):
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def post_json(self, url, payload):
+        return self.session.post(url, json=payload, timeout=self.timeout)
+
+    def close(self):
+        self.session.close()
+
+
+class Outbox:
+    """
+    Backend requests on disk until delivered
+
+    client:       BackendClient used for every attempt
+    retry_min/max: backoff bounds in seconds (doubling, ±20% jitter; a
+                  numeric Retry-After header is honoured up to retry_max)
+    keep:         finished entries kept for status lookups
+    on_result:    called with the entry dict when an entry is delivered or fails
+    """
+
+    def __init__(self, path, client, max_attempts=20, max_age=24 * 3600, retry_min=5, retry_max=600, keep=100):
+        self.path = path
+        self.client = client
+        self.max_attempts = max_attempts
+        self.max_age = max_age
+        self.retry_min = retry_min
+        self.retry_max = retry_max
+        self.keep = keep
+        self.on_result = None
+        self._lock = threading.Lock()
+        self._inflight = set()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")  # few, important rows
+        self._db.execute(_SCHEMA)
+        self.attempts = {"delivered": 0, "retry": 0, "rejected": 0}
+
+    # ---------------- queueing ----------------
+
+    def submit(self, url, payload, ref=None):
+        """Store a POST of payload (JSON) to url for the worker; returns the entry id"""
+        entry_id = self._insert(url, payload, ref)
+        self._wake.set()
+        return entry_id
+
+    def send(self, url, payload, ref=None):
+        """Store the request and make the first attempt in the calling thread; returns the entry dict"""
+        entry_id = self._insert(url, payload, ref, claim=True)
+        return self._attempt(entry_id)
+
+    def _insert(self, url, payload, ref, claim=False):
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO outbox (url, body, ref, state, created, updated, next_attempt) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, json.dumps(payload), ref, PENDING, now, now, now),
+            )
+            if claim:
+                self._inflight.add(cursor.lastrowid)
+            return cursor.lastrowid
+
+    def retry_now(self):
+        """Make every pending entry due now (e.g. after Wi-Fi came back)"""
+        with self._lock:
+            self._db.execute("UPDATE outbox SET next_attempt = ? WHERE state = ?", (time.time(), PENDING))
+        self._wake.set()
+
+    # ---------------- delivery ----------------
+
+    def _attempt(self, entry_id):
+        # Caller has claimed entry_id (it is in self._inflight)
+        try:
+            with self._lock:
+                row = self._db.execute("SELECT url, body FROM outbox WHERE id = ?", (entry_id,)).fetchone()
+            if row is None:
+                return None
+            url, body = row
+            started = time.perf_counter()
+            try:
+                response = self.client.post_json(url, json.loads(body))
+            except requests.RequestException as e:
+                _REQUEST_SECONDS.labels("error").observe(time.perf_counter() - started)
+                return self._record(entry_id, None, None, f"{type(e).__name__}: {e}", None)
+            status = response.status_code
+            result = "ok" if 200 <= status < 300 else "retry" if self._retryable(status) else "rejected"
+            _REQUEST_SECONDS.labels(result).observe(time.perf_counter() - started)
+            return self._record(entry_id, status, response.text, None, response.headers.get("Retry-After"))
+        finally:
+            with self._lock:
+                self._inflight.discard(entry_id)
+
+    @staticmethod
+    def _retryable(status):
+        return status in RETRY_STATUS or status >= 500
+
+    def _record(self, entry_id, status, text, error, retry_after):
+        now = time.time()
+        with self._lock:
+            attempts, created = self._db.execute(
+                "SELECT attempts + 1, created FROM outbox WHERE id = ?", (entry_id,)).fetchone()
+            next_attempt = now
+            if status is not None and 200 <= status < 300:
+                state, outcome = DELIVERED, "delivered"
+            elif status is not None and not self._retryable(status):
+                state, outcome = FAILED, "rejected"
+            elif attempts >= self.max_attempts or now - created >= self.max_age:
+                state, outcome = FAILED, "retry"
+                error = f"gave up after {attempts} attempts: {error or f'HTTP {status}'}"
+            else:
+                state, outcome = PENDING, "retry"
+                next_attempt = now + self._delay(attempts, retry_after)
+            self._db.execute(
+                "UPDATE outbox SET state = ?, attempts = ?, updated = ?, next_attempt = ?, status_code = ?, "
+                "response = ?, error = ? WHERE id = ?",
+                (state, attempts, now, next_attempt, status, text, error, entry_id),
+            )
+            self.attempts[outcome] += 1
+            if state != PENDING:
+                # Finished entries keep only their status: the body carries the pairing token
+                self._db.execute("UPDATE outbox SET body = NULL WHERE id = ?", (entry_id,))
+                self._prune()
+        entry = self.get(entry_id)
+        if state == PENDING:
+            self._wake.set()  # the worker may be idle with nothing else due
+            logger.warning("⚠ Backend call %d failed (%s), retry %d in %.1fs",
+                           entry_id, error or f"HTTP {status}", attempts, next_attempt - now)
+        elif state == DELIVERED:
+            logger.info("✓ Backend call %d delivered after %d attempt(s)", entry_id, attempts)
+        else:
+            logger.error("✗ Backend call %d failed: %s", entry_id, error or f"HTTP {status} {text}")
+        if state != PENDING and self.on_result is not None:
+            try:
+                self.on_result(entry)
+            except Exception:
+                logger.exception("Outbox result callback failed")
+        return entry
+
+    def _delay(self, attempts, retry_after):
+        delay = min(self.retry_max, self.retry_min * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+        try:
+            return max(delay, min(self.retry_max, float(retry_after)))
+        except (TypeError, ValueError):
+            return delay
+
+    def _prune(self):
+        # Caller holds the lock
+        self._db.execute(
+            "DELETE FROM outbox WHERE state != ? AND id NOT IN "
+            "(SELECT id FROM outbox WHERE state != ? ORDER BY id DESC LIMIT ?)",
+            (PENDING, PENDING, self.keep),
+        )
+
+    # ---------------- worker ----------------
+
+    def start(self):
+        """Start retrying pending entries, including those left by a previous run"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="Backend-Outbox")
+            self._thread.start()
+            pending = self.stats()["pending"]
+            if pending:
+                logger.info("⏳ %d backend call(s) waiting in the outbox", pending)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            now = time.time()
+            with self._lock:
+                due = [row_id for (row_id,) in self._db.execute(
+                    "SELECT id FROM outbox WHERE state = ? AND next_attempt <= ? ORDER BY id", (PENDING, now))
+                    if row_id not in self._inflight]
+                self._inflight.update(due)
+                upcoming = self._db.execute(
+                    "SELECT MIN(next_attempt) FROM outbox WHERE state = ? AND next_attempt > ?",
+                    (PENDING, now)).fetchone()[0]
+            for entry_id in due:
+                if self._stop.is_set():
+                    with self._lock:
+                        self._inflight.difference_update(due)
+                    return
+                self._attempt(entry_id)
+            if due:
+                continue
+            self._wake.wait(timeout=None if upcoming is None else max(0.05, upcoming - time.time()))
+            self._wake.clear()
+
+    # ---------------- status ----------------
+
+    def get(self, entry_id):
+        """Entry as a dict (without the request body), or None"""
+        with self._lock:
+            row = self._db.execute(f"SELECT {', '.join(_COLUMNS)} FROM outbox WHERE id = ?", (entry_id,)).fetchone()
+        if row is None:
+            return None
+        entry = dict(zip(_COLUMNS, row))
+        del entry["body"]
+        if entry["state"] != PENDING:
+            entry["next_attempt"] = None
+        return entry
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._db.execute("SELECT state, COUNT(*) FROM outbox GROUP BY state").fetchall())
+        return {"pending": counts.get(PENDING, 0), **{f"attempts_{key}": value for key, value in self.attempts.items()}}
+
+    def close(self):
+        self.stop()
+        with self._lock:
+            self._db.close()
+        self.client.close()
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+
+def _collect_outbox():
+    if _outbox is None:
+        return []
+    counts = _outbox.stats()
+    return [
+        ("backend_outbox_pending", "gauge", "Backend calls waiting for delivery", [({}, counts["pending"])]),
+        ("backend_outbox_attempts_total", "counter", "Backend delivery attempts by outcome",
+         [({"result": key}, value) for key, value in _outbox.attempts.items()]),
+    ]
+
+
+metrics.register_collector(_collect_outbox)
+
+
+def get_backend_outbox():
+    """Shared Outbox (and its BackendClient), created on first use; call start() to run retries"""
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = Outbox(
+                config.OUTBOX_PATH,
+                BackendClient(timeout=(config.BACKEND_CONNECT_TIMEOUT, config.BACKEND_TIMEOUT)),
+                max_attempts=config.OUTBOX_MAX_ATTEMPTS,
+                max_age=config.OUTBOX_MAX_AGE,
+                retry_min=config.OUTBOX_RETRY_MIN,
+                retry_max=config.OUTBOX_RETRY_MAX,
+            )
+    return _outbox
+
+
+def retry_pending_backend_calls():
+    """Retry pending entries now, if the outbox is in use (e.g. after Wi-Fi reconnects)"""
+    if _outbox is not None:
+        _outbox.retry_now()
@@ -0,0 +1,213 @@
+"""
+Known Networks - Connection history for saved Wi-Fi profiles
+Records, per NetworkManager profile, how often `nmcli connection up`
+succeeded, how long it took and the signal at the time, in
+config/known_networks.json. Reconnects use it to try the most likely
+profile first, skip profiles whose SSID is not in the scan cache, and
+give attempts on networks not seen in range a timeout sized from their
+past connect times instead of a flat 15-20 s.
+
+wlan0 can only activate one profile at a time, so candidates are probed
+together by one scan (plus parallel profile lookups), not by parallel
+connection attempts.
+"""
+import json
+import os
+import subprocess
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from network.network_state import run_nmcli
+from utils import log, metrics
+
+logger = log.get_logger(__name__)
+
+HISTORY_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "config", "known_networks.json")
+KEEP = 20                 # profiles remembered
+MIN_CONNECT_TIMEOUT = 5   # seconds
+TIMEOUT_FACTOR = 3        # attempt timeout = TIMEOUT_FACTOR x average connect time
+EWMA_ALPHA = 0.3
+
+Candidate = namedtuple("Candidate", "name ssid visible signal score")
+
+_RECONNECT_SECONDS = metrics.histogram(
+    "wifi_reconnect_seconds", "Time to get back online through a saved profile", ("result",))
+
+
+def signal_percent(signal, source):
+    """Scan signal as 0-100 (iw reports dBm, nmcli already reports percent)"""
+    if signal is None:
+        return None
+    if source == "iw":
+        return max(0.0, min(100.0, 2 * (signal + 100)))
+    return signal
+
+
+def visible_signals(scan):
+    """{ssid: strongest signal in percent} from a ScanResult"""
+    signals = {}
+    for ap in scan.access_points:
+        percent = signal_percent(ap.signal, scan.source)
+        if ap.ssid not in signals or (percent or 0) > (signals[ap.ssid] or 0):
+            signals[ap.ssid] = percent
+    return signals
+
+
+def _profile_details(name):
+    """(ssid, hidden) for a saved profile, or None if nmcli could not be asked"""
+    try:
+        result = run_nmcli(["nmcli", "-g", "802-11-wireless.ssid,802-11-wireless.hidden", "connection", "show", name],
+                           capture_output=True, text=True, timeout=10)
+    except (subprocess.TimeoutExpired, OSError) as e:
+        logger.warning("⚠ Could not look up profile %s, ranking it by name: %s", name, e)
+        return None
+    lines = result.stdout.splitlines() if result.returncode == 0 else []
+    ssid = lines[0].replace("\\:", ":") if lines and lines[0] else name
+    hidden = len(lines) > 1 and lines[1].strip() == "yes"
+    return ssid, hidden
+
+
+class KnownNetworks:
+    """
+    Per-profile history: successes, failures, last success, average connect
+    time (EWMA) and last signal, persisted as JSON
+    """
+
+    def __init__(self, path=HISTORY_PATH, keep=KEEP):
+        self.path = path
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._profiles = {}   # NM profile name -> (ssid, hidden), looked up once per process
+        self._history = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                history = json.load(f)
+            return history if isinstance(history, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning("⚠ Ignoring unreadable network history %s: %s", self.path, e)
+            return {}
+
+    def _save(self):
+        # Caller holds self._lock
+        if len(self._history) > self.keep:
+            oldest = sorted(self._history, key=lambda name: self._history[name].get("last_used", 0))
+            for name in oldest[:len(self._history) - self.keep]:
+                del self._history[name]
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self._history, f, indent=2)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning("⚠ Could not save network history: %s", e)
+
+    # ---------------- recording ----------------
+
+    def record_success(self, name, ssid, seconds, signal=None):
+        with self._lock:
+            entry = self._history.setdefault(name, {"ssid": ssid, "successes": 0, "failures": 0})
+            entry["ssid"] = ssid
+            entry["successes"] += 1
+            entry["last_success"] = entry["last_used"] = time.time()
+            average = entry.get("connect_seconds")
+            entry["connect_seconds"] = round(
+                seconds if average is None else average + EWMA_ALPHA * (seconds - average), 2)
+            if signal is not None:
+                entry["signal"] = signal
+            self._save()
+
+    def record_failure(self, name, ssid):
+        with self._lock:
+            entry = self._history.setdefault(name, {"ssid": ssid, "successes": 0, "failures": 0})
+            entry["failures"] += 1
+            entry["last_used"] = time.time()
+            self._save()
+
+    # ---------------- ranking ----------------
+
+    def profiles(self, names):
+        """{name: (ssid, hidden)} for saved profiles, looking up unknown ones in parallel"""
+        missing = [name for name in names if name not in self._profiles]
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(4, len(missing))) as pool:
+                for name, details in zip(missing, pool.map(_profile_details, missing)):
+                    if details is not None:
+                        self._profiles[name] = details
+        # Failed lookups fall back to the profile name and are retried next time
+        return {name: self._profiles.get(name, (name, False)) for name in names}
+
+    def score(self, name, signal=None):
+        """Higher is more likely to connect: success rate, recency and current signal"""
+        entry = self._history.get(name, {})
+        successes, failures = entry.get("successes", 0), entry.get("failures", 0)
+        score = (successes + 1) / (successes + failures + 2)
+        last_success = entry.get("last_success")
+        if last_success:
+            score += 0.5 / (1 + (time.time() - last_success) / 86400)
+        if signal is not None:
+            score += 0.5 * signal / 100
+        return score
+
+    def rank(self, profiles, scan=None):
+        """
+        Candidates from {name: (ssid, hidden)}, most likely first. With a
+        scan, profiles whose SSID is not visible are dropped (hidden
+        networks are kept, after the visible ones). If that would drop every
+        profile (an empty or partial scan), all are returned unfiltered.
+        """
+        signals = visible_signals(scan) if scan is not None else None
+        candidates = []
+        for name, (ssid, hidden) in profiles.items():
+            visible = signal = None
+            if signals is not None:
+                if ssid in signals:
+                    visible, signal = True, signals[ssid]
+                elif not hidden:
+                    logger.debug("Skipping saved network %s: %s not in range", name, ssid)
+                    continue
+            candidates.append(Candidate(name, ssid, visible, signal, self.score(name, signal)))
+        if not candidates and profiles and signals is not None:
+            logger.info("No saved network seen in the last scan; trying all of them")
+            return self.rank(profiles)
+        candidates.sort(key=lambda c: (c.visible is not True, -c.score))
+        return candidates
+
+    def connect_timeout(self, name, limit, visible=None):
+        """
+        Seconds to give `nmcli connection up` for this profile, at most
+        limit. A network the scan shows in range always gets the full limit
+        (slow DHCP is no reason to give up on it); the learned timeout only
+        cuts short attempts on networks that may not be there.
+        """
+        average = self._history.get(name, {}).get("connect_seconds")
+        if visible or average is None:
+            return limit
+        return max(MIN_CONNECT_TIMEOUT, min(limit, TIMEOUT_FACTOR * average))
+
+    def stats(self):
+        with self._lock:
+            return {name: dict(entry) for name, entry in self._history.items()}
+
+
+_known = None
+_known_lock = threading.Lock()
+
+
+def get_known_networks():
+    """Shared KnownNetworks, loaded on first use"""
+    global _known
+    with _known_lock:
+        if _known is None:
+            _known = KnownNetworks()
+    return _known
+
+
+def record_reconnect(seconds, succeeded):
+    _RECONNECT_SECONDS.labels("ok" if succeeded else "failed").observe(seconds)
@@ -0,0 +1,107 @@
+"""
+Local Backend - HTTP stand-in for the provisioning backend, for tests and load runs
+Accepts JSON POSTs on any path and answers from a script of status codes
+(then `default` for everything after it), optionally after a delay. It
+counts requests and TCP connections, so keep-alive reuse and retries are
+visible. HTTP/1.1, keep-alive, plain HTTP (no TLS).
+
+Usage: python -m network.local_backend [--port 8080] [--script 503,503] [--default 200] [--delay 0]
+       BACKEND_PROVISION_URL=http://127.0.0.1:8080/api/v1/devices/provision python provision.py
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class LocalBackend(ThreadingHTTPServer):
+    """
+    script:  status codes for the first requests, in order
+    default: status code once the script is used up
+    delay:   seconds to wait before each response
+    """
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, script=(), default=200, delay=0.0):
+        super().__init__((host, port), _Handler)
+        self.port = self.server_address[1]
+        self.script = list(script)
+        self.default = default
+        self.delay = delay
+        self.received = []   # (path, JSON body) of every request
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    def url(self, path="/api/v1/devices/provision"):
+        return f"http://{self.server_address[0]}:{self.port}{path}"
+
+    def next_status(self):
+        with self._lock:
+            return self.script.pop(0) if self.script else self.default
+
+    def stats(self):
+        return {"requests": len(self.received), "connections": self.connections}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep connections open between requests
+
+    def setup(self):
+        super().setup()
+        with self.server._lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length)
+        try:
+            body = json.loads(raw or b"null")
+        except ValueError:
+            body = raw.decode(errors="replace")
+        self.server.received.append((self.path, body))
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        status = self.server.next_status()
+        reply = json.dumps({"message": "Device provisioned" if status < 300 else "Stand-in error",
+                            "status": status}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_in_thread(host="127.0.0.1", port=0, **kwargs):
+    """Run a LocalBackend in a daemon thread; returns it once listening"""
+    server = LocalBackend(host, port, **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True, name="LocalBackend").start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--script", default="", help="comma separated status codes for the first requests")
+    parser.add_argument("--default", type=int, default=200)
+    parser.add_argument("--delay", type=float, default=0.0)
+    parser.add_argument("--report", type=float, default=10, help="seconds between stats lines")
+    args = parser.parse_args()
+    script = [int(code) for code in args.script.split(",") if code.strip()]
+    server = start_in_thread(args.host, args.port, script=script, default=args.default, delay=args.delay)
+    print(f"✓ Local backend listening on {server.url()}")
+    try:
+        while True:
+            time.sleep(args.report)
+            print(f"[{time.strftime('%H:%M:%S')}] {server.stats()}")
+    except KeyboardInterrupt:
+        print("\nBackend shutting down...")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+"""
+Network State - Cached, event-driven view of NetworkManager state
+One `nmcli monitor` subprocess feeds an in-memory snapshot of wlan0 and the
+active connections; is_ap_active(), is_client_wifi_connected() and friends
+read the snapshot instead of spawning nmcli on every call
+"""
+import subprocess
+import threading
+import time
+
+from config import config
+from utils import log, metrics
+
+logger = log.get_logger(__name__)
+
+HOTSPOT_NAME = "BIOTECH"
+WLAN_DEVICE = "wlan0"
+
+DEVICE_STATUS_CMD = ["nmcli", "-t", "-f", "DEVICE,TYPE,STATE,CONNECTION", "device"]
+ACTIVE_CONNECTIONS_CMD = ["nmcli", "-t", "-f", "NAME,DEVICE", "connection", "show", "--active"]
+MONITOR_CMD = ["nmcli", "monitor"]
+MONITOR_RESTART_MIN = 1    # seconds before restarting a dead `nmcli monitor`,
+MONITOR_RESTART_MAX = 60   # doubling up to this
+
+# First word of an nmcli device state ("connecting (configuring)" -> "connecting")
+DEVICE_STATES = {"unknown", "unmanaged", "unavailable", "disconnected", "connecting", "connected",
+                 "disconnecting", "deactivating", "failed"}
+
+
+def state_word(state):
+    """Device state without nmcli's detail in parentheses"""
+    return state.split(" ", 1)[0]
+
+
+def split_terse(line):
+    """Split one line of `nmcli -t` output on ':' honouring '\\:' escapes"""
+    fields, current, escaped = [], [], False
+    for char in line:
+        if escaped:
+            current.append(char)
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char == ":":
+            fields.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    fields.append("".join(current))
+    return fields
+
+
+_NMCLI_DURATION = metrics.histogram(
+    "nmcli_duration_seconds", "Wall time of nmcli invocations", ("command",))
+# nmcli options that take a value, so the value is not mistaken for a subcommand
+_NMCLI_VALUE_OPTIONS = {"-f", "--fields", "-g", "--get-values", "-e", "--escape", "-c", "--colors",
+                        "-m", "--mode", "-w", "--wait"}
+
+
+def _nmcli_command(cmd):
+    """'device wifi', 'connection up', ... from an nmcli argument list"""
+    words, skip = [], False
+    for arg in cmd[1:]:
+        if skip:
+            skip = False
+        elif arg.startswith("-"):
+            skip = arg in _NMCLI_VALUE_OPTIONS
+        else:
+            words.append(arg)
+            if len(words) == 2:
+                break
+    return " ".join(words) or "nmcli"
+
+
+def run_nmcli(cmd, **kwargs):
+    """subprocess.run for nmcli, timed into nmcli_duration_seconds{command=...}"""
+    started = time.perf_counter()
+    try:
+        return subprocess.run(cmd, **kwargs)
+    finally:
+        _NMCLI_DURATION.labels(_nmcli_command(cmd)).observe(time.perf_counter() - started)
+
+
+def nmcli_snapshot():
+    """Run the two nmcli queries a snapshot needs; returns (device output, active output)"""
+    devices = run_nmcli(DEVICE_STATUS_CMD, capture_output=True, text=True, timeout=10)
+    active = run_nmcli(ACTIVE_CONNECTIONS_CMD, capture_output=True, text=True, timeout=10)
+    return devices.stdout, active.stdout
+
+
+def nmcli_monitor():
+    """Start `nmcli monitor`; returns the Popen object (its stdout yields event lines)"""
+    return subprocess.Popen(
+        MONITOR_CMD, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, bufsize=1
+    )
+
+
+class NetworkSnapshot:
+    """Immutable view of device and active-connection state"""
+    __slots__ = ("devices", "active", "taken_at")
+
+    def __init__(self, devices, active, taken_at):
+        self.devices = devices    # {device: (type, state, connection)}
+        self.active = active      # {connection name: device}
+        self.taken_at = taken_at
+
+    @classmethod
+    def parse(cls, device_output, active_output, taken_at=None):
+        devices = {}
+        for line in device_output.splitlines():
+            parts = split_terse(line.strip())
+            if len(parts) >= 4:
+                devices[parts[0]] = (parts[1], parts[2], parts[3])
+        active = {}
+        for line in active_output.splitlines():
+            parts = split_terse(line.strip())
+            if len(parts) >= 2:
+                active[parts[0]] = parts[1]
+        return cls(devices, active, time.monotonic() if taken_at is None else taken_at)
+
+
+class NetworkStateService:
+    """
+    Keeps a NetworkSnapshot current from `nmcli monitor` events
+
+    monitor_factory: returns an object with a .stdout iterable of event lines
+                     (and optionally .terminate()); nmcli_monitor by default
+    snapshot_fn:     returns (device output, active output); nmcli_snapshot by default
+    Device state lines ("wlan0: disconnected") update the cache immediately;
+    any event also schedules one debounced full refresh, and a resync runs
+    every resync_interval seconds in case events are missed. If the monitor
+    exits it is restarted with backoff; until then `available` is False and
+    callers poll nmcli themselves.
+    """
+
+    def __init__(self, monitor_factory=nmcli_monitor, snapshot_fn=nmcli_snapshot,
+                 hotspot_name=HOTSPOT_NAME, wlan_device=WLAN_DEVICE,
+                 debounce=0.2, resync_interval=60):
+        self.monitor_factory = monitor_factory
+        self.snapshot_fn = snapshot_fn
+        self.hotspot_name = hotspot_name
+        self.wlan_device = wlan_device
+        self.debounce = debounce
+        self.resync_interval = resync_interval
+        self._snapshot = NetworkSnapshot({}, {}, 0.0)
+        self._changed = threading.Condition()
+        self._refresh_needed = threading.Event()
+        self._stop = threading.Event()
+        self._monitor = None
+        self._threads = []
+        self.available = False
+        self.events = 0
+        self.refreshes = 0
+        self.monitor_restarts = 0
+        self.version = 0
+
+    # ---------------- lifecycle ----------------
+
+    def start(self):
+        """Take an initial snapshot and start following events. Returns False if nmcli is unusable"""
+        if self._threads:
+            return self.available
+        try:
+            self._refresh()
+            self._monitor = self.monitor_factory()
+        except (FileNotFoundError, OSError, subprocess.SubprocessError) as e:
+            logger.warning("⚠ Network monitor unavailable: %s", e)
+            self.available = False
+            return False
+        self.available = True
+        for target, name in ((self._read_events, "NM-Monitor"), (self._refresh_loop, "NM-Refresh")):
+            thread = threading.Thread(target=target, daemon=True, name=name)
+            thread.start()
+            self._threads.append(thread)
+        return True
+
+    def stop(self):
+        self._stop.set()
+        self._refresh_needed.set()
+        if self._monitor is not None and hasattr(self._monitor, "terminate"):
+            try:
+                self._monitor.terminate()
+            except Exception:
+                pass
+
+    def _read_events(self):
+        delay = MONITOR_RESTART_MIN
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                for line in self._monitor.stdout:
+                    if self._stop.is_set():
+                        break
+                    self.events += 1
+                    self._apply_event(line.strip())
+                    self._refresh_needed.set()
+            except Exception as e:
+                logger.warning("⚠ Network monitor stream error: %s", e)
+            if self._stop.is_set():
+                break
+            # Monitor exited: callers poll nmcli until it is back
+            logger.warning("⚠ nmcli monitor exited - network state falls back to polling")
+            self.available = False
+            if hasattr(self._monitor, "wait"):
+                try:
+                    self._monitor.wait(timeout=1)
+                except Exception:
+                    pass
+            if time.monotonic() - started > MONITOR_RESTART_MAX:
+                delay = MONITOR_RESTART_MIN  # it ran for a while: not a crash loop
+            while not self._stop.wait(delay):
+                delay = min(delay * 2, MONITOR_RESTART_MAX)
+                try:
+                    self._monitor = self.monitor_factory()
+                except (FileNotFoundError, OSError, subprocess.SubprocessError) as e:
+                    logger.warning("⚠ Could not restart nmcli monitor: %s", e)
+                    continue
+                self.monitor_restarts += 1
+                self.available = True
+                self._refresh_needed.set()  # catch up on events missed meanwhile
+                logger.info("✓ nmcli monitor restarted")
+                break
+
+    def _apply_event(self, line):
+        # "wlan0: disconnected", "wlan0: connected", "wlan0: using connection 'BIOTECH'"
+        device, sep, rest = line.partition(": ")
+        if not sep or device not in self._snapshot.devices:
+            return
+        with self._changed:
+            current = self._snapshot
+            dev_type, state, connection = current.devices[device]
+            if rest.startswith("using connection '") and rest.endswith("'"):
+                connection = rest[len("using connection '"):-1]
+            elif state_word(rest) in DEVICE_STATES:
+                # "connecting (configuring)" etc. are stored whole, like `nmcli -t device` shows them
+                state = rest
+                if state_word(state) in ("disconnected", "unavailable", "unmanaged"):
+                    connection = ""
+            else:
+                return  # "device created", "device removed", ...
+            devices = dict(current.devices)
+            devices[device] = (dev_type, state, connection)
+            self._publish(NetworkSnapshot(devices, current.active, time.monotonic()))
+
+    def _refresh_loop(self):
+        while not self._stop.is_set():
+            triggered = self._refresh_needed.wait(timeout=self.resync_interval)
+            if self._stop.is_set():
+                break
+            if triggered:
+                # Coalesce bursts of events into one refresh
+                time.sleep(self.debounce)
+                self._refresh_needed.clear()
+            try:
+                self._refresh()
+            except Exception as e:
+                logger.warning("⚠ Network state refresh failed: %s", e)
+
+    def _refresh(self):
+        device_output, active_output = self.snapshot_fn()
+        self.refreshes += 1
+        with self._changed:
+            self._publish(NetworkSnapshot.parse(device_output, active_output))
+
+    def _publish(self, snapshot):
+        # Caller holds self._changed
+        self._snapshot = snapshot
+        self.version += 1
+        self._changed.notify_all()
+
+    # ---------------- queries ----------------
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    def wlan(self):
+        """(type, state, connection) of the Wi-Fi device, or None"""
+        return self._snapshot.devices.get(self.wlan_device)
+
+    def is_ap_active(self):
+        return self.hotspot_name in self._snapshot.active
+
+    def is_client_wifi_connected(self):
+        wlan = self.wlan()
+        return bool(
+            wlan
+            and wlan[0] == "wifi"
+            and state_word(wlan[1]) in ("connected", "connecting")
+            and wlan[2] != self.hotspot_name
+        )
+
+    def current_ssid(self):
+        """Connection wlan0 is on (excluding the hotspot), or None"""
+        wlan = self.wlan()
+        if wlan and state_word(wlan[1]) == "connected" and wlan[2] and wlan[2] != self.hotspot_name:
+            return wlan[2]
+        return None
+
+    def wait_for(self, predicate, timeout):
+        """Block until predicate(snapshot) is true or timeout; returns the result"""
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                if predicate(self._snapshot):
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._changed.wait(remaining)
+
+    def wait_for_wlan_state(self, target_state, timeout=10):
+        def reached(snapshot):
+            wlan = snapshot.devices.get(self.wlan_device)
+            return wlan is not None and state_word(wlan[1]) == target_state
+        return self.wait_for(reached, timeout)
+
+    def wait_for_change(self, timeout):
+        """Block until the snapshot changes or timeout; returns True if it changed"""
+        with self._changed:
+            version = self.version
+            return self._changed.wait_for(lambda: self.version != version, timeout)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def _collect_network():
+    if _service is None:
+        return []
+    return [
+        ("network_monitor_available", "gauge", "nmcli monitor is running", [({}, _service.available)]),
+        ("network_monitor_events_total", "counter", "nmcli monitor events", [({}, _service.events)]),
+        ("network_state_refreshes_total", "counter", "Full nmcli state refreshes", [({}, _service.refreshes)]),
+        ("network_monitor_restarts_total", "counter", "nmcli monitor restarts", [({}, _service.monitor_restarts)]),
+    ]
+
+
+metrics.register_collector(_collect_network)
+
+
+def get_network_state(hotspot_name=HOTSPOT_NAME):
+    """
+    Shared NetworkStateService, started on first use
+    Returns None when NetworkManager's monitor is not usable (or
+    NETWORK_MONITOR is off); callers then fall back to running nmcli themselves
+    """
+    global _service
+    if not config.NETWORK_MONITOR:
+        return None
+    with _service_lock:
+        if _service is None:
+            _service = NetworkStateService(hotspot_name=hotspot_name)
+            _service.start()
+    return _service if _service.available else None
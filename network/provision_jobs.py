@@ -0,0 +1,184 @@
+"""
+Provision Jobs - Wi-Fi provisioning as background jobs with explicit states
+POST /provision only validates the request and queues a job; the scan,
+nmcli and backend calls run on a single "Provision" worker thread, so the
+API keeps answering (GET /provision/jobs/{id}, /provision/result, ...)
+while Wi-Fi is being switched, and two clients can never drive nmcli at
+the same time.
+
+States:
+    pending → scanning → connecting → registering → succeeded
+    any non-final state → failed
+"""
+import asyncio
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import log, metrics
+
+logger = log.get_logger(__name__)
+
+PENDING = "pending"
+SCANNING = "scanning"
+CONNECTING = "connecting"
+REGISTERING = "registering"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+TRANSITIONS = {
+    PENDING: {SCANNING, CONNECTING, FAILED},
+    SCANNING: {CONNECTING, FAILED},
+    CONNECTING: {REGISTERING, SUCCEEDED, FAILED},
+    REGISTERING: {SUCCEEDED, FAILED},
+    SUCCEEDED: set(),
+    FAILED: set(),
+}
+FINAL_STATES = (SUCCEEDED, FAILED)
+
+_JOB_SECONDS = metrics.histogram(
+    "provision_job_seconds", "Time from queueing a provisioning job to its final state", ("state",))
+
+
+class InvalidTransition(ValueError):
+    pass
+
+
+class ProvisionJob:
+    """One provisioning attempt; state changes are recorded with timestamps"""
+
+    def __init__(self, job_id, ssid):
+        self.id = job_id
+        self.ssid = ssid
+        self.state = PENDING
+        self.message = None
+        self.result = None      # final response, same shape as the old POST /provision reply
+        self.created = time.time()
+        self.updated = self.created
+        self.history = [(PENDING, self.created)]
+        self.future = None
+        self._lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self.state in FINAL_STATES
+
+    def advance(self, state, message=None):
+        """Move to state; raises InvalidTransition for a move the state machine does not allow"""
+        with self._lock:
+            if state not in TRANSITIONS[self.state]:
+                raise InvalidTransition(f"{self.state} → {state}")
+            self.state = state
+            self.message = message
+            self.updated = time.time()
+            self.history.append((state, self.updated))
+        logger.info("Provision job %s: %s%s", self.id, state, f" ({message})" if message else "")
+
+    def finish(self, succeeded, result):
+        """Final state with the result returned to the client"""
+        self.result = result
+        self.advance(SUCCEEDED if succeeded else FAILED, result.get("message"))
+        _JOB_SECONDS.labels(self.state).observe(self.updated - self.created)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "ssid": self.ssid,
+                "state": self.state,
+                "message": self.message,
+                "created": self.created,
+                "updated": self.updated,
+                "history": [{"state": state, "at": at} for state, at in self.history],
+                "result": self.result,
+            }
+
+
+class ProvisionJobManager:
+    """
+    Runs provisioning jobs one at a time on a dedicated worker thread
+    keep: finished jobs remembered for GET /provision/jobs/{id}
+    """
+
+    def __init__(self, keep=20):
+        self.keep = keep
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Provision")
+        self._jobs = OrderedDict()  # id -> ProvisionJob, oldest first
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._prefix = os.urandom(3).hex()  # ids stay unique across restarts
+
+    def submit(self, ssid, fn, *args):
+        """
+        Queue fn(job, *args) as a new job; returns (job, True), or
+        (running job, False) when one is already in progress
+        """
+        with self._lock:
+            active = self._active()
+            if active is not None:
+                return active, False
+            job = ProvisionJob(f"{self._prefix}-{next(self._ids)}", ssid)
+            self._jobs[job.id] = job
+            finished = [job_id for job_id, old in self._jobs.items() if old.done]
+            for job_id in finished[:max(0, len(self._jobs) - self.keep)]:
+                del self._jobs[job_id]
+            job.future = self._pool.submit(self._run, job, fn, args)
+        return job, True
+
+    def _run(self, job, fn, args):
+        try:
+            fn(job, *args)
+        except Exception as e:
+            logger.exception("✗ Provision job %s failed", job.id)
+            if not job.done:
+                job.finish(False, {"status": "failed", "message": f"Provisioning error: {e}"})
+        if not job.done:
+            job.finish(False, {"status": "failed", "message": "Provisioning ended without a result"})
+
+    def run(self, fn, *args):
+        """
+        Run fn(*args) on the provisioning worker, after any queued job (other
+        Wi-Fi changes). Exceptions are logged here, since callers usually
+        drop the returned future.
+        """
+        return self._pool.submit(self._run_task, fn, args)
+
+    @staticmethod
+    def _run_task(fn, args):
+        try:
+            return fn(*args)
+        except Exception:
+            logger.exception("✗ Provisioning task %s failed", getattr(fn, "__name__", fn))
+            raise
+
+    def _active(self):
+        for job in reversed(self._jobs.values()):
+            if not job.done:
+                return job
+        return None
+
+    def active(self):
+        with self._lock:
+            return self._active()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        """Known jobs, newest first"""
+        with self._lock:
+            return list(reversed(self._jobs.values()))
+
+    async def wait(self, job, timeout):
+        """Wait up to timeout seconds for job to finish without blocking the event loop"""
+        if job.future is None or timeout <= 0:
+            return job
+        try:
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(job.future)), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return job
@@ -0,0 +1,333 @@
+"""
+Wi-Fi Scan - Background scanner with a timestamped access point cache
+A scan takes seconds (and in AP mode briefly takes the radio off the
+hotspot's channel), so one background thread scans every WIFI_SCAN_INTERVAL
+seconds and everyone else reads the cache: POST /provision checks the SSID
+is in range, connect_to_wifi skips its rescan, GET /scan lists networks for
+the pairing app.
+
+Background scans only run while the hotspot is up (that is when the
+pairing app needs the list) and never during a provisioning job; on client
+Wi-Fi the cache is refreshed only on demand, so NetworkManager is not made
+to leave the channel every interval.
+
+While the BIOTECH hotspot is up, scans use `iw dev wlan0 scan ap-force`
+(NetworkManager will not scan in AP mode); otherwise `nmcli device wifi list`
+with --rescan auto, which reuses NetworkManager's own recent scan.
+"""
+import contextlib
+import subprocess
+import threading
+import time
+from collections import namedtuple
+
+from config import config
+from network.network_state import HOTSPOT_NAME, WLAN_DEVICE, get_network_state, run_nmcli, split_terse
+from utils import log, metrics
+
+logger = log.get_logger(__name__)
+
+SCAN_TIMEOUT = 15  # seconds
+
+AccessPoint = namedtuple("AccessPoint", "ssid bssid signal frequency security")
+
+
+def parse_iw_scan(output):
+    """AccessPoints from `iw dev <dev> scan` output (signal in dBm)"""
+    access_points = []
+    current = None
+    for raw in output.splitlines():
+        line = raw.strip()
+        if raw.startswith("BSS "):
+            if current is not None:
+                access_points.append(AccessPoint(**current))
+            current = {"ssid": "", "bssid": raw[4:].split("(")[0].strip(), "signal": None,
+                       "frequency": None, "security": ""}
+        elif current is None:
+            continue
+        elif line.startswith("SSID:"):
+            current["ssid"] = line[5:].strip()
+        elif line.startswith("signal:"):
+            try:
+                current["signal"] = float(line[7:].split()[0])
+            except (ValueError, IndexError):
+                pass
+        elif line.startswith("freq:"):
+            try:
+                current["frequency"] = int(float(line[5:].split()[0]))
+            except (ValueError, IndexError):
+                pass
+        elif line.startswith("RSN:"):
+            current["security"] = "WPA2"
+        elif line.startswith("WPA:") and not current["security"]:
+            current["security"] = "WPA"
+    if current is not None:
+        access_points.append(AccessPoint(**current))
+    return [ap for ap in access_points if ap.ssid]
+
+
+def parse_nmcli_scan(output):
+    """AccessPoints from `nmcli -t -f SSID,BSSID,SIGNAL,FREQ,SECURITY device wifi list` (signal in %)"""
+    access_points = []
+    for line in output.splitlines():
+        parts = split_terse(line.strip())
+        if len(parts) < 5 or not parts[0]:
+            continue
+        try:
+            signal = float(parts[2])
+        except ValueError:
+            signal = None
+        try:
+            frequency = int(parts[3].split()[0])
+        except (ValueError, IndexError):
+            frequency = None
+        access_points.append(AccessPoint(parts[0], parts[1], signal, frequency, parts[4]))
+    return access_points
+
+
+def iw_scan(device=WLAN_DEVICE):
+    """Scan with iw without leaving AP mode; None if the scan failed"""
+    try:
+        result = subprocess.run(["iw", "dev", device, "scan", "ap-force"],
+                                capture_output=True, text=True, timeout=SCAN_TIMEOUT)
+    except FileNotFoundError:
+        logger.warning("⚠ iw not found; cannot scan while in AP mode")
+        return None
+    except subprocess.TimeoutExpired:
+        logger.warning("⚠ iw scan timed out")
+        return None
+    if result.returncode != 0:
+        logger.warning("⚠ iw scan ap-force failed: %s", result.stderr.strip() or result.stdout)
+        return None
+    return parse_iw_scan(result.stdout)
+
+
+def nmcli_scan(device=WLAN_DEVICE, rescan="auto"):
+    """Scan with NetworkManager; rescan="yes" waits for a fresh scan. None if it failed"""
+    try:
+        result = run_nmcli(
+            ["nmcli", "-t", "-f", "SSID,BSSID,SIGNAL,FREQ,SECURITY", "device", "wifi", "list",
+             "ifname", device, "--rescan", rescan],
+            capture_output=True, text=True, timeout=SCAN_TIMEOUT,
+        )
+    except (FileNotFoundError, subprocess.TimeoutExpired) as e:
+        logger.warning("⚠ nmcli scan failed: %s", e)
+        return None
+    if result.returncode != 0:
+        logger.warning("⚠ nmcli scan failed: %s", result.stderr.strip() or result.stdout)
+        return None
+    return parse_nmcli_scan(result.stdout)
+
+
+def _ap_active():
+    state = get_network_state(HOTSPOT_NAME)
+    if state is not None:
+        return state.is_ap_active()
+    try:
+        result = run_nmcli(["nmcli", "-t", "-f", "NAME", "connection", "show", "--active"],
+                           capture_output=True, text=True, timeout=10)
+    except (FileNotFoundError, subprocess.TimeoutExpired):
+        return False
+    return HOTSPOT_NAME in result.stdout.splitlines()
+
+
+def scan_access_points(rescan="auto"):
+    """iw in AP mode, nmcli otherwise; returns (access points or None, tool used)"""
+    if _ap_active():
+        return iw_scan(), "iw"
+    return nmcli_scan(rescan=rescan), "nmcli"
+
+
+class ScanResult:
+    """Access points seen by one scan"""
+    __slots__ = ("access_points", "taken_at", "scanned_at", "source")
+
+    def __init__(self, access_points, source, taken_at=None):
+        self.access_points = access_points
+        self.source = source
+        self.taken_at = time.monotonic() if taken_at is None else taken_at
+        self.scanned_at = time.time() - (time.monotonic() - self.taken_at)
+
+    @property
+    def age(self):
+        return time.monotonic() - self.taken_at
+
+    def ssids(self):
+        return {ap.ssid for ap in self.access_points}
+
+    def networks(self):
+        """One entry per SSID (its strongest access point), strongest first"""
+        best, counts = {}, {}
+        for ap in self.access_points:
+            counts[ap.ssid] = counts.get(ap.ssid, 0) + 1
+            current = best.get(ap.ssid)
+            if current is None or (ap.signal is not None and (current.signal is None or ap.signal > current.signal)):
+                best[ap.ssid] = ap
+        ordered = sorted(best.values(), key=lambda ap: ap.signal if ap.signal is not None else float("-inf"),
+                         reverse=True)
+        return [{**ap._asdict(), "access_points": counts[ap.ssid]} for ap in ordered]
+
+
+class WifiScanner:
+    """
+    Keeps a ScanResult no older than about `interval` seconds
+
+    scan_fn:    scan_fn(rescan) returns (list of AccessPoint or None on
+                failure, source name); scan_access_points by default
+    max_age:    default freshness limit for fresh()/ssids()
+    background: returns whether a periodic scan may run now (default: always);
+                refresh_soon() requests are served regardless
+    hold() pauses background scans, e.g. while wlan0 is being connected.
+    """
+
+    def __init__(self, scan_fn=scan_access_points, interval=30, max_age=60, background=None):
+        self.scan_fn = scan_fn
+        self.interval = interval
+        self.max_age = max_age
+        self.background = background
+        self._result = None
+        self._scan_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._requested = False
+        self._stop = threading.Event()
+        self._holds = 0
+        self._holds_lock = threading.Lock()
+        self._thread = None
+        self.scans = 0
+        self.failures = 0
+        self.hits = 0
+        self.misses = 0
+
+    # ---------------- lifecycle ----------------
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True, name="WiFi-Scan")
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            if not self._holds and (self._requested or self._background_allowed()):
+                self._requested = False
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.warning("⚠ Wi-Fi scan failed: %s", e)
+            self._wake.wait(timeout=self.interval)
+            self._wake.clear()
+
+    def _background_allowed(self):
+        if self.background is None:
+            return True
+        try:
+            return self.background()
+        except Exception as e:
+            logger.debug("Background scan check failed: %s", e)
+            return False
+
+    @contextlib.contextmanager
+    def hold(self):
+        """No background scans inside this block (explicit refresh() still runs)"""
+        with self._holds_lock:
+            self._holds += 1
+        try:
+            yield
+        finally:
+            with self._holds_lock:
+                self._holds -= 1
+
+    # ---------------- scanning ----------------
+
+    def refresh(self, rescan="auto"):
+        """
+        Scan now (or wait for the scan already running); returns the new
+        ScanResult or None. rescan="yes" makes nmcli do a full fresh scan.
+        """
+        started = time.monotonic()
+        with self._scan_lock:
+            if self._result is not None and self._result.taken_at >= started:
+                return self._result  # another caller scanned while we waited
+            access_points, source = self.scan_fn(rescan)
+            self.scans += 1
+            if access_points is None:
+                self.failures += 1
+                return None
+            self._result = ScanResult(access_points, source)
+            logger.debug("Wi-Fi scan (%s): %d access points, %d networks",
+                         source, len(access_points), len(self._result.ssids()))
+            return self._result
+
+    def refresh_soon(self):
+        """Ask the background thread for a scan without waiting for it"""
+        self._requested = True
+        self._wake.set()
+
+    # ---------------- queries ----------------
+
+    @property
+    def latest(self):
+        """Last successful ScanResult, however old, or None"""
+        return self._result
+
+    def fresh(self, max_age=None):
+        """Last ScanResult if younger than max_age seconds, else None"""
+        result = self._result
+        max_age = self.max_age if max_age is None else max_age
+        if result is not None and result.age <= max_age:
+            self.hits += 1
+            return result
+        self.misses += 1
+        return None
+
+    def ssids(self, require=None, max_age=None):
+        """
+        SSIDs in range from the cache, scanning now when it is stale or does
+        not show `require`; None if scanning failed
+        """
+        result = self.fresh(max_age)
+        if result is None or (require is not None and require not in result.ssids()):
+            result = self.refresh()
+        return result.ssids() if result is not None else None
+
+    @property
+    def held(self):
+        return self._holds > 0
+
+
+_scanner = None
+_scanner_lock = threading.Lock()
+
+
+def _collect_scanner():
+    if _scanner is None:
+        return []
+    result = _scanner.latest
+    families = [
+        ("wifi_scans_total", "counter", "Wi-Fi scans run", [({}, _scanner.scans)]),
+        ("wifi_scan_failures_total", "counter", "Wi-Fi scans that failed", [({}, _scanner.failures)]),
+        ("wifi_scan_cache_lookups_total", "counter", "Scan cache lookups by outcome",
+         [({"result": "hit"}, _scanner.hits), ({"result": "miss"}, _scanner.misses)]),
+    ]
+    if result is not None:
+        families.append(("wifi_scan_age_seconds", "gauge", "Age of the cached Wi-Fi scan", [({}, result.age)]))
+    return families
+
+
+metrics.register_collector(_collect_scanner)
+
+
+def get_wifi_scanner():
+    """Shared WifiScanner, started on first use; None when WIFI_SCAN_ENABLED is off"""
+    global _scanner
+    if not config.WIFI_SCAN_ENABLED:
+        return None
+    with _scanner_lock:
+        if _scanner is None:
+            _scanner = WifiScanner(interval=config.WIFI_SCAN_INTERVAL, max_age=config.WIFI_SCAN_MAX_AGE,
+                                   background=_ap_active).start()
+    return _scanner
@@ -1,31 +1,42 @@
 #!/usr/bin/env python3
 import subprocess
 from fastapi import FastAPI, Request, BackgroundTasks
+from fastapi.responses import JSONResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 import uvicorn
 import json
 import os
-import requests
 import time
+import contextlib
 import logging
-import sys
 import threading
+from network.network_state import get_network_state, run_nmcli, state_word
+from network.provision_jobs import CONNECTING, REGISTERING, SCANNING, ProvisionJobManager
+from network.wifi_scan import get_wifi_scanner
+from network.backend_outbox import DELIVERED, PENDING, get_backend_outbox, retry_pending_backend_calls
+from network.known_networks import MIN_CONNECT_TIMEOUT, get_known_networks, record_reconnect, visible_signals
+from data.timeseries import get_timeseries_store
+from config import config
+from utils import log, metrics
 
 # ---------------- LOGGING SETUP ----------------
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[logging.StreamHandler(sys.stdout)]
-)
+log.setup()
 logger = logging.getLogger(__name__)
 # ------------------------------------------------
 
 #BACKEND_API="hydronew.me/api/v1/devices/provision"
 #BACKEND_API = "https://auntlike-karrie-caboshed.ngrok-free.dev/api/v1/devices/provision"
-BACKEND_API = "https://latarsha-nonconcessive-telically.ngrok-free.dev/api/v1/devices/provision"
+BACKEND_API = config.BACKEND_PROVISION_URL or "https://latarsha-nonconcessive-telically.ngrok-free.dev/api/v1/devices/provision"
 
 config_path = os.path.join(os.path.dirname(__file__), 'config', 'device_config.json')
 last_provision_result_path = os.path.join(os.path.dirname(__file__), 'config', 'last_provision_result.json')
 app = FastAPI()
+API_HOST = "0.0.0.0"
+API_PORT = 5000
+PROVISION_MAX_WAIT = 30  # seconds POST /provision?wait= may hold the response
+provision_jobs = ProvisionJobManager()
+provision_attempts = metrics.counter(
+    "provision_attempts_total", "POST /provision requests by outcome", ("result",))
 
 watchdog_enabled = True
 
@@ -43,8 +54,11 @@ logger.info("Loaded device config: %s", data)
 
 def get_current_ssid() -> str | None:
     """Return the SSID wlan0 is currently connected to, or None if disconnected."""
+    state = get_network_state(HOTSPOT_NAME)
+    if state is not None:
+        return state.current_ssid()
     try:
-        result = subprocess.run(
+        result = run_nmcli(
             ["nmcli", "-t", "-f", "DEVICE,STATE,CONNECTION", "device", "status"],
             capture_output=True,
             text=True
@@ -53,7 +67,7 @@ def get_current_ssid() -> str | None:
             parts = line.strip().split(":")
             if len(parts) >= 3 and parts[0] == "wlan0":
                 state, conn = parts[1], parts[2]
-                if state == "connected" and conn != HOTSPOT_NAME:
+                if state_word(state) == "connected" and conn != HOTSPOT_NAME:
                     return conn
         return None
     except Exception:
@@ -61,7 +75,10 @@ def get_current_ssid() -> str | None:
 
 
 def is_ap_active() -> bool:
-    result = subprocess.run(
+    state = get_network_state(HOTSPOT_NAME)
+    if state is not None:
+        return state.is_ap_active()
+    result = run_nmcli(
         ["nmcli", "-t", "-f", "NAME,DEVICE", "connection", "show", "--active"],
         capture_output=True,
         text=True
@@ -71,34 +88,11 @@ def is_ap_active() -> bool:
         for line in result.stdout.splitlines()
     )
 
-def is_client_wifi_connected() -> str | None:
-    result = subprocess.run(
-        ["nmcli", "-t", "-f", "DEVICE,TYPE,STATE,CONNECTION", "device"],
-        capture_output=True,
-        text=True
-    )
-
-    for line in result.stdout.splitlines():
-        parts = line.split(":")
-        if len(parts) < 4:
-            continue
-
-        device, dev_type, state, connection = parts
-
-        if (
-            device == "wlan0"
-            and dev_type == "wifi"
-            and state in ["connected", "connecting"]
-            and connection != HOTSPOT_NAME
-        ):
-            return True
-
-    return None
-
-
-
 def is_client_wifi_connected() -> bool:
-    result = subprocess.run(
+    state = get_network_state(HOTSPOT_NAME)
+    if state is not None:
+        return state.is_client_wifi_connected()
+    result = run_nmcli(
         ["nmcli", "-t", "-f", "DEVICE,TYPE,STATE,CONNECTION", "device"],
         capture_output=True,
         text=True
@@ -114,7 +108,7 @@ def is_client_wifi_connected() -> bool:
         if (
             device == "wlan0"
             and dev_type == "wifi"
-            and state in ["connected", "connecting"]
+            and state_word(state) in ["connected", "connecting"]
             and connection != HOTSPOT_NAME
         ):
             return True
@@ -128,7 +122,7 @@ def get_saved_wifi_connections() -> list:
     Returns a list of connection names that are WiFi type.
     """
     try:
-        result = subprocess.run(
+        result = run_nmcli(
             ["nmcli", "-t", "-f", "NAME,TYPE", "connection", "show"],
             capture_output=True,
             text=True
@@ -147,9 +141,26 @@ def get_saved_wifi_connections() -> list:
         return []
 
 
+def wait_for_client_wifi(timeout: float) -> bool:
+    """Wait until wlan0 is connected as a client (not the hotspot) or timeout"""
+    state = get_network_state(HOTSPOT_NAME)
+    if state is not None:
+        return state.wait_for(lambda snapshot: state.is_client_wifi_connected(), timeout)
+    deadline = time.time() + timeout
+    while True:
+        if is_client_wifi_connected():
+            return True
+        if time.time() >= deadline:
+            return False
+        time.sleep(0.5)
+
+
 def try_connect_saved_network(timeout: int = 15) -> bool:
     """
-    Try to connect to a saved WiFi network.
+    Try to connect to a saved WiFi network, most likely first.
+    Profiles whose SSID is not in range are skipped (unless none is), and
+    networks not seen in range get a timeout from their past connect times
+    (network/known_networks.py).
     Returns True if successfully connected, False otherwise.
     """
     saved_networks = get_saved_wifi_connections()
@@ -159,35 +170,50 @@ def try_connect_saved_network(timeout: int = 15) -> bool:
         return False
     
     logger.info("Found saved WiFi networks: %s", saved_networks)
-    
-    for network in saved_networks:
-        logger.info("Attempting to connect to saved network: %s", network)
-        result = subprocess.run(
-            ["nmcli", "connection", "up", network],
-            capture_output=True,
-            text=True
-        )
-        
-        if result.returncode == 0:
-            logger.info("Successfully initiated connection to: %s", network)
-            # Wait for connection to be fully established
-            start_time = time.time()
-            while time.time() - start_time < timeout:
-                if is_client_wifi_connected():
-                    logger.info("Connected to saved network: %s", network)
-                    return True
-                time.sleep(1)
-        else:
-            logger.warning("Failed to connect to %s: %s", network, result.stderr.strip())
-    
+
+    started = time.monotonic()
+    known = get_known_networks()
+    scanner = get_wifi_scanner()
+    # One scan probes every candidate: no waiting on networks out of range
+    scan = (scanner.fresh() or scanner.refresh()) if scanner is not None else None
+    candidates = known.rank(known.profiles(saved_networks), scan)
+    logger.info("Saved networks to try, most likely first: %s", [c.name for c in candidates])
+
+    with scanner.hold() if scanner is not None else contextlib.nullcontext():
+        for candidate in candidates:
+            wait = known.connect_timeout(candidate.name, timeout, candidate.visible)
+            logger.info("Attempting to connect to saved network: %s (timeout %ds)", candidate.name, wait)
+            attempt_started = time.monotonic()
+            # nmcli waits for the activation itself (up to -w seconds)
+            result = run_nmcli(
+                ["nmcli", "-w", str(int(wait)), "connection", "up", candidate.name],
+                capture_output=True,
+                text=True
+            )
+
+            if result.returncode == 0 and wait_for_client_wifi(MIN_CONNECT_TIMEOUT):
+                seconds = time.monotonic() - attempt_started
+                logger.info("Connected to saved network: %s in %.1fs", candidate.name, seconds)
+                known.record_success(candidate.name, candidate.ssid, seconds, candidate.signal)
+                retry_pending_backend_calls()  # back online: don't wait out the backoff
+                record_reconnect(time.monotonic() - started, True)
+                return True
+            logger.warning("Failed to connect to %s: %s", candidate.name, result.stderr.strip())
+            known.record_failure(candidate.name, candidate.ssid)
+
+    record_reconnect(time.monotonic() - started, False)
     return False
 
 
 def wait_for_wlan_state(target_state: str, timeout: int = 10) -> bool:
     """Wait until wlan0 reaches the desired state (e.g., disconnected) or timeout"""
+    state = get_network_state(HOTSPOT_NAME)
+    if state is not None:
+        # Woken by nmcli monitor events instead of polling every 0.5 s
+        return state.wait_for_wlan_state(target_state, timeout)
     start = time.time()
     while time.time() - start < timeout:
-        result = subprocess.run(
+        result = run_nmcli(
             ["nmcli", "-t", "-f", "DEVICE,STATE", "device"],
             capture_output=True,
             text=True
@@ -195,7 +221,7 @@ def wait_for_wlan_state(target_state: str, timeout: int = 10) -> bool:
         for line in result.stdout.splitlines():
             parts = line.split(":")
             if len(parts) >= 2 and parts[0] == "wlan0":
-                if parts[1] == target_state:
+                if state_word(parts[1]) == target_state:
                     return True
         time.sleep(0.5)
     return False
@@ -237,14 +263,19 @@ def wifi_watchdog(poll_interval: int = 5):
         except Exception:
             logger.exception("WiFi watchdog error")
 
-        time.sleep(poll_interval)
+        state = get_network_state(HOTSPOT_NAME)
+        if state is not None:
+            # React to the next network event right away, re-check at least every poll_interval
+            state.wait_for_change(poll_interval)
+        else:
+            time.sleep(poll_interval)
 
 
 def start_ap_mode(wait_until_up: bool = False):
     logger.info("Starting AP Mode...")
     print("Starting AP Mode...")
 
-    existing = subprocess.run(
+    existing = run_nmcli(
         ["nmcli", "-t", "-f", "NAME", "connection", "show"],
         capture_output=True,
         text=True
@@ -252,7 +283,7 @@ def start_ap_mode(wait_until_up: bool = False):
     logger.info("Existing NM connections: %s", existing.stdout.strip())
 
     if HOTSPOT_NAME not in existing.stdout:
-        result = subprocess.run([
+        result = run_nmcli([
             "nmcli", "device", "wifi", "hotspot",
             "ifname", "wlan0",
             "con-name", HOTSPOT_NAME,
@@ -263,7 +294,7 @@ def start_ap_mode(wait_until_up: bool = False):
         logger.info("Hotspot create rc=%s stdout=%s stderr=%s",
                     result.returncode, result.stdout, result.stderr)
     else:
-        result = subprocess.run(
+        result = run_nmcli(
             ["nmcli", "connection", "up", HOTSPOT_NAME],
             capture_output=True,
             text=True
@@ -280,7 +311,7 @@ def stop_ap_mode():
     logger.info("Stopping AP Mode...")
     print("Stopping AP Mode...")
 
-    result = subprocess.run(
+    result = run_nmcli(
         ["nmcli", "connection", "down", HOTSPOT_NAME],
         capture_output=True,
         text=True
@@ -327,8 +358,11 @@ def scan_ssids_while_ap() -> set[str] | None:
 def save_last_provision_result(result: dict):
     """Persist last provision attempt for GET /provision/result after reconnect."""
     os.makedirs(os.path.dirname(last_provision_result_path), exist_ok=True)
-    with open(last_provision_result_path, "w") as f:
+    # Write then rename: readers never see a half-written file
+    tmp = last_provision_result_path + ".tmp"
+    with open(tmp, "w") as f:
         json.dump(result, f, indent=2)
+    os.replace(tmp, last_provision_result_path)
     logger.info("Saved last provision result: %s", result)
 
 
@@ -342,10 +376,15 @@ def load_last_provision_result() -> dict | None:
         return None
 
 
-def connect_to_wifi(ssid: str, password: str) -> bool:
-    print(f"Connecting to WiFi: {ssid}")
+def rescan_wifi(scanner=None):
+    """Fresh NetworkManager scan; nmcli only connects to SSIDs it has seen"""
+    if scanner is not None:
+        result = scanner.refresh(rescan="yes")
+        if result is not None:
+            print("VISIBLE SSIDS:\n", "\n".join(sorted(result.ssids())))
+            return
 
-    subprocess.run(
+    run_nmcli(
         ["nmcli", "device", "wifi", "rescan", "ifname", "wlan0"],
         stderr=subprocess.DEVNULL,
         stdout=subprocess.DEVNULL
@@ -353,39 +392,61 @@ def connect_to_wifi(ssid: str, password: str) -> bool:
 
     time.sleep(3)
 
-    scan = subprocess.run(
+    scan = run_nmcli(
         ["nmcli", "-t", "-f", "SSID", "device", "wifi", "list"],
         capture_output=True,
         text=True
     )
     print("VISIBLE SSIDS:\n", scan.stdout)
 
-    result = subprocess.run(
-        [
+
+def connect_to_wifi(ssid: str, password: str) -> bool:
+    print(f"Connecting to WiFi: {ssid}")
+
+    scanner = get_wifi_scanner()
+    # No background scans while wlan0 associates
+    with scanner.hold() if scanner is not None else contextlib.nullcontext():
+        cached = scanner.fresh() if scanner is not None else None
+        if cached is not None and ssid in cached.ssids():
+            logger.info("%s seen by a scan %.0fs ago — connecting without rescan", ssid, cached.age)
+        else:
+            cached = None
+            rescan_wifi(scanner)
+
+        cmd = [
             "nmcli", "device", "wifi", "connect", ssid,
             "password", password, "ifname", "wlan0"
-        ],
-        capture_output=True,
-        text=True
-    )
+        ]
+        started = time.monotonic()
+        result = run_nmcli(cmd, capture_output=True, text=True)
+        if result.returncode == 10 and cached is not None:
+            # "No network with SSID": the cached scan (e.g. from iw in AP
+            # mode) never reached NetworkManager's own list
+            logger.info("NetworkManager has not seen %s yet — rescanning", ssid)
+            rescan_wifi(scanner)
+            started = time.monotonic()
+            result = run_nmcli(cmd, capture_output=True, text=True)
     print("NMCLI STDOUT:", result.stdout)
     print("NMCLI STDERR:", result.stderr)
 
+    if result.returncode == 0:
+        # `nmcli device wifi connect` names the new profile after the SSID
+        latest = scanner.latest if scanner is not None else None
+        signal = visible_signals(latest).get(ssid) if latest is not None else None
+        get_known_networks().record_success(ssid, ssid, time.monotonic() - started, signal)
     return result.returncode == 0
 
 
-def send_device_config(pairing_token: str):
-    logger.info("Sending device config to backend")
-
-    if not os.path.exists(config_path):
-        logger.error("Device config not found at %s", config_path)
-        print("Device config not found")
-        return False
-
+def register_device(pairing_token: str, ref: str | None = None):
+    """
+    Send the device config to the backend through the outbox: first attempt
+    now, retried in the background if the backend is unreachable.
+    Returns (outbox entry, device info).
+    """
     with open(config_path, "r") as f:
         device_info = json.load(f)
 
-    payload =  {
+    payload = {
         "pairing_token": pairing_token,
         "serial_number": device_info["serial_number"],
         "machine_name": device_info.get("machine_name"),
@@ -394,19 +455,51 @@ def send_device_config(pairing_token: str):
     }
 
     logger.info("Backend payload: %s", payload)
+    outbox = get_backend_outbox()
+    outbox.on_result = _on_backend_result
+    outbox.start()
+    return outbox.send(BACKEND_API, payload, ref=ref), device_info
+
+
+def _on_backend_result(entry: dict):
+    """Outbox entry delivered or given up: update the saved provision result it belongs to"""
+    # On the provisioning worker, so the read-modify-write cannot interleave
+    # with a job saving its own result
+    provision_jobs.run(_update_provision_result, entry)
+
+
+def _update_provision_result(entry: dict):
+    result = load_last_provision_result()
+    if not result or result.get("delivery_id") != entry["id"]:
+        return
+    delivered = entry["state"] == DELIVERED
+    result.update({
+        "status": "ok" if delivered else "error",
+        "message": entry["response"] if entry["response"] is not None else entry["error"],
+    })
+    save_last_provision_result(result)
+
+
+def send_device_config(pairing_token: str):
+    logger.info("Sending device config to backend")
+
+    if not os.path.exists(config_path):
+        logger.error("Device config not found at %s", config_path)
+        print("Device config not found")
+        return False
 
     try:
-        response = requests.post(BACKEND_API, json=payload, timeout=10)
-        print("Backend response:", response.status_code, response.text)
-        logger.info(
-            "Backend response status=%s body=%s",
-            response.status_code,
-            response.text
-        )
-        return response.status_code == 200
+        entry, _ = register_device(pairing_token)
     except Exception:
         logger.exception("Exception while sending device config")
         return False
+    print("Backend response:", entry["status_code"], entry["response"] or entry["error"])
+    logger.info(
+        "Backend response status=%s body=%s",
+        entry["status_code"],
+        entry["response"]
+    )
+    return entry["state"] == DELIVERED
 
 
 def switch_wifi_only(ssid: str, password: str) -> bool:
@@ -508,9 +601,15 @@ def switch_wifi(ssid: str, password: str, pairing_token: str):
 
 
 @app.post("/provision")
-async def provision_wifi(request: Request):
+async def provision_wifi(request: Request, wait: float = 0):
+    """
+    Validate the request and queue a provisioning job; returns its job_id
+    right away (202). Poll GET /provision/jobs/{job_id}, or after the hotspot
+    drops, reconnect and call GET /provision/result. wait: seconds (up to
+    PROVISION_MAX_WAIT) to hold the response for the final result, e.g. to
+    get "Wifi not found" without polling.
+    """
     data = await request.json()
-
     print("RECEIVED PROVISION PAYLOAD:", data)
     logger.info("Received provision payload: %s", data)
 
@@ -520,16 +619,67 @@ async def provision_wifi(request: Request):
 
     if not ssid or not password or not pairing_token:
         logger.warning("Invalid provision request payload")
+        provision_attempts.labels("invalid").inc()
         return {
             "status": "error",
             "message": "SSID, password, and pairing token are required"
         }
 
-    # Scan while AP is still up; if SSID not in range, return failed without dropping AP
-    visible = scan_ssids_while_ap()
+    job, accepted = provision_jobs.submit(ssid, _run_provision, ssid, password, pairing_token)
+    if not accepted:
+        provision_attempts.labels("busy").inc()
+        return JSONResponse(status_code=409, content={
+            "status": "busy",
+            "message": "A provisioning job is already running",
+            **job.to_dict(),
+        })
+
+    await provision_jobs.wait(job, min(wait, PROVISION_MAX_WAIT))
+    if job.done:
+        return {**job.result, "job_id": job.id, "state": job.state}
+    return JSONResponse(status_code=202, content={"status": "accepted", **job.to_dict()})
+
+
+@app.get("/provision/jobs")
+async def list_provision_jobs():
+    """Recent provisioning jobs, newest first."""
+    return {"status": "ok", "jobs": [job.to_dict() for job in provision_jobs.jobs()]}
+
+
+@app.get("/provision/jobs/{job_id}")
+async def get_provision_job(job_id: str):
+    """State, transition history and (once final) result of one provisioning job."""
+    job = provision_jobs.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"status": "error", "message": "Unknown job"})
+    return {"status": "ok", **job.to_dict()}
+
+
+def _finish_provision(job, succeeded: bool, result: dict, outcome: str):
+    """Record a job's final result for GET /provision/result and the metrics"""
+    save_last_provision_result({**result, "job_id": job.id, "ssid": job.ssid})
+    provision_attempts.labels(outcome).inc()
+    job.finish(succeeded, result)
+
+
+def _run_provision(job, ssid: str, password: str, pairing_token: str):
+    """Provisioning job body, runs on the provisioning worker thread"""
+    scanner = get_wifi_scanner()
+    # No background scans while a client is mid-provision
+    with scanner.hold() if scanner is not None else contextlib.nullcontext():
+        _provision_steps(job, scanner, ssid, password, pairing_token)
+
+
+def _provision_steps(job, scanner, ssid: str, password: str, pairing_token: str):
+    global watchdog_enabled
+
+    # Scan while AP is still up; if SSID not in range, fail without dropping AP
+    job.advance(SCANNING)
+    visible = scanner.ssids(require=ssid) if scanner is not None else scan_ssids_while_ap()
     if visible is not None and ssid not in visible:
         logger.warning("SSID not found in scan: %s (visible: %s)", ssid, visible)
-        return {"status": "failed", "message": "Wifi not found"}
+        _finish_provision(job, False, {"status": "failed", "message": "Wifi not found"}, "not_found")
+        return
 
     # SSID is there (or scan unavailable) — clear previous result, then drop AP and try connect
     if os.path.exists(last_provision_result_path):
@@ -538,61 +688,70 @@ async def provision_wifi(request: Request):
         except OSError:
             pass
 
-    global watchdog_enabled
+    job.advance(CONNECTING)
     watchdog_enabled = False  # temporarily stop watchdog
+    try:
+        stop_ap_mode()
+        wait_for_wlan_state("disconnected", timeout=10)
 
-    stop_ap_mode()
-    wait_for_wlan_state("disconnected", timeout=10)
-
-    success = connect_to_wifi(ssid, password)
-    if not success:
-        logger.warning("First Wi-Fi connection attempt failed — retrying once...")
-        time.sleep(3)
         success = connect_to_wifi(ssid, password)
+        if not success:
+            logger.warning("First Wi-Fi connection attempt failed — retrying once...")
+            time.sleep(3)
+            success = connect_to_wifi(ssid, password)
 
-    if not success:
-        save_last_provision_result({
-            "status": "failed",
-            "message": "Failed to connect. Wrong password or network unreachable.",
-            "ssid": ssid,
-        })
-        start_ap_mode(wait_until_up=True)
+        if not success:
+            start_ap_mode(wait_until_up=True)
+            # Client is disconnected; they can reconnect to hotspot and GET /provision/result
+            _finish_provision(job, False, {
+                "status": "failed",
+                "message": "Failed to connect. Wrong password or network unreachable.",
+            }, "wifi_failed")
+            return
+    except Exception as e:
+        # The AP is (probably) down already: bring it back so the client can
+        # reconnect and read the error from GET /provision/result
+        logger.exception("Provisioning failed while switching Wi-Fi")
+        try:
+            if not is_client_wifi_connected():
+                start_ap_mode(wait_until_up=True)
+        except Exception:
+            logger.exception("Could not restore the hotspot")
+        _finish_provision(job, False, {"status": "failed", "message": f"Provisioning error: {e}"}, "wifi_error")
+        return
+    finally:
         watchdog_enabled = True
-        # Client is disconnected; they can reconnect to hotspot and GET /provision/result
-        return {"status": "failed", "message": f"Failed to connect to Wi-Fi {ssid}"}
 
     # Connected — send config to backend and get response
+    job.advance(REGISTERING)
     try:
-        with open(config_path, "r") as f:
-            device_info = json.load(f)
-
-        payload = {
-            "pairing_token": pairing_token,
-            "serial_number": device_info["serial_number"],
-            "machine_name": device_info.get("machine_name"),
-            "model": device_info.get("model"),
-            "firmware_version": device_info.get("firmware_version")
-        }
-
-        response = requests.post(BACKEND_API, json=payload, timeout=10)
-        backend_status = "ok" if response.status_code == 200 else "error"
-        backend_message = response.text
-
+        entry, device_info = register_device(pairing_token, ref=job.id)
     except Exception as e:
-        backend_status = "error"
-        backend_message = str(e)
-
-    watchdog_enabled = True
-
-    # Forward backend response to frontend
-    return {
-        "status": backend_status,
-        "message": backend_message,
-        "device": device_info
-    }
-
-
-def _on_mqtt_wifi_set(message: str, topic: str):
+        _finish_provision(job, False, {"status": "error", "message": str(e), "device": None}, "backend_error")
+        return
+
+    if entry["state"] == PENDING:
+        # Backend unreachable for now; the outbox keeps retrying and
+        # GET /provision/result follows the delivery
+        _finish_provision(job, True, {
+            "status": "pending",
+            "message": f"Registration queued, retrying: {entry['error'] or 'HTTP %s' % entry['status_code']}",
+            "device": device_info,
+            "delivery_id": entry["id"],
+        }, "queued")
+        return
+
+    # Same reply the backend gave, as the synchronous endpoint used to return it
+    delivered = entry["state"] == DELIVERED
+    _finish_provision(job, delivered, {
+        "status": "ok" if delivered else "error",
+        "message": entry["response"] if entry["response"] is not None else entry["error"],
+        "device": device_info,
+        "delivery_id": entry["id"],
+    }, "ok" if delivered else "backend_error")
+
+
+def _on_mqtt_wifi_set(message: str, topic: str, segments: list | None = None):
     """
     Handle MQTT payload to change WiFi when device is already on WiFi.
     Payload: JSON {"ssid": "...", "password": "..."}
@@ -609,8 +768,9 @@ def _on_mqtt_wifi_set(message: str, topic: str):
             logger.warning("MQTT wifi/set: missing ssid in payload")
             return
         logger.info("MQTT wifi/set: switching to %s", ssid)
-        # Run in thread so we don't block MQTT loop
-        threading.Thread(target=switch_wifi_from_mqtt, args=(ssid, password), daemon=True).start()
+        # Run on the provisioning worker so we don't block the MQTT loop and
+        # never switch Wi-Fi while a provisioning job is using it
+        provision_jobs.run(switch_wifi_from_mqtt, ssid, password)
     except json.JSONDecodeError as e:
         logger.warning("MQTT wifi/set: invalid JSON %s", e)
     except Exception as e:
@@ -623,19 +783,103 @@ async def get_provision_result():
     Result of the last provision attempt. After a failed connect (e.g. wrong password),
     the device brings the hotspot back; reconnect to BIOTECH and call this to get the error.
     """
-    result = load_last_provision_result()
+    job = provision_jobs.active()
+    if job is not None:
+        return {"status": "in_progress", "message": f"Provisioning {job.state}", **job.to_dict()}
+    result = await run_in_threadpool(load_last_provision_result)
     if result is None:
         return {"status": "unknown", "message": "No previous provision attempt."}
+    if result.get("delivery_id") is not None:
+        # Live state of the backend registration (attempts, next retry, ...)
+        result["delivery"] = await run_in_threadpool(get_backend_outbox().get, result["delivery_id"])
     return result
 
 
-if __name__ == "__main__":
-    logger.info("Provision service starting")
+@app.get("/scan")
+async def get_scan(refresh: bool = False, max_age: float | None = None):
+    """
+    Wi-Fi networks in range (one entry per SSID, strongest first) from the
+    background scan cache. A cache older than max_age (default
+    WIFI_SCAN_MAX_AGE) is returned with stale=true while a new scan runs;
+    refresh=true waits for a new scan.
+    """
+    scanner = get_wifi_scanner()
+    if scanner is None:
+        return {"status": "error", "message": "Wi-Fi scanning is disabled"}
+    max_age = scanner.max_age if max_age is None else max_age
+    result = scanner.fresh(max_age)
+    if result is None or refresh:
+        if scanner.latest is not None and (scanner.held or not refresh):
+            # Serve what we have; never scan while wlan0 is being connected
+            result = scanner.latest
+            if not scanner.held:
+                scanner.refresh_soon()
+        else:
+            result = await run_in_threadpool(scanner.refresh)
+    if result is None:
+        return {"status": "error", "message": "Wi-Fi scan failed"}
+    return {
+        "status": "ok",
+        "scanned_at": result.scanned_at,
+        "age": round(result.age, 1),
+        "stale": result.age > max_age,
+        "source": result.source,
+        "networks": result.networks(),
+    }
+
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Prometheus text format metrics for this process."""
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/timeseries")
+def get_timeseries_info():
+    """Stages and fields available in the local sensor history, plus store stats."""
+    store = get_timeseries_store()
+    if store is None:
+        return {"status": "error", "message": "Sensor history is disabled"}
+    from data.records import STAGE_SCHEMAS
+    return {
+        "status": "ok",
+        "stages": {stage: list(fields) for stage, fields in STAGE_SCHEMAS.items()},
+        "store": store.stats(),
+    }
+
+
+@app.get("/timeseries/{stage}")
+def get_timeseries(stage: str, fields: str | None = None, start: float | None = None,
+                   end: float | None = None, hours: float = 24, resolution: str = "auto"):
+    """
+    Local sensor history for one stage. start/end are unix times (default:
+    the last `hours` hours); fields is comma separated (default: all of the
+    stage); resolution is raw, 60, 3600 or auto.
+    """
+    store = get_timeseries_store()
+    if store is None:
+        return {"status": "error", "message": "Sensor history is disabled"}
+    end = time.time() if end is None else end
+    start = end - hours * 3600 if start is None else start
+    try:
+        series = store.query(
+            stage,
+            fields=[name.strip() for name in fields.split(",") if name.strip()] if fields else None,
+            start=start,
+            end=end,
+            resolution=resolution,
+        )
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+    return {"status": "ok", "stage": stage, "start": start, "end": end, **series}
+
+
+def prepare_network():
+    """Wait for NetworkManager, join a saved network or start the hotspot, start the watchdog"""
     # Wait until NetworkManager is ready
     for _ in range(10):
         try:
-            if subprocess.run(["nmcli", "-t", "-f", "DEVICE", "device"], capture_output=True, text=True).returncode == 0:
+            if run_nmcli(["nmcli", "-t", "-f", "DEVICE", "device"], capture_output=True, text=True).returncode == 0:
                 break
         except Exception:
             time.sleep(1)
@@ -660,15 +904,34 @@ if __name__ == "__main__":
             start_ap_mode(wait_until_up=True)
 
     threading.Thread(target=wifi_watchdog, daemon=True).start()
+    get_wifi_scanner()  # start background scans so /scan and /provision have a list ready
+    start_backend_outbox()
+
 
-    # MQTT subscriber for remote WiFi change (no backend call)
+def start_backend_outbox():
+    """Resume backend calls left pending by a previous run"""
+    try:
+        outbox = get_backend_outbox()
+    except Exception as e:
+        logger.error("✗ Backend outbox unavailable: %s", e)
+        return
+    outbox.on_result = _on_backend_result
+    outbox.start()
+
+
+def start_mqtt_listener():
+    """MQTT subscriber for remote WiFi change (no backend call); shares an existing client"""
     try:
         from mqtt.mqtt_client import init_mqtt, subscribe as mqtt_subscribe
-        if init_mqtt() is not None:
-            mqtt_subscribe(MQTT_TOPIC_WIFI_SET, _on_mqtt_wifi_set)
+        mqtt_subscribe(MQTT_TOPIC_WIFI_SET, _on_mqtt_wifi_set)
+        if init_mqtt(role="provision") is not None:
             logger.info("Subscribed to MQTT topic: %s", MQTT_TOPIC_WIFI_SET)
     except Exception as e:
         logger.warning("MQTT wifi subscriber not started: %s", e)
 
-    uvicorn.run(app, host="0.0.0.0", port=5000)
 
+if __name__ == "__main__":
+    logger.info("Provision service starting")
+    prepare_network()
+    start_mqtt_listener()
+    uvicorn.run(app, host=API_HOST, port=API_PORT)
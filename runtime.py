@@ -0,0 +1,137 @@
+"""
+Unified Runtime - main.py and provision.py in one process on one event loop
+Alternative to running the two services separately: one asyncio loop hosts
+the MQTT network I/O (one broker connection and TLS session shared by the
+publisher, command handling and the Wi-Fi listener, no paho thread), the
+heartbeat and the FastAPI provisioning app (uvicorn Server.serve).
+
+pyserial has no asyncio interface, so the serial reader and publisher stay
+on one thread, and actuator commands still run on the ActuatorExecutor pool
+(their serial writes block). Metrics are served by the app on GET /metrics.
+
+Usage: python runtime.py [--no-provision]
+"""
+import argparse
+import asyncio
+import contextlib
+import signal
+import threading
+
+from config import config
+from mqtt import mqtt_client, publisher, subscriber
+from network.network_state import get_network_state
+from utils import log
+
+logger = log.get_logger(__name__)
+
+SHUTDOWN_TIMEOUT = 10  # seconds to let the publisher flush on exit
+
+
+async def _heartbeat(serial_number, stopping):
+    """Publish '1' every HEARTBEAT_INTERVAL seconds unless in AP mode"""
+    topic = publisher.HEARTBEAT_TOPIC.format(serial=serial_number)
+    while True:
+        try:
+            await asyncio.wait_for(stopping.wait(), timeout=publisher.HEARTBEAT_INTERVAL)
+            return
+        except asyncio.TimeoutError:
+            pass
+        state = get_network_state(publisher.HOTSPOT_NAME)
+        # The cached network state answers instantly; plain nmcli blocks
+        ap_active = state.is_ap_active() if state is not None else await asyncio.to_thread(publisher.is_ap_active)
+        if not ap_active:
+            mqtt_client.publish(topic, "1", QoS=1)
+
+
+def _make_server(app, host, port):
+    """uvicorn.Server that ends serve() on SIGINT/SIGTERM without re-raising the signal"""
+    import uvicorn
+
+    class Server(uvicorn.Server):
+        @contextlib.contextmanager
+        def capture_signals(self):
+            # uvicorn re-raises the captured signal once serve() is done, which
+            # would skip (SIGINT) or kill (SIGTERM) our own shutdown sequence
+            with super().capture_signals():
+                yield
+                getattr(self, "_captured_signals", []).clear()
+
+    if not hasattr(uvicorn.Server, "capture_signals"):
+        Server = uvicorn.Server  # older uvicorn never re-raises
+    return Server(uvicorn.Config(app, host=host, port=port, log_config=None, lifespan="off"))
+
+
+def _start_publisher(loop, stop_event):
+    """publisher.main on a daemon thread; returns an asyncio.Event set when it returns"""
+    finished = asyncio.Event()
+
+    def run():
+        try:
+            publisher.main(stop_event=stop_event, heartbeat=False)
+        except Exception as e:
+            logger.error("Error in publisher: %s", e)
+        finally:
+            loop.call_soon_threadsafe(finished.set)
+
+    threading.Thread(target=run, daemon=True, name="Publisher").start()
+    return finished
+
+
+async def run(provision=True):
+    loop = asyncio.get_running_loop()
+    # Handlers before connecting, for commands queued in a persistent session
+    subscriber.subscribe_commands()
+    mqtt_client.init_mqtt(role="device", loop=loop)
+
+    stop_publisher = threading.Event()
+    publisher_done = _start_publisher(loop, stop_publisher)
+    stopping = asyncio.Event()
+    heartbeat = asyncio.create_task(_heartbeat(config.SERIAL_NUMBER, stopping), name="Heartbeat")
+
+    try:
+        if provision:
+            import provision as provisioning
+            try:
+                await asyncio.to_thread(provisioning.prepare_network)
+            except Exception as e:
+                # Keep the device services and the API up even without Wi-Fi management
+                logger.error("✗ Network preparation failed: %s", e)
+            provisioning.start_mqtt_listener()
+            server = _make_server(provisioning.app, provisioning.API_HOST, provisioning.API_PORT)
+            logger.info("✓ Provisioning API on %s:%d", provisioning.API_HOST, provisioning.API_PORT)
+            await server.serve()  # returns on SIGINT / SIGTERM
+        else:
+            shutdown = asyncio.Event()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, shutdown.set)
+            await shutdown.wait()
+    finally:
+        logger.info("Runtime shutting down...")
+        stopping.set()
+        stop_publisher.set()
+        try:
+            # The publisher stops at its next batch and flushes window/history
+            await asyncio.wait_for(publisher_done.wait(), SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("⚠ Publisher did not stop within %ds", SHUTDOWN_TIMEOUT)
+            # Its finally block never ran: report offline ourselves
+            mqtt_client.publish(publisher.HEARTBEAT_TOPIC.format(serial=config.SERIAL_NUMBER), "0", QoS=1)
+            logger.info("✓ Heartbeat published 0 (offline)")
+        await heartbeat
+        await mqtt_client.close_async()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--no-provision", action="store_true",
+                        help="device services only (no Wi-Fi management or provisioning API)")
+    args = parser.parse_args()
+    logger.info("Starting unified runtime...")
+    try:
+        asyncio.run(run(provision=not args.no_provision))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+Fleet Simulator for Load-Testing the MQTT Path
+Runs thousands of virtual devices on one asyncio loop. Each device has its
+own serial number and MQTT connection, publishes sensor batches to
+hydronew/ai/classification and heartbeats to biotech/<serial>/heartbeat,
+and answers pump/valve commands on the same topics as mqtt/subscriber.py
+(ack + state). A simulated backend sends commands and consumes the sensor
+topic, so the run reports:
+  publish->PUBACK   device publish to broker acknowledgement
+  sensor e2e        device publish to backend receipt (timestamp in payload)
+  command rtt       backend command to device ack
+By default an embedded LocalBroker (mqtt/local_broker.py) is used; point
+--broker at another broker to load-test it instead.
+
+Usage: python simulate_fleet.py [--devices 1000] [--interval 5] [--commands 20]
+       [--duration 60] [--broker host:port] [--format text|binary]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import resource
+import time
+
+from data.records import STAGES
+from mqtt import mqtt_wire as wire
+from mqtt.batch_assembler import SensorBatch
+from mqtt.local_broker import LocalBroker
+from mqtt.payload import TIMESTAMP_PREFIX, decode_binary, encode, is_binary
+from simulate_serial import generate_sensor_data
+from utils.latency import LatencyRecorder
+
+CLASSIFICATION_TOPIC = "hydronew/ai/classification"
+HEARTBEAT_TOPIC = "biotech/{serial}/heartbeat"
+# Same filters mqtt/subscriber.py subscribes to
+COMMAND_FILTERS = (
+    "mfc/{serial}/pump/+",
+    "hydroponics/{serial}/pump/+",
+    "reservoir_fallback/{serial}/pump/+",
+    "reservoir/{serial}/pump/+",
+    "mfc/{serial}/valve/+",
+    "mfc_fallback/{serial}/valve/+",
+)
+COMMAND_TOPICS = ("mfc/{serial}/pump/1", "hydroponics/{serial}/pump/2", "mfc/{serial}/valve/1")
+
+
+class SimClient:
+    """Minimal asyncio MQTT 3.1.1 client (QoS 0/1) for one virtual device"""
+
+    def __init__(self, client_id, on_message=None):
+        self.client_id = client_id
+        self.on_message = on_message
+        self._reader = None
+        self._writer = None
+        self._ids = itertools.cycle(range(1, 65536))
+        self._pending = {}   # packet id -> future
+        self._tasks = []
+        self.connected = False
+
+    async def connect(self, host, port, keepalive=60):
+        self._reader, self._writer = await asyncio.open_connection(host, port)
+        self._writer.write(wire.connect(self.client_id, keepalive))
+        packet_type, _, body = await wire.read_packet(self._reader)
+        if packet_type != wire.CONNACK or body[1] != 0:
+            raise ConnectionError(f"{self.client_id}: connection refused")
+        self.connected = True
+        self._tasks = [
+            asyncio.create_task(self._read_loop()),
+            asyncio.create_task(self._ping_loop(keepalive)),
+        ]
+
+    async def subscribe(self, filters, qos=1):
+        packet_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[packet_id] = future
+        self._writer.write(wire.subscribe(packet_id, [(topic, qos) for topic in filters]))
+        await future
+
+    def publish(self, topic, payload, qos=0):
+        """Send a PUBLISH; for QoS 1 returns a future resolved on PUBACK"""
+        if not self.connected:
+            raise ConnectionError(f"{self.client_id}: not connected")
+        packet_id = next(self._ids) if qos else 0
+        self._writer.write(wire.publish(topic, payload, qos, packet_id=packet_id))
+        if qos:
+            future = asyncio.get_running_loop().create_future()
+            self._pending[packet_id] = future
+            return future
+        return None
+
+    async def _read_loop(self):
+        try:
+            while True:
+                packet_type, flags, body = await wire.read_packet(self._reader)
+                if packet_type == wire.PUBLISH:
+                    topic, payload, qos, _, packet_id = wire.parse_publish(flags, body)
+                    if qos:
+                        self._writer.write(wire.ack(wire.PUBACK, packet_id))
+                    if self.on_message is not None:
+                        self.on_message(self, topic, payload)
+                elif packet_type in (wire.PUBACK, wire.SUBACK):
+                    future = self._pending.pop(wire.parse_packet_id(body), None)
+                    if future is not None:
+                        if not future.done():
+                            future.set_result(None)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._lost()
+
+    async def _ping_loop(self, keepalive):
+        while self.connected:
+            await asyncio.sleep(keepalive / 2)
+            if self.connected:
+                self._writer.write(wire.PINGREQ_PACKET)
+
+    def _lost(self):
+        self.connected = False
+        # Cancelled rather than failed: nobody has to retrieve the error
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+
+    async def close(self):
+        if self.connected:
+            self._writer.write(wire.DISCONNECT_PACKET)
+        self.connected = False
+        for task in self._tasks:
+            task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+
+
+class Fleet:
+    """Shared counters and latency recorders for one simulation run"""
+
+    def __init__(self, args):
+        self.args = args
+        self.devices = {}   # serial -> SimClient (connected devices)
+        self.total = {name: LatencyRecorder(maxlen=200_000) for name in ("puback", "sensor_e2e", "command_rtt")}
+        self.interval = {name: LatencyRecorder(maxlen=50_000) for name in self.total}
+        self.counts = dict.fromkeys(
+            ("sensor_sent", "sensor_received", "heartbeats", "commands_sent", "acks_received",
+             "publish_errors", "connect_failures"), 0)
+        self._commands = {}  # command topic -> sent_at
+        self.backend = []
+
+    def record(self, name, seconds):
+        self.total[name].record(seconds)
+        self.interval[name].record(seconds)
+
+    # ---------------- device side ----------------
+
+    async def run_device(self, host, port, index):
+        serial = f"SIM-{index:05d}"
+        client = SimClient(serial, on_message=self._on_command)
+        try:
+            await client.connect(host, port)
+            await client.subscribe([template.format(serial=serial) for template in COMMAND_FILTERS])
+        except (OSError, ConnectionError):
+            self.counts["connect_failures"] += 1
+            return
+        self.devices[serial] = client
+        # Spread devices over the interval instead of publishing in lockstep
+        await asyncio.gather(
+            self._sensor_loop(client, serial, random.uniform(0, self.args.interval)),
+            self._heartbeat_loop(client, serial, random.uniform(0, self.args.heartbeat)),
+        )
+
+    async def _sensor_loop(self, client, serial, delay):
+        await asyncio.sleep(delay)
+        while client.connected:
+            started = time.perf_counter()
+            records = generate_sensor_data()
+            batch = SensorBatch([record.to_line() for record in records], list(records), 0.0, 0.0)
+            payload = encode(serial, [batch], [time.time()], self.args.format, text_timestamps=True)
+            self._track(client.publish(CLASSIFICATION_TOPIC, payload, qos=self.args.qos), started)
+            self.counts["sensor_sent"] += 1
+            await asyncio.sleep(self.args.interval)
+
+    async def _heartbeat_loop(self, client, serial, delay):
+        await asyncio.sleep(delay)
+        topic = HEARTBEAT_TOPIC.format(serial=serial)
+        while client.connected:
+            self._track(client.publish(topic, "1", qos=1), time.perf_counter())
+            self.counts["heartbeats"] += 1
+            await asyncio.sleep(self.args.heartbeat)
+
+    def _track(self, future, started):
+        if future is None:
+            return
+
+        def done(f):
+            if f.cancelled() or f.exception() is not None:
+                self.counts["publish_errors"] += 1
+            else:
+                self.record("puback", time.perf_counter() - started)
+        future.add_done_callback(done)
+
+    def _on_command(self, client, topic, payload):
+        # Same replies as mqtt/subscriber.py: <topic>/ack "1" and <topic>/state
+        command = payload.decode(errors="replace").upper()
+        if command not in ("OPEN", "CLOSE"):
+            return
+        client.publish(f"{topic}/ack", "1", qos=1)
+        client.publish(f"{topic}/state", "1" if command == "OPEN" else "0", qos=1)
+
+    # ---------------- backend side ----------------
+
+    async def run_backend(self, host, port):
+        consumer = SimClient("sim-backend-consumer", on_message=self._on_sensor_data)
+        controller = SimClient("sim-backend-controller", on_message=self._on_ack)
+        self.backend = [consumer, controller]
+        await consumer.connect(host, port)
+        await consumer.subscribe([CLASSIFICATION_TOPIC])
+        await controller.connect(host, port)
+        await controller.subscribe(["+/+/+/+/ack"])
+        if self.args.commands <= 0:
+            return
+        while controller.connected:
+            await asyncio.sleep(random.expovariate(self.args.commands))
+            if not self.devices:
+                continue
+            serial = random.choice(list(self.devices))
+            topic = random.choice(COMMAND_TOPICS).format(serial=serial)
+            self._commands[topic] = time.perf_counter()
+            controller.publish(topic, random.choice(("OPEN", "CLOSE")), qos=1)
+            self.counts["commands_sent"] += 1
+
+    def _on_sensor_data(self, client, topic, payload):
+        now = time.time()
+        self.counts["sensor_received"] += 1
+        if is_binary(payload):
+            timestamps = [batch["timestamp"] for batch in decode_binary(payload)["batches"]]
+        else:
+            timestamps = [float(line[len(TIMESTAMP_PREFIX):])
+                          for line in payload.decode().splitlines() if line.startswith(TIMESTAMP_PREFIX)]
+        for ts in timestamps:
+            self.record("sensor_e2e", now - ts)
+
+    def _on_ack(self, client, topic, payload):
+        sent_at = self._commands.pop(topic[:-len("/ack")], None)
+        self.counts["acks_received"] += 1
+        if sent_at is not None:
+            self.record("command_rtt", time.perf_counter() - sent_at)
+
+    # ---------------- reporting ----------------
+
+    def report_line(self, elapsed, window, previous):
+        sent = self.counts["sensor_sent"] - previous["sensor_sent"]
+        received = self.counts["sensor_received"] - previous["sensor_received"]
+        target = len(self.devices) / self.args.interval
+
+        def pcts(name):
+            snap = self.interval[name].snapshot()
+            self.interval[name].reset()
+            if not snap["count"]:
+                return "-"
+            return f"{snap['p50_ms']:.1f}/{snap['p95_ms']:.1f}/{snap['p99_ms']:.1f}"
+
+        return (f"[{elapsed:6.1f}s] devices {len(self.devices)}/{self.args.devices} | "
+                f"sensor {sent / window:.1f}/s sent, {received / window:.1f}/s consumed "
+                f"(target {target:.1f}/s) | ms p50/p95/p99 puback {pcts('puback')} "
+                f"e2e {pcts('sensor_e2e')} cmd {pcts('command_rtt')}")
+
+
+def _raise_fd_limit(needed):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        target = needed if hard == resource.RLIM_INFINITY else min(hard, needed)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        if target < needed:
+            print(f"⚠ Open file limit is {target}; fewer than {needed} sockets may connect")
+
+
+async def run(args):
+    broker = None
+    if args.broker:
+        host, _, port = args.broker.rpartition(":")
+        port = int(port)
+    else:
+        broker = await LocalBroker("127.0.0.1", 0).start()
+        host, port = "127.0.0.1", broker.port
+        print(f"✓ Embedded local broker on {host}:{port}")
+
+    fleet = Fleet(args)
+    tasks = [asyncio.create_task(fleet.run_backend(host, port))]
+    await asyncio.sleep(0.2)
+
+    print(f"✓ Starting {args.devices} virtual devices ({args.ramp}/s), "
+          f"sensor batch every {args.interval}s, {args.commands} commands/s\n")
+    started = time.monotonic()
+    for index in range(args.devices):
+        tasks.append(asyncio.create_task(fleet.run_device(host, port, index)))
+        if args.ramp and index % args.ramp == args.ramp - 1:
+            await asyncio.sleep(1)
+
+    previous = dict(fleet.counts)
+    last = time.monotonic()
+    while time.monotonic() - started < args.duration:
+        await asyncio.sleep(args.report)
+        now = time.monotonic()
+        print(fleet.report_line(now - started, now - last, previous))
+        previous, last = dict(fleet.counts), now
+
+    summary = {
+        "devices": args.devices,
+        "connected": len(fleet.devices),
+        "duration": round(time.monotonic() - started, 1),
+        **fleet.counts,
+        **{name: recorder.snapshot() for name, recorder in fleet.total.items()},
+    }
+    if broker is not None:
+        summary["broker"] = broker.stats()
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*(client.close() for client in [*fleet.devices.values(), *fleet.backend]))
+    if broker is not None:
+        await broker.stop()
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--interval", type=float, default=5, help="seconds between sensor batches per device")
+    parser.add_argument("--heartbeat", type=float, default=45, help="seconds between heartbeats per device")
+    parser.add_argument("--commands", type=float, default=20, help="backend commands per second (fleet-wide)")
+    parser.add_argument("--qos", type=int, choices=(0, 1), default=1, help="QoS of sensor publishes")
+    parser.add_argument("--format", choices=("text", "binary"), default="text")
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--ramp", type=int, default=500, help="devices connected per second (0 = all at once)")
+    parser.add_argument("--report", type=float, default=5, help="seconds between progress lines")
+    parser.add_argument("--broker", help="host:port of an external broker (default: embedded)")
+    parser.add_argument("--json", help="write the final summary to this file")
+    args = parser.parse_args()
+
+    _raise_fd_limit(2 * args.devices + 256)
+
+    print(f"\n{'='*70}")
+    print(f"  IoT Fleet Simulator - {args.devices} devices, {len(STAGES)} stages per batch")
+    print(f"{'='*70}\n")
+    try:
+        summary = asyncio.run(run(args))
+    except KeyboardInterrupt:
+        print("\nFleet simulator stopped")
+        return
+
+    print(f"\n{'='*70}")
+    print(json.dumps(summary, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"✓ Summary written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,35 +7,36 @@ import time
 import random
 from mqtt.mqtt_client import init_mqtt, publish
 from config import config
+from data.records import make_record
 
 def generate_sensor_data():
-    """Generate realistic sensor data for all three water stages"""
+    """Generate realistic sensor records for all three water stages"""
     
     # Dirty water: higher TDS, turbidity, lower pH
-    dirty_water = (
-        f"dirty_water,"
-        f"ph:{random.uniform(5, 8.0):.2f},"
-        f"tds:{random.uniform(250, 350):.2f},"
-        f"turbidity:{random.uniform(10, 15):.2f},"
-        f"water_level:{random.uniform(50, 60):.2f}"
+    dirty_water = make_record(
+        "dirty_water",
+        ph=random.uniform(5, 8.0),
+        tds=random.uniform(250, 350),
+        turbidity=random.uniform(10, 15),
+        water_level=random.uniform(50, 60),
     )
     
     # Clean water: lower TDS, turbidity, neutral pH
-    clean_water = (
-        f"clean_water,"
-        f"ph:{random.uniform(5.0, 8.0):.2f},"
-        f"tds:{random.uniform(100, 150):.2f},"
-        f"turbidity:{random.uniform(6, 10):.2f},"
-        f"water_level:{random.uniform(75, 85):.2f}"
+    clean_water = make_record(
+        "clean_water",
+        ph=random.uniform(5.0, 8.0),
+        tds=random.uniform(100, 150),
+        turbidity=random.uniform(6, 10),
+        water_level=random.uniform(75, 85),
     )
     
     # Hydroponics water: high TDS (nutrients), slightly acidic pH
-    hydroponics_water = (
-        f"hydroponics_water,"
-        f"ph:{random.uniform(5.4, 6.6):.2f},"
-        f"tds:{random.uniform(800, 900):.2f},"
-        f"humidity:{random.uniform(55, 65):.2f},"
-        f"ec:{random.uniform(950, 1100):.2f}"
+    hydroponics_water = make_record(
+        "hydroponics_water",
+        ph=random.uniform(5.4, 6.6),
+        tds=random.uniform(800, 900),
+        humidity=random.uniform(55, 65),
+        ec=random.uniform(950, 1100),
     )
     
     return dirty_water, clean_water, hydroponics_water
@@ -60,7 +61,7 @@ def main():
             batch_count += 1
             
             # Generate sensor data for all three stages
-            dirty, clean, hydro = generate_sensor_data()
+            dirty, clean, hydro = (record.to_line() for record in generate_sensor_data())
             
             # Format as expected by AI classifier
             batch_data = f"{dirty}\n{clean}\n{hydro}"
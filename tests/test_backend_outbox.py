@@ -0,0 +1,29 @@
+"""Outbox delivery against the local backend stand-in"""
+from network import local_backend
+from network.backend_outbox import DELIVERED, FAILED, PENDING, BackendClient, Outbox
+
+
+def _outbox(tmp_path, **kwargs):
+    return Outbox(str(tmp_path / "outbox.db"), BackendClient(timeout=(2, 2)), retry_min=0.05, retry_max=0.1, **kwargs)
+
+
+def _bodies(outbox):
+    return dict(outbox._db.execute("SELECT id, body FROM outbox").fetchall())
+
+
+def test_finished_entries_drop_their_body(tmp_path):
+    backend = local_backend.start_in_thread(script=[503, 400], default=200)
+    outbox = _outbox(tmp_path)
+    try:
+        payload = {"serial_number": "SN1", "pairing_token": "secret"}
+        retried = outbox.send(backend.url(), payload)
+        assert retried["state"] == PENDING
+        assert "secret" in _bodies(outbox)[retried["id"]]
+
+        rejected = outbox.send(backend.url(), payload)
+        assert rejected["state"] == FAILED
+        assert outbox._attempt(retried["id"])["state"] == DELIVERED
+        assert _bodies(outbox) == {retried["id"]: None, rejected["id"]: None}
+    finally:
+        outbox.close()
+        backend.shutdown()
@@ -0,0 +1,48 @@
+"""KnownNetworks ranking and connect timeouts"""
+import subprocess
+import types
+
+from network import known_networks
+from network.known_networks import KnownNetworks
+from network.wifi_scan import AccessPoint, ScanResult
+
+
+def _scan(*ssids):
+    return ScanResult([AccessPoint(ssid, "00:00:00:00:00:00", 70.0, 2412, "WPA2") for ssid in ssids], "nmcli")
+
+
+def test_rank_skips_networks_not_in_range(tmp_path):
+    known = KnownNetworks(path=str(tmp_path / "history.json"))
+    profiles = {"home": ("home", False), "office": ("office", False), "lab": ("lab", True)}
+    ranked = known.rank(profiles, _scan("office"))
+    assert [c.name for c in ranked] == ["office", "lab"]
+
+
+def test_rank_falls_back_to_all_profiles_when_none_seen(tmp_path):
+    known = KnownNetworks(path=str(tmp_path / "history.json"))
+    known.record_success("office", "office", 3.0)
+    profiles = {"home": ("home", False), "office": ("office", False)}
+    for scan in (_scan(), _scan("neighbour")):
+        ranked = known.rank(profiles, scan)
+        assert [c.name for c in ranked] == ["office", "home"]
+        assert all(c.visible is None for c in ranked)
+
+
+def test_visible_networks_get_the_full_timeout(tmp_path):
+    known = KnownNetworks(path=str(tmp_path / "history.json"))
+    known.record_success("office", "office", 1.0)
+    assert known.connect_timeout("office", 20, visible=True) == 20
+    assert known.connect_timeout("office", 20) == 5
+    assert known.connect_timeout("unknown", 20) == 20
+
+
+def test_failed_profile_lookup_ranks_by_name(tmp_path, monkeypatch):
+    def run_nmcli(args, **kwargs):
+        if args[-1] == "slow":
+            raise subprocess.TimeoutExpired(args, 10)
+        return types.SimpleNamespace(returncode=0, stdout="Office WiFi\nno\n")
+
+    monkeypatch.setattr(known_networks, "run_nmcli", run_nmcli)
+    known = KnownNetworks(path=str(tmp_path / "history.json"))
+    assert known.profiles(["office", "slow"]) == {"office": ("Office WiFi", False), "slow": ("slow", False)}
+    assert "slow" not in known._profiles
@@ -0,0 +1,45 @@
+"""mqtt_client session ids and subscription binding"""
+import threading
+
+from config import config
+from mqtt import local_broker, mqtt_client
+
+
+def test_client_id_keeps_role_with_configured_id(monkeypatch):
+    monkeypatch.setattr(config, "MQTT_CLIENT_ID", "pi-42")
+    assert mqtt_client.client_id_for("device") == "pi-42-device"
+    assert mqtt_client.client_id_for("provision") == "pi-42-provision"
+
+
+def test_subscribe_before_init_binds_handler(monkeypatch):
+    # Queued persistent-session messages arrive right after CONNACK; the
+    # handler must already be bound when the client connects
+    monkeypatch.setattr(mqtt_client, "client", None)
+    monkeypatch.setattr(mqtt_client, "_subscriptions", set())
+    received = []
+    mqtt_client.subscribe("test/early/+", lambda message, topic, segments: received.append((topic, message)))
+    assert "test/early/+" in mqtt_client._subscriptions
+    assert mqtt_client._router.dispatch("1", "test/early/pump")
+    assert received == [("test/early/pump", "1")]
+
+
+def test_concurrent_init_builds_one_client(monkeypatch):
+    broker = local_broker.start_in_thread()
+    for name, value in (("MQTT_BROKER", "127.0.0.1"), ("MQTT_PORT", broker.port), ("MQTT_USER", "u"),
+                        ("MQTT_PASSWORD", "p"), ("MQTT_TLS", False), ("MQTT_PERSISTENT_SESSION", True),
+                        ("MQTT_CLIENT_ID", None), ("SPOOL_ENABLED", False), ("PUBLISH_ASYNC", False)):
+        monkeypatch.setattr(config, name, value)
+    monkeypatch.setattr(mqtt_client, "client", None)
+    clients = []
+    threads = [threading.Thread(target=lambda role=role: clients.append(mqtt_client.init_mqtt(role=role)))
+               for role in ("device", "publisher") * 4]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    created = mqtt_client.client
+    try:
+        assert len({id(c) for c in clients}) == 1 and clients[0] is created
+    finally:
+        created.loop_stop()
+        created.disconnect()
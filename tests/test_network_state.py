@@ -0,0 +1,66 @@
+"""NetworkStateService event handling with stand-in nmcli output"""
+import queue
+import time
+
+from network.network_state import NetworkStateService
+
+DEVICES = "wlan0:wifi:connected:home\n"
+ACTIVE = "home:wlan0\n"
+
+
+class _Monitor:
+    """`nmcli monitor` stand-in: yields queued lines, None ends the stream"""
+
+    def __init__(self):
+        self.lines = queue.Queue()
+
+    @property
+    def stdout(self):
+        return iter(self.lines.get, None)
+
+    def terminate(self):
+        self.lines.put(None)
+
+
+def _service(monitors):
+    return NetworkStateService(monitor_factory=lambda: monitors.pop(0), snapshot_fn=lambda: (DEVICES, ACTIVE),
+                               debounce=30, resync_interval=60)  # no refresh undoes the events
+
+
+def _wait(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_state_with_detail_is_applied():
+    monitor = _Monitor()
+    service = _service([monitor])
+    service.start()
+    try:
+        monitor.lines.put("wlan0: disconnected")
+        _wait(lambda: service.wlan()[1] == "disconnected")
+        assert not service.is_client_wifi_connected()
+        monitor.lines.put("wlan0: connecting (configuring)")
+        _wait(lambda: service.wlan()[1] == "connecting (configuring)")
+        assert service.is_client_wifi_connected()
+        monitor.lines.put("wlan0: device removed")
+        monitor.lines.put("wlan0: connected (site only)")
+        assert service.wait_for_wlan_state("connected", timeout=5)
+    finally:
+        service.stop()
+
+
+def test_dead_monitor_is_restarted(monkeypatch):
+    monkeypatch.setattr("network.network_state.MONITOR_RESTART_MIN", 0.05)
+    first, second = _Monitor(), _Monitor()
+    service = _service([first, second])
+    service.start()
+    try:
+        first.lines.put(None)  # nmcli monitor exits
+        _wait(lambda: service.monitor_restarts == 1 and service.available)
+        second.lines.put("wlan0: disconnected")
+        _wait(lambda: service.events == 1)
+    finally:
+        service.stop()
@@ -0,0 +1,42 @@
+"""Pre-classifier tags in the text and binary payloads"""
+import pytest
+
+from data.records import make_record
+from mqtt.batch_assembler import SensorBatch
+from mqtt.payload import VERSION, VERSION_TAGGED, decode_binary, decoded_to_text, encode_binary, encode_text
+
+
+def _batch(tag=None, score=None):
+    records = [make_record("clean_water", ph=7.0, tds=120, turbidity=2, water_level=50)]
+    return SensorBatch([r.to_line() for r in records], records, 0.0, 0.0, tag=tag, score=score)
+
+
+def test_text_payload_carries_tag_and_score():
+    payload = encode_text("SN1", [_batch("suspect", 0.25)], [1000.0])
+    assert payload.splitlines()[1:3] == ["timestamp:1000.000", "precheck:suspect,score:0.250"]
+    assert "precheck" not in encode_text("SN1", [_batch()])
+
+
+def test_binary_payload_carries_tag_and_score():
+    decoded = decode_binary(encode_binary("SN1", [_batch("anomalous", 1.5), _batch()], [1000.0, 1001.0]))
+    assert decoded["version"] == VERSION_TAGGED
+    assert [(b["tag"], b["score"]) for b in decoded["batches"]] == [("anomalous", 1.5), (None, None)]
+    assert decoded["batches"][0]["records"][0].get("tds") == 120
+    assert "precheck:anomalous,score:1.500" in decoded_to_text(decoded)
+
+
+def test_untagged_binary_payload_stays_version_1():
+    decoded = decode_binary(encode_binary("SN1", [_batch()], [1000.0]))
+    assert decoded["version"] == VERSION
+    assert decoded["batches"][0]["tag"] is None
+
+
+def test_score_records_matches_score():
+    np = pytest.importorskip("numpy")
+    from data.preclassifier import PreClassifier
+    classifier = PreClassifier()
+    batch = _batch()
+    batch.records[0].values[1] = 450  # tds above the 0-300 band
+    stage_ids = np.array([r.stage_id for r in batch.records])
+    values = np.array([list(r.values) for r in batch.records])
+    assert classifier.score_records(stage_ids, values)[0] == pytest.approx(classifier.score(batch))
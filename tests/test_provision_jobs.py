@@ -0,0 +1,18 @@
+"""ProvisionJobManager worker tasks"""
+import logging
+
+import pytest
+
+from network.provision_jobs import ProvisionJobManager
+
+
+def test_failed_task_is_logged(caplog):
+    def switch_wifi():
+        raise RuntimeError("nmcli crashed")
+
+    manager = ProvisionJobManager()
+    with caplog.at_level(logging.ERROR, logger="network.provision_jobs"):
+        future = manager.run(switch_wifi)
+        with pytest.raises(RuntimeError):
+            future.result(timeout=5)
+    assert any("switch_wifi" in record.getMessage() and record.exc_info for record in caplog.records)
@@ -0,0 +1,99 @@
+"""PublishTracker against the local broker stand-in"""
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from mqtt import local_broker
+from mqtt.publish_queue import PublishTracker
+
+
+def _connected_client(broker, tracker):
+    c = mqtt.Client(client_id=f"tracker-test-{time.monotonic_ns()}")
+    c.on_publish = tracker.on_publish
+    c.connect("127.0.0.1", broker.port)
+    c.loop_start()
+    deadline = time.monotonic() + 5
+    while not c.is_connected():
+        assert time.monotonic() < deadline, "could not connect to the local broker"
+        time.sleep(0.01)
+    return c
+
+
+def test_qos1_publish_does_not_deadlock_with_on_publish():
+    # publish() used to hold the tracker lock across client.publish() while
+    # paho's thread held its message mutex and waited for the tracker lock
+    broker = local_broker.start_in_thread()
+    tracker = PublishTracker()
+    c = _connected_client(broker, tracker)
+    count = 2000
+    try:
+        def run():
+            for i in range(count):
+                tracker.publish(c, "test/tracker", f"message {i}", qos=1)
+
+        publisher = threading.Thread(target=run, daemon=True)
+        publisher.start()
+        publisher.join(timeout=30)
+        assert not publisher.is_alive(), "publisher stalled (deadlock)"
+
+        deadline = time.monotonic() + 10
+        while tracker.acked < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert tracker.acked == count
+        assert tracker.inflight == 0
+    finally:
+        c.loop_stop()
+        c.disconnect()
+
+
+def test_qos0_mids_are_not_kept_as_early_acks():
+    broker = local_broker.start_in_thread()
+    tracker = PublishTracker()
+    c = _connected_client(broker, tracker)
+    try:
+        for i in range(500):
+            tracker.publish(c, "test/tracker", f"message {i}", qos=0)
+        time.sleep(0.5)
+        assert not tracker._early
+    finally:
+        c.loop_stop()
+        c.disconnect()
+
+
+class _Info:
+    def __init__(self, mid):
+        self.mid = mid
+        self.rc = 0
+
+
+class _FakeClient:
+    def __init__(self):
+        self.mid = 0
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.mid += 1
+        return _Info(self.mid)
+
+
+def test_expire_runs_from_publish_without_a_pipeline():
+    tracker = PublishTracker(expire_after=0.05, expire_interval=0)
+    c = _FakeClient()
+    tracker.publish(c, "t", "lost in a disconnect", qos=1)
+    assert tracker.inflight == 1
+    time.sleep(0.1)
+    tracker.publish(c, "t", "next", qos=1)
+    assert tracker.expired == 1
+    assert tracker.inflight == 1
+
+
+def test_stale_early_ack_does_not_match_a_later_publish():
+    tracker = PublishTracker(expire_interval=0)
+    tracker._publishing = 1
+    tracker.on_publish(None, None, 1)
+    tracker._publishing = 0
+    tracker._early[1] -= PublishTracker.EARLY_MAX_AGE + 1
+    tracker.expire()
+    tracker.publish(_FakeClient(), "t", "after wraparound", qos=1)
+    assert tracker.acked == 0
+    assert tracker.inflight == 1
@@ -0,0 +1,23 @@
+"""SampleParser handling of bad lines and values"""
+import math
+
+from data.records import SampleParser
+
+
+def test_non_finite_value_keeps_the_record():
+    parser = SampleParser()
+    record = parser.parse("hydroponics_water,ph:6.2,tds:410,humidity:nan,ec:1.4")
+    assert record is not None
+    assert record.get("ph") == 6.2
+    assert record.get("humidity") is None
+    assert math.isnan(record.values[5])
+    assert parser.stats()["invalid_values"] == 1
+    assert parser.stats()["malformed"] == 0
+    assert parser.stats()["missing_fields"] == 0
+
+
+def test_repeated_field_is_malformed_even_after_nan():
+    parser = SampleParser()
+    assert parser.parse("clean_water,ph:nan,ph:7.0,tds:1,turbidity:1,water_level:1") is None
+    assert parser.parse("clean_water,ph:abc,tds:1") is None
+    assert parser.stats()["malformed"] == 2
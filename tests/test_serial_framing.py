@@ -0,0 +1,18 @@
+"""LineFramer chunking and overlong lines"""
+from mqtt.serial_framing import LineFramer
+
+
+def test_line_split_across_chunks():
+    framer, out = LineFramer(), []
+    framer.feed(b"clean_water,ph:7", out)
+    framer.feed(b".0\nP1 ON\n", out)
+    assert out == ["clean_water,ph:7.0"]
+
+
+def test_rest_of_overlong_line_is_not_framed():
+    framer, out = LineFramer(max_line_length=16), []
+    framer.feed(b"dirty_water,ph:6.1,tds:", out)   # over the limit, discarded
+    framer.feed(b"300,turbidity:4", out)           # still the same line
+    framer.feed(b",water_level:50\nclean_water,ph:7.0\n", out)
+    assert out == ["clean_water,ph:7.0"]
+    assert framer.bytes_discarded == len(b"dirty_water,ph:6.1,tds:300,turbidity:4,water_level:50\n")
@@ -0,0 +1,76 @@
+"""SerialManager full-duplex writer against a pty pair"""
+import os
+import select
+import threading
+import time
+
+import pytest
+
+from config import config
+from mqtt.serial_manager import SerialManager
+
+
+@pytest.fixture
+def full_duplex(monkeypatch):
+    master, slave = os.openpty()
+    monkeypatch.setattr(config, "SERIAL_PORT", os.ttyname(slave))
+    monkeypatch.setattr(config, "SERIAL_FULL_DUPLEX", True)
+    monkeypatch.setattr(config, "SERIAL_COMMAND_GAP", 0)
+    monkeypatch.setattr(config, "SERIAL_COMMAND_TIMEOUT", 0.2)
+    SerialManager._instance = None
+    manager = SerialManager()
+    assert manager.connected
+    yield manager, master
+    manager.close()
+    SerialManager._instance = None
+    os.close(master)
+    os.close(slave)
+
+
+def _read_written(master, wait=0.5):
+    data = b""
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        ready, _, _ = select.select([master], [], [], 0.05)
+        if ready:
+            data += os.read(master, 1024)
+    return data.decode().replace("\r", "")
+
+
+def test_timed_out_command_is_not_sent_later(full_duplex):
+    manager, master = full_duplex
+    manager._port_ready.clear()  # writer held, as during reconnect()
+    assert manager.write_command("P1=1") is False
+    manager._port_ready.set()
+    assert manager.write_command("P2=1") is True
+    assert _read_written(master) == "P2=1\n"
+
+
+def test_writer_waits_for_reconnect(full_duplex, monkeypatch):
+    manager, master = full_duplex
+    monkeypatch.setattr(config, "SERIAL_COMMAND_TIMEOUT", 5)
+    old_port = manager.ser
+    reconnecting = threading.Thread(target=manager.reconnect)
+    reconnecting.start()
+    time.sleep(0.2)  # old port closed, new one not open yet
+    assert manager.write_command("V1=0") is True
+    assert manager.ser is not old_port
+    reconnecting.join()
+    assert _read_written(master) == "V1=0\n"
+
+
+def test_read_batches_stops_while_waiting_for_port(monkeypatch):
+    monkeypatch.setattr(config, "SERIAL_PORT", "/dev/does-not-exist")
+    monkeypatch.setattr(config, "SERIAL_FULL_DUPLEX", False)
+    SerialManager._instance = None
+    manager = SerialManager()
+    try:
+        assert not manager.connected
+        stop = threading.Event()
+        threading.Timer(0.2, stop.set).start()
+        started = time.monotonic()
+        assert list(manager.read_batches(stop)) == []
+        assert time.monotonic() - started < 2
+    finally:
+        manager.close()
+        SerialManager._instance = None
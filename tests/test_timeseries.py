@@ -0,0 +1,48 @@
+"""TimeSeriesStore chunking across clock steps"""
+import time
+
+from data.records import make_record
+from data.timeseries import TimeSeriesStore
+
+
+def _record(ph):
+    return make_record("clean_water", ph=ph, tds=100, turbidity=1, water_level=50)
+
+
+def test_clock_going_backward_starts_a_new_chunk(tmp_path):
+    store = TimeSeriesStore(str(tmp_path / "history.db"), chunk_seconds=60)
+    try:
+        now = round(time.time())
+        store.append(_record(7.0), now)
+        store.append(_record(7.1), now + 5)
+        store.append(_record(7.2), now - 3600)   # NTP stepped the clock back an hour
+        store.append(_record(7.3), now - 3595)
+        store.append(_record(7.4), now + 86400 * 60)  # and then 60 days forward
+        store.flush()
+        stats = store.stats()
+        assert stats["chunks"] == 3
+        assert stats["records"] == 5
+        assert stats["buffered"] == 0
+        assert stats["records_dropped"] == 0
+        series = store.query("clean_water", fields=["ph"], start=now - 7200, end=now + 60, resolution="raw")
+        assert series["t"] == [now - 3600, now - 3595, now, now + 5]
+        assert series["fields"]["ph"] == [7.2, 7.3, 7.0, 7.1]
+    finally:
+        store.close()
+
+
+def test_unwritable_chunk_is_dropped_not_retried(tmp_path):
+    store = TimeSeriesStore(str(tmp_path / "history.db"), chunk_seconds=60)
+    try:
+        timestamps, _ = store._buffers[_record(7.0).stage_id]
+        store.append(_record(7.0), 1000.0)
+        timestamps.append(990.0)  # offsets would go negative
+        for column in store._buffers[_record(7.0).stage_id][1]:
+            column.append(1.0)
+        store.flush()
+        assert store.stats()["records_dropped"] == 2
+        store.append(_record(7.1), 2000.0)
+        store.flush()
+        assert store.stats()["records"] == 1
+    finally:
+        store.close()
@@ -0,0 +1,38 @@
+"""WifiScanner background policy"""
+import time
+
+from network.wifi_scan import AccessPoint, WifiScanner
+
+
+def _scanner(background):
+    calls = []
+
+    def scan(rescan):
+        calls.append(rescan)
+        return [AccessPoint("home", "00:00:00:00:00:00", 60.0, 2412, "WPA2")], "nmcli"
+
+    return WifiScanner(scan_fn=scan, interval=0.05, max_age=60, background=background), calls
+
+
+def test_no_background_scans_when_not_allowed():
+    scanner, calls = _scanner(lambda: False)
+    scanner.start()
+    try:
+        time.sleep(0.3)
+        assert calls == []
+        scanner.refresh_soon()  # an on-demand request still scans
+        time.sleep(0.2)
+        assert len(calls) == 1
+    finally:
+        scanner.stop()
+
+
+def test_hold_pauses_background_scans():
+    scanner, calls = _scanner(None)
+    with scanner.hold():
+        scanner.start()
+        time.sleep(0.2)
+        assert calls == []
+    time.sleep(0.2)
+    scanner.stop()
+    assert calls
@@ -0,0 +1,70 @@
+"""
+Latency Recorder - Small, thread-safe latency sample keeper
+Keeps the most recent samples in a bounded buffer and summarises them as
+percentiles so callers can confirm how fast a path really is on the Pi
+"""
+import threading
+from collections import deque
+
+
+def _pick(samples, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not samples:
+        return None
+    index = min(len(samples) - 1, max(0, round(pct / 100 * (len(samples) - 1))))
+    return samples[index]
+
+
+class LatencyRecorder:
+    """Bounded window of latency samples (in seconds) with percentile summaries"""
+
+    def __init__(self, maxlen=1024):
+        self._samples = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        """Add one latency sample, in seconds"""
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, pct):
+        """Return the pct-th percentile (0-100) of the recent window, or None if empty"""
+        with self._lock:
+            samples = sorted(self._samples)
+        return _pick(samples, pct)
+
+    def snapshot(self):
+        """
+        Summary of recorded latencies in milliseconds
+        Percentiles cover the recent window, count/mean/max cover all samples
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+            count, total, peak = self.count, self.total, self.max
+
+        def pick(pct):
+            value = _pick(samples, pct)
+            return round(value * 1000, 3) if value is not None else None
+
+        return {
+            "count": count,
+            "mean_ms": round(total / count * 1000, 3) if count else None,
+            "p50_ms": pick(50),
+            "p95_ms": pick(95),
+            "p99_ms": pick(99),
+            "max_ms": round(peak * 1000, 3) if count else None,
+        }
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self.count = 0
+            self.total = 0.0
+            self.max = 0.0
@@ -0,0 +1,251 @@
+"""
+Log - Leveled, rate-limited logging for the device services
+Thin layer over the standard logging module:
+- LOG_LEVEL picks what is emitted; per-message detail (every publish, every
+  incoming command) is DEBUG, so at INFO it costs one level check
+- each call site (file + line) gets a token bucket of LOG_RATE_BURST records
+  refilled at LOG_RATE per second; what it suppresses is counted and shown
+  as "(+N suppressed)" on the next record that gets through
+- extra=log.every(n) samples a call site: only 1 in n records is emitted
+- extra=log.fields(key=value, ...) attaches structured fields (appended as
+  key=value in text format, kept as an object with LOG_FORMAT=json)
+- LOG_ASYNC hands records to a bounded queue drained by a writer thread, so
+  the caller never blocks on stdout/journald; when the queue is full records
+  are dropped and counted instead
+
+Usage:
+    from utils import log
+    logger = log.get_logger(__name__)
+    logger.debug("Message published to %s: %s", topic, payload)
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+from config import config
+from utils import metrics
+
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+
+# Frames from the logging module itself are skipped when finding the call site
+_LOGGING_SOURCE = logging.addLevelName.__code__.co_filename
+
+_setup_lock = threading.Lock()
+_handler = None
+_listener = None
+_limiter = None
+
+
+def fields(**values):
+    """extra= for a record carrying structured key/value fields"""
+    return {"fields": values}
+
+
+def every(n, **values):
+    """extra= that samples the call site: 1 in n records is emitted"""
+    extra = {"sample_every": n}
+    if values:
+        extra["fields"] = values
+    return extra
+
+
+class RateLimiter:
+    """
+    Token bucket per call site
+    rate:  records per second a call site may sustain (0 disables limiting)
+    burst: records a quiet call site may emit back to back
+    """
+
+    def __init__(self, rate=1.0, burst=10):
+        self.rate = rate
+        self.burst = burst
+        self.suppressed = 0
+        self._sites = {}   # (filename, lineno) -> [tokens, last refill, suppressed, sampled]
+        self._lock = threading.Lock()
+
+    def allow(self, key, now, sample_every=1):
+        """None to drop the record, else how many were suppressed at this site since the last one"""
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None:
+                site = self._sites[key] = [float(self.burst), now, 0, 0]
+            if sample_every > 1:
+                site[3] += 1
+                if (site[3] - 1) % sample_every:
+                    site[2] += 1
+                    self.suppressed += 1
+                    return None
+            if self.rate:
+                site[0] = min(self.burst, site[0] + (now - site[1]) * self.rate)
+                site[1] = now
+                if site[0] < 1:
+                    site[2] += 1
+                    self.suppressed += 1
+                    return None
+                site[0] -= 1
+            suppressed, site[2] = site[2], 0
+            return suppressed
+
+
+class RateLimitedLogger(logging.Logger):
+    """
+    Logger that asks the call site's RateLimiter before building a record
+    Creating a LogRecord (caller lookup included) is the expensive part of a
+    log call, so suppressed calls skip it entirely.
+    """
+    limiter = None   # set by setup(); a logger may carry its own
+
+    def _log(self, level, msg, args, exc_info=None, extra=None, stack_info=False, stacklevel=1):
+        limiter = self.limiter
+        if limiter is not None:
+            sample_every = extra.get("sample_every", 1) if extra else 1
+            if limiter.rate or sample_every > 1:
+                frame = sys._getframe(2)
+                while frame is not None and frame.f_code.co_filename == _LOGGING_SOURCE:
+                    frame = frame.f_back
+                key = (frame.f_code.co_filename, frame.f_lineno) if frame is not None else None
+                suppressed = limiter.allow(key, time.monotonic(), sample_every)
+                if suppressed is None:
+                    return
+                if suppressed:
+                    extra = {**extra, "suppressed": suppressed} if extra else {"suppressed": suppressed}
+        super()._log(level, msg, args, exc_info, extra, stack_info, stacklevel)
+
+
+class TextFormatter(logging.Formatter):
+    """TEXT_FORMAT plus key=value fields and the suppressed count"""
+
+    def format(self, record):
+        line = super().format(record)
+        extra = getattr(record, "fields", None)
+        if extra:
+            line += " " + " ".join(f"{key}={value}" for key, value in extra.items())
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            line += f" (+{suppressed} suppressed)"
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        extra = getattr(record, "fields", None)
+        if extra:
+            entry["fields"] = extra
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that never blocks: a full queue drops the record
+    Formatting is left to the writer thread, so the caller only pays for
+    creating the record; arguments must not be mutated after the call.
+    """
+
+    def __init__(self, maxsize=1000):
+        super().__init__(queue.Queue(maxsize=maxsize))
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class DrainingQueueListener(logging.handlers.QueueListener):
+    """QueueListener whose stop() waits for room in a full queue instead of raising"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+def setup(level=None, fmt=None, async_=None, queue_size=None, rate=None, burst=None, stream=None):
+    """
+    Configure the root logger once (later calls are no-ops); arguments
+    default to the LOG_* settings in config
+    """
+    global _handler, _listener, _limiter
+    with _setup_lock:
+        if _handler is not None:
+            return
+        level = level or config.LOG_LEVEL
+        fmt = fmt or config.LOG_FORMAT
+        async_ = config.LOG_ASYNC if async_ is None else async_
+        rate = config.LOG_RATE if rate is None else rate
+        burst = config.LOG_RATE_BURST if burst is None else burst
+
+        writer = logging.StreamHandler(stream or sys.stdout)
+        writer.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter(TEXT_FORMAT))
+        _limiter = RateLimitedLogger.limiter = RateLimiter(rate, burst)
+        logging.setLoggerClass(RateLimitedLogger)
+        if async_:
+            _handler = BoundedQueueHandler(queue_size or config.LOG_QUEUE_SIZE)
+            _listener = DrainingQueueListener(_handler.queue, writer)
+            _listener.start()
+            atexit.register(shutdown)
+        else:
+            _handler = writer
+
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(_handler)
+        root.setLevel(level.upper() if isinstance(level, str) else level)
+
+
+def get_logger(name):
+    """logging.getLogger(name) (a RateLimitedLogger), configuring logging on first use"""
+    if _handler is None:
+        setup()
+    return logging.getLogger(name)
+
+
+def shutdown():
+    """Flush the async queue (called at exit)"""
+    global _listener
+    if _listener is not None:
+        listener, _listener = _listener, None
+        listener.stop()
+
+
+def stats():
+    return {
+        "suppressed": _limiter.suppressed if _limiter is not None else 0,
+        "dropped": getattr(_handler, "dropped", 0),
+        "queued": _handler.queue.qsize() if isinstance(_handler, BoundedQueueHandler) else 0,
+    }
+
+
+def _collect_log():
+    counts = stats()
+    return [
+        ("log_records_suppressed_total", "counter", "Log records held back by rate limiting or sampling",
+         [({}, counts["suppressed"])]),
+        ("log_records_dropped_total", "counter", "Log records dropped because the async queue was full",
+         [({}, counts["dropped"])]),
+        ("log_queue_depth", "gauge", "Log records waiting for the writer thread", [({}, counts["queued"])]),
+    ]
+
+
+metrics.register_collector(_collect_log)
@@ -0,0 +1,288 @@
+"""
+Metrics - Small Prometheus-style metrics registry
+Counters, gauges and fixed-bucket histograms cheap enough for hot paths
+(one lock and a few additions per call), plus collectors that turn the
+stats() dictionaries and LatencyRecorders already kept by each component
+into metrics at scrape time. render() produces the Prometheus text format;
+start_http_server() serves it on /metrics.
+"""
+import bisect
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; covers sub-millisecond lock waits up to multi-second nmcli calls
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_value(value):
+    if value is None:
+        return "NaN"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+class _Metric:
+    """Base for labelled metrics: .labels(*values) returns a cached child"""
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        return type(self)(self.name, self.help)
+
+    def _series(self):
+        """[(labels dict, child)] for this metric"""
+        if self.labelnames:
+            return [(dict(zip(self.labelnames, values)), child) for values, child in list(self._children.items())]
+        return [({}, self)]
+
+
+class Counter(_Metric):
+    """Monotonic count; name it with a _total suffix"""
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        return [(self.name, labels, child.value) for labels, child in self._series()]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def samples(self):
+        return [(self.name, labels, child.value) for labels, child in self._series()]
+
+
+class _Timer:
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+        return False
+
+
+class Histogram(_Metric):
+    """Fixed buckets; observe() is a bisect plus three additions under a lock"""
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # last slot: +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def _new_child(self):
+        return Histogram(self.name, self.help, buckets=self.buckets)
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        """with histogram.time(): ... observes the block's duration in seconds"""
+        return _Timer(self)
+
+    def samples(self):
+        out = []
+        for labels, child in self._series():
+            with child._lock:
+                counts, total, count = list(child._counts), child.sum, child.count
+            cumulative = 0
+            for bound, bucket_count in zip(child.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                out.append((self.name + "_bucket", {**labels, "le": _format_value(float(bound))}, cumulative))
+            out.append((self.name + "_sum", labels, total))
+            out.append((self.name + "_count", labels, count))
+        return out
+
+
+class Registry:
+    """Named metrics plus collectors evaluated at scrape time"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = []
+
+    def _get_or_create(self, cls, name, help_text, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, labelnames, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} already registered as {metric.kind}")
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._get_or_create(Counter, name, help_text, labelnames)
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._get_or_create(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def register_collector(self, collector):
+        """
+        collector() returns an iterable of (name, kind, help, [(labels dict, value), ...]);
+        kind is "counter", "gauge" or "summary". Exceptions skip that collector.
+        """
+        with self._lock:
+            if collector not in self._collectors:
+                self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for collector in collectors:
+            try:
+                families = list(collector())
+            except Exception as e:
+                lines.append(f"# collector {getattr(collector, '__name__', collector)} failed: {e}")
+                continue
+            for name, kind, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    labels = dict(labels)
+                    sample_name = labels.pop("__name__", name)
+                    lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def latency_family(name, help_text, recorder, labels=None):
+    """
+    A collector family for a utils.latency.LatencyRecorder as a Prometheus
+    summary in seconds (quantiles over the recorder's recent window)
+    """
+    labels = labels or {}
+    samples = [({**labels, "quantile": str(q)}, recorder.percentile(q * 100)) for q in (0.5, 0.95, 0.99)]
+    samples.append(({**labels, "__name__": name + "_sum"}, recorder.total))
+    samples.append(({**labels, "__name__": name + "_count"}, recorder.count))
+    return name, "summary", help_text, samples
+
+
+def stats_families(prefix, stats, kinds=None, help_prefix=""):
+    """
+    Collector families for a flat stats() dict of numbers
+    kinds: {key: "counter" | "gauge"}; keys not listed are gauges. Counters
+    get a _total suffix. Nested dicts and non-numeric values are skipped.
+    """
+    kinds = kinds or {}
+    families = []
+    for key, value in stats.items():
+        if not isinstance(value, (int, float)):
+            continue
+        kind = kinds.get(key, "gauge")
+        name = f"{prefix}_{key}" + ("_total" if kind == "counter" else "")
+        families.append((name, kind, f"{help_prefix}{key.replace('_', ' ')}", [({}, value)]))
+    return families
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+register_collector = REGISTRY.register_collector
+render = REGISTRY.render
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes every few seconds would flood the console
+
+
+def start_http_server(port, host="127.0.0.1"):
+    """Serve /metrics from a daemon thread; returns the server (None if the port is taken)"""
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        print(f"⚠ Metrics endpoint not started on port {port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="Metrics-HTTP").start()
+    print(f"✓ Metrics on http://{host}:{port}/metrics")
+    return server